@@ -0,0 +1,244 @@
+"""Batch mode for the analysis stage, for scans where cost and throughput matter more than latency.
+
+Instead of one chat call per market, the analysis prompts are written to a JSONL file and
+submitted as a single batch job, which providers run at a discount and outside the per-minute
+quotas. The job is polled until it finishes and every result is parsed and stored in the
+prediction cache under the key `prediction_pipeline.create_prediction_from_report` would use,
+so later interactive runs pick the predictions up as cache hits.
+
+Each line of a batch file is:
+  {"key": condition_id, "cache_key": prediction cache key, "request": GenerateContentRequest}
+
+A provider has `submit(path, model) -> job id`, `poll(job_id) -> state` and `results(job_id)`,
+which yields (key, text, usage, error) per request of a finished job: `usage` is an
+(input_tokens, output_tokens) tuple or None, and `error` is None on success. A job moves through
+the states pending, running and one of `FINISHED_STATES`. `GeminiBatchProvider` talks to the
+Gemini Batch API. Point it at a `fake_batch_server.FakeBatchServer` to run the whole path locally.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import cache_keys
+import http_client
+import prediction_pipeline
+import prompts
+
+# Batch files are written here, one per job. Keep it apart from the repo's own JSONL files.
+DEFAULT_BATCH_DIR = "batches"
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_DOWNLOAD_URL = "https://generativelanguage.googleapis.com/download/v1beta"
+FINISHED_STATES = ("succeeded", "failed", "cancelled", "expired")
+
+def analysis_request(report, market_description):
+  """Returns the GenerateContentRequest of one market's analysis, as sent by the chat path."""
+  report = prediction_pipeline.compact_report(report, market_description)
+  return {
+    "contents": [{"role": "user", "parts": [{"text": prompts.prediction_content_template(report, market_description)}]}],
+    "system_instruction": {"parts": [{"text": prompts.prediction_system_prompt}]},
+    "generation_config": prediction_pipeline.ANALYSIS_CONFIG,
+  }
+
+def write_batch_file(path, lines):
+  """Writes batch lines (dicts with `key`, `cache_key` and `request`) to a JSONL file.
+
+  Returns:
+      int: The number of lines written."""
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  count = 0
+  with open(path, 'w') as f:
+    for line in lines:
+      f.write(json.dumps(line) + "\n")
+      count += 1
+  return count
+
+def read_batch_file(path):
+  with open(path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+def _response_text(response):
+  """Joins the text parts of a GenerateContentResponse's first candidate, skipping thoughts."""
+  candidates = response.get("candidates") or []
+  if not candidates:
+    return ""
+  parts = candidates[0].get("content", {}).get("parts", [])
+  return "".join(part.get("text", "") for part in parts if not part.get("thought"))
+
+def _response_usage(response):
+  usage = response.get("usageMetadata")
+  if not usage:
+    return None
+  return usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0)
+
+class GeminiBatchProvider:
+  """Gemini Batch API. Requests are sent inline, which covers files of up to about 20 MB.
+
+  Args:
+      api_key (str): Gemini API key.
+      client (HttpClient): Client used for every call."""
+
+  def __init__(self, api_key, client=None, base_url=GEMINI_API_URL, download_url=GEMINI_DOWNLOAD_URL):
+    self.api_key = api_key
+    self.client = client or http_client.default_client
+    self.base_url = base_url
+    self.download_url = download_url
+
+  def _headers(self):
+    return {"x-goog-api-key": self.api_key, "Content-Type": "application/json"}
+
+  def submit(self, path, model):
+    requests = [{"request": line["request"], "metadata": {"key": line["key"]}} for line in read_batch_file(path)]
+    body = {"batch": {
+      "display_name": os.path.basename(path),
+      "input_config": {"requests": {"requests": requests}},
+    }}
+    response = self.client.post(f"{self.base_url}/models/{model}:batchGenerateContent",
+                                json=body, headers=self._headers())
+    return response.json()["name"]
+
+  def _operation(self, job_id):
+    return self.client.get(f"{self.base_url}/{job_id}", headers=self._headers()).json()
+
+  def poll(self, job_id):
+    state = self._operation(job_id).get("metadata", {}).get("state", "BATCH_STATE_PENDING")
+    return state.replace("BATCH_STATE_", "").lower()
+
+  def results(self, job_id):
+    output = self._operation(job_id).get("response", {})
+    if "responsesFile" in output:
+      text = self.client.get(f"{self.download_url}/{output['responsesFile']}:download",
+                             params={"alt": "media"}, headers=self._headers()).text
+      entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+      entries = [dict(entry, key=entry.get("metadata", {}).get("key"))
+                 for entry in output.get("inlinedResponses", {}).get("inlinedResponses", [])]
+    for entry in entries:
+      if "error" in entry:
+        yield entry["key"], None, None, entry["error"].get("message", str(entry["error"]))
+      else:
+        yield entry["key"], _response_text(entry["response"]), _response_usage(entry["response"]), None
+
+def _create_reports(market_descriptions, cache, max_concurrency, report_groups, reuse_index, refresh_reused):
+  """Yields (key, report) as reports finish, sharing event reports like `create_predictions`."""
+  with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="report") as pool:
+    futures = {}
+    grouped = set()
+    for event_description, keys in (report_groups or {}).values():
+      members = [key for key in keys if key in market_descriptions and key not in grouped]
+      if members:
+        grouped.update(members)
+        futures[pool.submit(prediction_pipeline.create_event_report, event_description, cache=cache)] = members
+    for key, market_description in market_descriptions.items():
+      if key not in grouped:
+        futures[pool.submit(prediction_pipeline.create_report, market_description, cache=cache,
+                            reuse_index=reuse_index, refresh_reused=refresh_reused)] = [key]
+    for future in as_completed(futures):
+      try:
+        report = future.result()
+      except Exception as e:
+        print(f"Error: report stage failed for {futures[future]}: {e}")
+        continue
+      for key in futures[future]:
+        yield key, report
+
+def submit_batch(market_descriptions, provider, cache=None, batch_dir=DEFAULT_BATCH_DIR, max_concurrency=8,
+                 report_groups=None, reuse_index=None, refresh_reused=False):
+  """Writes the reports of many markets and submits their analyses as one batch job.
+
+  Args:
+      market_descriptions (dict): Maps condition_id to market description.
+      provider: Batch API to submit to, e.g. a `GeminiBatchProvider`.
+      cache: Cache of the reports and predictions, as in `create_predictions`.
+      batch_dir (str): Directory of the batch files.
+      max_concurrency (int): Concurrent report calls.
+      report_groups, reuse_index, refresh_reused: See `prediction_pipeline.create_predictions`.
+
+  Returns:
+      tuple: (job id or None if nothing was submitted, batch file path, dict of condition_id
+        to the predictions that were already cached)"""
+  cached = {}
+  lines = []
+  for key, report in _create_reports(market_descriptions, cache, max_concurrency, report_groups,
+                                     reuse_index, refresh_reused):
+    market_description = market_descriptions[key]
+    cache_key = cache_keys.make_key(
+      "prediction", prediction_pipeline.PREDICTION_CACHE_VERSION, report, market_description)
+    prediction = cache.get(cache_key) if cache else None
+    if prediction:
+      cached[key] = prediction
+      continue
+    lines.append({"key": key, "cache_key": cache_key, "request": analysis_request(report, market_description)})
+
+  path = os.path.join(batch_dir, f"analysis-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl")
+  if not lines:
+    print(f"All {len(cached)} predictions were cached, nothing to submit")
+    return None, path, cached
+  write_batch_file(path, lines)
+  job_id = provider.submit(path, prediction_pipeline.ANALYSIS_MODEL)
+  print(f"Submitted {len(lines)} analyses as batch job {job_id} ({path}), {len(cached)} were cached")
+  return job_id, path, cached
+
+def wait_for_batch(provider, job_id, poll_seconds=60, timeout_hours=24):
+  """Polls a job until it finishes. Returns its final state, or the last state on timeout."""
+  deadline = time.monotonic() + timeout_hours * 3600
+  state = provider.poll(job_id)
+  while state not in FINISHED_STATES and time.monotonic() < deadline:
+    time.sleep(poll_seconds)
+    state = provider.poll(job_id)
+  print(f"Batch job {job_id}: {state}")
+  return state
+
+def load_batch_results(provider, job_id, path, cache=None):
+  """Parses the results of a finished job and stores them in the prediction cache.
+
+  Args:
+      path (str): The job's batch file, which maps each condition_id to its cache key.
+
+  Returns:
+      dict: condition_id to prediction for every result that parsed."""
+  cache_keys_by_key = {line["key"]: line["cache_key"] for line in read_batch_file(path)}
+  predictions = {}
+  input_tokens = output_tokens = 0
+  for key, text, usage, error in provider.results(job_id):
+    if error is not None:
+      print(f"Error: batch analysis failed for {key}: {error}")
+      continue
+    if usage:
+      input_tokens += usage[0]
+      output_tokens += usage[1]
+    prediction = prediction_pipeline.clean_parse_raw_prediction(text)
+    if not prediction:
+      continue
+    predictions[key] = prediction
+    if cache and key in cache_keys_by_key:
+      cache.set(cache_keys_by_key[key], prediction)
+  if input_tokens or output_tokens:
+    cost = prediction_pipeline.scheduler.record_batch(
+      "gemini", prediction_pipeline.ANALYSIS_MODEL, input_tokens, output_tokens)
+    print(f"Batch job {job_id} used {input_tokens} input and {output_tokens} output tokens (${cost:.2f})")
+  return predictions
+
+def create_batch_predictions(market_descriptions, provider, cache=None, batch_dir=DEFAULT_BATCH_DIR,
+                             max_concurrency=8, poll_seconds=60, timeout_hours=24, report_groups=None,
+                             reuse_index=None, refresh_reused=False):
+  """Creates predictions for many markets with one batch job for the analyses.
+
+  Reports are written as usual, then `submit_batch`, `wait_for_batch` and `load_batch_results`
+  run in turn. If the process stops while the job runs, call `wait_for_batch` and
+  `load_batch_results` with the printed job id and batch file to collect it.
+
+  Returns:
+      dict: condition_id to prediction, cached ones included."""
+  job_id, path, predictions = submit_batch(
+    market_descriptions, provider, cache=cache, batch_dir=batch_dir, max_concurrency=max_concurrency,
+    report_groups=report_groups, reuse_index=reuse_index, refresh_reused=refresh_reused)
+  if job_id is None:
+    return predictions
+  state = wait_for_batch(provider, job_id, poll_seconds=poll_seconds, timeout_hours=timeout_hours)
+  if state != "succeeded":
+    print(f"Error: batch job {job_id} is {state}, no new predictions loaded")
+    return predictions
+  predictions.update(load_batch_results(provider, job_id, path, cache=cache))
+  return predictions
@@ -0,0 +1,39 @@
+"""Structured cache keys for the prediction pipeline.
+
+A key has the form `<namespace>/<version>/<digest>`:
+  - namespace: the pipeline stage, e.g. "report" or "prediction".
+  - version: a fingerprint of everything that shapes the stage's output besides its inputs,
+    i.e. the model name, the generation config and the prompt text.
+  - digest: a hash of the stage inputs.
+
+Changing a prompt or model changes only that stage's version, so the other stages keep their
+warm cache entries. Entries of old versions are never served and can be deleted per namespace.
+"""
+import hashlib
+import json
+
+def fingerprint(*parts, length=16):
+  """Returns a short, stable hex digest of JSON-serializable parts."""
+  serialized = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+  return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:length]
+
+def stage_version(schema, model, config, *prompts):
+  """Returns the version fingerprint of a pipeline stage.
+
+  Args:
+      schema (int): Bumped by hand when the stage's code changes the shape of its output.
+      model (str): Model name(s) used by the stage.
+      config (dict): Generation config sent with the request.
+      *prompts (str): Prompt text. Pass templates rendered with placeholder arguments."""
+  return fingerprint(schema, model, config, *prompts, length=12)
+
+def make_key(namespace, version, *inputs):
+  """Returns the cache key for a stage's inputs."""
+  return f"{namespace}/{version}/{fingerprint(*inputs, length=64)}"
+
+def parse_key(key):
+  """Returns (namespace, version) of a structured key, or (None, None) for any other key."""
+  parts = key.split('/')
+  if len(parts) != 3:
+    return None, None
+  return parts[0], parts[1]
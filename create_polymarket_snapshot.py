@@ -3,8 +3,9 @@ import dotenv
 import os
 import pickle
 import py_clob_client
-import requests
 import prediction_pipeline
+import orderbooks
+import pagination
 from datetime import datetime, timedelta, timezone
 from py_clob_client.constants import POLYGON
 from py_clob_client.client import ClobClient
@@ -20,72 +21,18 @@ def fetch_all_events_from_gamma():
   """
   Fetch all events from Gamma API.
   """
-  events = []
-  offset = 0
-  limit = 100  # Max results per page
-  
-  while True:
-    url = "https://gamma-api.polymarket.com/events"
-    params = {
-      "closed": "false",
-      "active": "true",
-      "limit": limit,
-      "offset": offset,
-      "order": "createdAt",
-      "ascending": "false"
-    }
-    
-    response = requests.get(url, params=params)
-    if response.status_code != 200:
-      print(f"Error fetching events: {response.status_code}")
-      break
-        
-    batch = response.json()
-    if not batch:  # No more results
-      break
-        
-    events.extend(batch)
-    offset += limit
-      
-  return events
+  return pagination.fetch_all_gamma_events()
 
 def fetch_all_markets(client):
   """
   Fetch all markets from CLOB, iterating through all possible pages.
   """
-  markets = []
-  next_cursor = ""
-
-  while True:
-    response = client.get_markets(next_cursor=next_cursor)
-    if not response or 'data' not in response:
-      break
-    markets.extend(response['data'])
-
-    next_cursor = response.get('next_cursor', '')
-    if next_cursor == 'LTE=' or not next_cursor:
-      break
-
-  return markets
+  return pagination.fetch_all_clob_markets(client)
 
 def fetch_all_active_orderbooks(client, markets):
-  # Fetch and attach order books for each market
-  # (We can do this unconditionally, or add a check if you want to separately pickle the order-book-fetched markets)
-  order_books = {}
-  for _, market in markets.items():
-    if not market['active'] or market['closed']:
-      continue
-
-    tokens = market.get('tokens', [])
-    for token in tokens:
-      token_id = token.get('token_id', None)
-      if token_id:
-        try:
-          order_book = client.get_order_book(token_id)
-        except py_clob_client.exceptions.PolyApiException as e:
-          print(f"Error fetching order book for token {token_id}: {e}")
-          continue
-        order_books[token_id] = order_book
+  # Fetch the order books of every token in the active, non-closed markets concurrently.
+  token_ids = orderbooks.market_token_ids(markets, active_only=True)
+  return orderbooks.fetch_order_books(client, token_ids)
 
 def main():
   # Create the client
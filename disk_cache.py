@@ -1,8 +1,22 @@
 import os
 import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 import hashlib
 
+import cache_keys
+
+def _matches(key, namespace, version, keep_version):
+    key_namespace, key_version = cache_keys.parse_key(key)
+    return (key_namespace == namespace
+            and (version is None or key_version == version)
+            and (keep_version is None or key_version != keep_version))
+
+
 class DiskCache:
     def __init__(self, cache_dir="api_cache", expiry_hours=24):
         self.cache_dir = cache_dir
@@ -40,7 +54,377 @@ class DiskCache:
             with open(cache_path, 'wb') as f:
                 pickle.dump({
                     'timestamp': datetime.now(),
+                    'key': key,
                     'data': data
                 }, f)
         except (pickle.PickleError, IOError) as e:
-            print(f"Cache write error: {e}")
\ No newline at end of file
+            print(f"Cache write error: {e}")
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, or calls compute() and caches its result.
+
+        Empty results are treated as misses and recomputed on the next call."""
+        data = self.get(key)
+        if data:
+            return data
+        data = compute()
+        self.set(key, data)
+        return data
+
+    def invalidate(self, namespace, version=None, keep_version=None):
+        """Deletes entries with structured keys (see cache_keys) in the given namespace.
+
+        Args:
+            namespace (str): The namespace to clear.
+            version (str): Only delete entries of this version.
+            keep_version (str): Keep entries of this version, e.g. the current one.
+
+        Returns:
+            int: The number of deleted entries."""
+        deleted = 0
+        for filename in os.listdir(self.cache_dir):
+            cache_path = os.path.join(self.cache_dir, filename)
+            try:
+                with open(cache_path, 'rb') as f:
+                    key = pickle.load(f).get('key')
+            except (pickle.PickleError, EOFError, AttributeError, IOError):
+                continue
+            if key is None:
+                continue
+            if _matches(key, namespace, version, keep_version):
+                os.remove(cache_path)
+                deleted += 1
+        return deleted
+
+
+class SQLiteCache:
+    """Single-file cache with the same get/set API as DiskCache.
+
+    Entries live in one SQLite database in WAL mode, so several threads and worker processes
+    can read and write it at once. Expired entries are deleted by a background sweeper, and
+    the least recently used entries are evicted once `max_entries` or `max_bytes` is exceeded.
+    Writes keep running totals of the entries and their bytes, so a write only scans the table
+    when it pushes the totals over a cap. The sweeper also evicts what other processes wrote.
+    """
+
+    # Last-access times are only rewritten when older than this, to keep reads cheap.
+    ACCESS_RESOLUTION_SECONDS = 60
+
+    def __init__(self, path="api_cache.sqlite", expiry_hours=24, max_entries=None,
+                 max_bytes=None, sweep_interval_seconds=300):
+        self.path = path
+        self.expiry_seconds = expiry_hours * 3600
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._totals_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    namespace TEXT,
+                    version TEXT
+                )""")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+            if "namespace" not in columns:
+                conn.execute("ALTER TABLE entries ADD COLUMN namespace TEXT")
+                conn.execute("ALTER TABLE entries ADD COLUMN version TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace, version)")
+            self._count, self._bytes = self._totals(conn)
+
+        self._stop_sweeper = threading.Event()
+        self._sweeper = None
+        if sweep_interval_seconds:
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, args=(sweep_interval_seconds,), daemon=True,
+                name="cache-sweeper")
+            self._sweeper.start()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, so each thread opens its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _hash_key(self, key):
+        # Same hashing as DiskCache, so its files can be imported with their keys intact.
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        hashed_key = self._hash_key(key)
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, created_at, accessed_at FROM entries WHERE key = ?",
+            (hashed_key,)).fetchone()
+        if row is None:
+            return None
+
+        value, created_at, accessed_at = row
+        now = time.time()
+        if now - created_at > self.expiry_seconds:
+            return None
+        try:
+            data = pickle.loads(value)
+        except (pickle.PickleError, EOFError):
+            # Handle corrupted entries
+            with conn:
+                conn.execute("DELETE FROM entries WHERE key = ?", (hashed_key,))
+            return None
+
+        if now - accessed_at > self.ACCESS_RESOLUTION_SECONDS:
+            with conn:
+                conn.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, hashed_key))
+        return data
+
+    def set(self, key, data):
+        try:
+            value = pickle.dumps(data)
+            now = time.time()
+            namespace, version = cache_keys.parse_key(key)
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self._hash_key(key), value, now, now, len(value), namespace, version))
+            with self._totals_lock:
+                # A replaced entry is counted twice until the next eviction recounts.
+                self._count += 1
+                self._bytes += len(value)
+                over_cap = ((self.max_entries is not None and self._count > self.max_entries)
+                            or (self.max_bytes is not None and self._bytes > self.max_bytes))
+            if over_cap:
+                self.evict()
+        except (pickle.PickleError, sqlite3.Error) as e:
+            print(f"Cache write error: {e}")
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, or calls compute() and caches its result.
+
+        Empty results are treated as misses and recomputed on the next call."""
+        data = self.get(key)
+        if data:
+            return data
+        data = compute()
+        self.set(key, data)
+        return data
+
+    def sweep(self):
+        """Deletes expired entries and returns how many were removed."""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM entries WHERE created_at < ?", (time.time() - self.expiry_seconds,))
+        return cursor.rowcount
+
+    def invalidate(self, namespace, version=None, keep_version=None):
+        """Deletes entries with structured keys (see cache_keys) in the given namespace.
+
+        Args:
+            namespace (str): The namespace to clear.
+            version (str): Only delete entries of this version.
+            keep_version (str): Keep entries of this version, e.g. the current one.
+
+        Returns:
+            int: The number of deleted entries."""
+        query = "DELETE FROM entries WHERE namespace = ?"
+        params = [namespace]
+        if version is not None:
+            query += " AND version = ?"
+            params.append(version)
+        if keep_version is not None:
+            query += " AND version != ?"
+            params.append(keep_version)
+        with self._connection() as conn:
+            cursor = conn.execute(query, params)
+        return cursor.rowcount
+
+    def _totals(self, conn):
+        return conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+    def evict(self):
+        """Deletes least recently used entries until the size caps are met."""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        with self._connection() as conn:
+            count, total_bytes = self._totals(conn)
+            if self.max_entries is not None and count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,))
+            if self.max_bytes is not None and total_bytes > self.max_bytes:
+                # Walk from the oldest access until enough bytes are freed.
+                excess = total_bytes - self.max_bytes
+                keys = []
+                for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+                    if excess <= 0:
+                        break
+                    keys.append((key,))
+                    excess -= size
+                conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            totals = self._totals(conn)
+        with self._totals_lock:
+            self._count, self._bytes = totals
+
+    def _sweep_loop(self, interval_seconds):
+        while not self._stop_sweeper.wait(interval_seconds):
+            try:
+                self.sweep()
+                self.evict()
+            except sqlite3.Error as e:
+                print(f"Cache sweep error: {e}")
+
+    def close(self):
+        """Stops the sweeper thread and closes this thread's connection."""
+        self._stop_sweeper.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def import_disk_cache(self, cache_dir="api_cache"):
+        """Copies the unexpired entries of a DiskCache directory into this cache.
+
+        Returns:
+            int: The number of imported entries."""
+        rows = []
+        for filename in os.listdir(cache_dir):
+            if not filename.endswith(".pkl"):
+                continue
+            try:
+                with open(os.path.join(cache_dir, filename), 'rb') as f:
+                    cached_data = pickle.load(f)
+                created_at = cached_data['timestamp'].timestamp()
+                value = pickle.dumps(cached_data['data'])
+            except (pickle.PickleError, EOFError, KeyError, AttributeError):
+                continue
+            if time.time() - created_at > self.expiry_seconds:
+                continue
+            namespace, version = cache_keys.parse_key(cached_data.get('key', ''))
+            rows.append((filename[:-len(".pkl")], value, created_at, created_at, len(value),
+                         namespace, version))
+        with self._connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.evict()
+        return len(rows)
+
+
+class TieredCache:
+    """Bounded in-process LRU in front of a DiskCache or SQLiteCache, with single-flight misses.
+
+    Concurrent `get_or_compute` calls for the same key share one upstream computation: the
+    first caller computes and the others wait for its result. Hit and miss counts are kept
+    per tier in `stats`.
+    """
+
+    def __init__(self, backend, max_items=1024, memory_expiry_seconds=3600):
+        self.backend = backend
+        self.max_items = max_items
+        self.memory_expiry_seconds = memory_expiry_seconds
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'memory_misses': 0,
+            'disk_hits': 0,
+            'disk_misses': 0,
+            'coalesced': 0,
+            'computed': 0,
+        }
+
+    def _get_memory(self, key):
+        # Must be called with the lock held.
+        entry = self._memory.get(key)
+        if entry is not None and time.time() - entry[0] <= self.memory_expiry_seconds:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return entry[1]
+        if entry is not None:
+            del self._memory[key]
+        self.stats['memory_misses'] += 1
+        return None
+
+    def _set_memory(self, key, data):
+        with self._lock:
+            self._memory[key] = (time.time(), data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _get_disk(self, key):
+        data = self.backend.get(key)
+        with self._lock:
+            self.stats['disk_hits' if data else 'disk_misses'] += 1
+        if data:
+            self._set_memory(key, data)
+        return data
+
+    def get(self, key):
+        with self._lock:
+            data = self._get_memory(key)
+        if data:
+            return data
+        return self._get_disk(key)
+
+    def set(self, key, data):
+        self._set_memory(key, data)
+        self.backend.set(key, data)
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, or calls compute() once across concurrent callers.
+
+        Empty results are returned to every waiting caller but not cached."""
+        with self._lock:
+            data = self._get_memory(key)
+            if data:
+                return data
+            waiting_on = self._in_flight.get(key)
+            if waiting_on is not None:
+                self.stats['coalesced'] += 1
+            else:
+                future = Future()
+                self._in_flight[key] = future
+        if waiting_on is not None:
+            return waiting_on.result()
+
+        try:
+            data = self._get_disk(key)
+            if not data:
+                with self._lock:
+                    self.stats['computed'] += 1
+                data = compute()
+                if data:
+                    self.set(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def invalidate(self, namespace, version=None, keep_version=None):
+        """Deletes entries in the given namespace from both tiers. See SQLiteCache.invalidate."""
+        with self._lock:
+            for key in [k for k in self._memory if _matches(k, namespace, version, keep_version)]:
+                del self._memory[key]
+        return self.backend.invalidate(namespace, version=version, keep_version=keep_version)
+
+    def invalidate_memory(self):
+        """Drops every entry from the in-process tier."""
+        with self._lock:
+            self._memory.clear()
@@ -0,0 +1,175 @@
+"""Local HTTP server that speaks the parts of the Gemini Batch API `batch_predictions` uses.
+
+Used to run `batch_predictions.GeminiBatchProvider` without a provider:
+
+  server = fake_batch_server.FakeBatchServer(respond).start()
+  provider = batch_predictions.GeminiBatchProvider(
+    "test-key", base_url=server.api_url, download_url=server.download_url)
+
+`respond(request)` is called with each GenerateContentRequest of a job and returns the
+response text. An exception becomes that request's error entry. Jobs stay pending for one poll
+and running for `running_polls` more, then succeed with their responses inline or, with
+`responses_file`, in a JSONL file that is downloaded separately.
+"""
+import itertools
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+_SUBMIT_PATH = re.compile(r"^/v1beta/models/([^/:]+):batchGenerateContent$")
+_JOB_PATH = re.compile(r"^/v1beta/(batches/[^/:]+)$")
+_DOWNLOAD_PATH = re.compile(r"^/download/v1beta/(files/[^/:]+):download$")
+
+def _prompt_text(request):
+  return "".join(part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", []))
+
+class FakeBatchServer:
+  """Runs batch jobs against a `respond` callable behind the Batch API's HTTP interface.
+
+  Args:
+      respond (callable): `request dict -> response text`, called per request on submit.
+      api_key (str): Key expected in the `x-goog-api-key` header. None accepts any key.
+      running_polls (int): Polls a job answers with the running state before it succeeds.
+      responses_file (bool): Return results as a downloadable responses file instead of inline.
+      host (str): Interface to listen on.
+      port (int): Port to listen on. 0 picks a free port; see `api_url`."""
+
+  def __init__(self, respond, api_key=None, running_polls=1, responses_file=False, host="127.0.0.1", port=0):
+    self.respond = respond
+    self.api_key = api_key
+    self.running_polls = running_polls
+    self.responses_file = responses_file
+    # (method, path) of every request received, for assertions.
+    self.requests = []
+    self.jobs = {}
+    self.files = {}
+    self._ids = itertools.count(1)
+    self._lock = threading.Lock()
+    self._server = ThreadingHTTPServer((host, port), self._handler())
+
+  @property
+  def api_url(self):
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}/v1beta"
+
+  @property
+  def download_url(self):
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}/download/v1beta"
+
+  def start(self):
+    threading.Thread(target=self._server.serve_forever, name="fake-batch-server", daemon=True).start()
+    return self
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def _run(self, model, entries):
+    """Answers every request of a job. Returns the inlined response entries."""
+    responses = []
+    for entry in entries:
+      metadata = entry.get("metadata", {})
+      try:
+        text = self.respond(entry["request"])
+      except Exception as e:
+        responses.append({"error": {"code": 400, "message": str(e)}, "metadata": metadata})
+        continue
+      responses.append({"metadata": metadata, "response": {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {
+          "promptTokenCount": len(_prompt_text(entry["request"])) // 4,
+          "candidatesTokenCount": len(text) // 4,
+        },
+        "modelVersion": model,
+      }})
+    return responses
+
+  def submit(self, model, body):
+    batch = body["batch"]
+    entries = batch["input_config"]["requests"]["requests"]
+    with self._lock:
+      name = f"batches/{next(self._ids)}"
+    job = {"name": name, "model": model, "display_name": batch.get("display_name"), "polls": 0,
+           "responses": self._run(model, entries)}
+    with self._lock:
+      self.jobs[name] = job
+    return {"name": name, "metadata": {"name": name, "state": "BATCH_STATE_PENDING"}}
+
+  def operation(self, name):
+    with self._lock:
+      job = self.jobs[name]
+      job["polls"] += 1
+      polls = job["polls"]
+    if polls == 1:
+      state = "BATCH_STATE_PENDING"
+    elif polls <= 1 + self.running_polls:
+      state = "BATCH_STATE_RUNNING"
+    else:
+      state = "BATCH_STATE_SUCCEEDED"
+    operation = {"name": name, "metadata": {"name": name, "model": f"models/{job['model']}", "state": state},
+                 "done": state == "BATCH_STATE_SUCCEEDED"}
+    if not operation["done"]:
+      return operation
+    if self.responses_file:
+      file_name = f"files/{name.split('/')[-1]}-responses"
+      lines = [dict({key: value for key, value in entry.items() if key != "metadata"},
+                    key=entry["metadata"].get("key")) for entry in job["responses"]]
+      with self._lock:
+        self.files[file_name] = "".join(json.dumps(line) + "\n" for line in lines)
+      operation["response"] = {"responsesFile": file_name}
+    else:
+      operation["response"] = {"inlinedResponses": {"inlinedResponses": job["responses"]}}
+    return operation
+
+  def _handler(self):
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def log_message(self, format, *args):
+        pass
+
+      def _send(self, status, body, content_type="application/json"):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def _authorized(self):
+        if server.api_key is None or self.headers.get("x-goog-api-key") == server.api_key:
+          return True
+        self._send(401, {"error": {"code": 401, "message": "API key not valid"}})
+        return False
+
+      def do_POST(self):
+        path = urlparse(self.path).path
+        server.requests.append(("POST", path))
+        if not self._authorized():
+          return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        match = _SUBMIT_PATH.match(path)
+        if match is None:
+          self._send(404, {"error": {"code": 404, "message": f"Unknown path {path}"}})
+          return
+        self._send(200, server.submit(match.group(1), body))
+
+      def do_GET(self):
+        path = urlparse(self.path).path
+        server.requests.append(("GET", path))
+        if not self._authorized():
+          return
+        match = _JOB_PATH.match(path)
+        if match and match.group(1) in server.jobs:
+          self._send(200, server.operation(match.group(1)))
+          return
+        match = _DOWNLOAD_PATH.match(path)
+        if match and match.group(1) in server.files:
+          self._send(200, server.files[match.group(1)], content_type="application/jsonl")
+          return
+        self._send(404, {"error": {"code": 404, "message": f"Unknown path {path}"}})
+
+    return Handler
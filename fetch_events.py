@@ -2,7 +2,7 @@
 import os
 import dotenv
 import pickle
-import requests
+import pagination
 
 from datetime import datetime, timedelta, timezone
 from py_clob_client.constants import POLYGON
@@ -33,34 +33,7 @@ POLYMARKET_KEY = env["PK"]
 CHAIN_ID = POLYGON
 
 def fetch_all_active_events():
-  events = []
-  offset = 0
-  limit = 100  # Max results per page
-    
-  while True:
-    url = "https://gamma-api.polymarket.com/events"
-    params = {
-      "closed": "false",
-      "active": "true",
-      "limit": limit,
-      "offset": offset,
-      "order": "createdAt",
-      "ascending": "false"
-    }
-      
-    response = requests.get(url, params=params)
-    if response.status_code != 200:
-      print(f"Error fetching events: {response.status_code}")
-      break
-          
-    batch = response.json()
-    if not batch:  # No more results
-      break
-          
-    events.extend(batch)
-    offset += limit
-        
-  return events
+  return pagination.fetch_all_gamma_events()
 
 def filter_events_by_end_date(events, days=7):
   now = datetime.now(timezone.utc)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import os
 import dotenv
-import pickle
+import market_sync
+import orderbooks
+import pagination
 from datetime import datetime, timedelta, timezone
 from py_clob_client.constants import POLYGON
 from py_clob_client.client import ClobClient
@@ -31,22 +33,7 @@ POLYMARKET_KEY = env["PK"]
 CHAIN_ID = POLYGON
 
 def fetch_all_markets(client):
-  markets = []
-  next_cursor = ""
-    
-  while True:
-      response = client.get_markets(next_cursor=next_cursor)
-        
-      if not response or 'data' not in response:
-          break
-            
-      markets.extend(response['data'])
-        
-      next_cursor = response.get('next_cursor', '')
-      if next_cursor == 'LTE=' or not next_cursor:
-          break
-            
-  return markets
+  return pagination.fetch_all_clob_markets(client)
 
 def filter_markets_by_end_date(markets, days=7):
   now = datetime.now(timezone.utc)
@@ -78,20 +65,8 @@ def main():
   client = ClobClient(HOST, key=POLYMARKET_KEY, chain_id=CHAIN_ID)
   client.set_api_creds(client.create_or_derive_api_creds())
 
-  # Check for existing pickle from today
-  today = datetime.now().strftime('%Y-%m-%d')
-  pickle_path = f'all_markets_{today}.pkl'
-    
-  if os.path.exists(pickle_path):
-      with open(pickle_path, 'rb') as f:
-          all_markets = pickle.load(f)
-      print(f"Loaded {len(all_markets)} markets from pickle")
-  else:
-      # Fetch all markets using CLOB API
-      all_markets = fetch_all_markets(client)
-      # Save to pickle
-      with open(pickle_path, 'wb') as f:
-          pickle.dump(all_markets, f)
+  # Sync the catalog incrementally from the latest snapshot generation
+  all_markets = list(market_sync.sync_markets(client, snapshot_dir="snapshots").values())
     
   print(f"Total markets: {len(all_markets)}")
   print("Example Market:", all_markets[0])
@@ -110,6 +85,10 @@ def main():
   # Sort by end date
   filtered_markets.sort(key=lambda x: x['end_date_iso'])
     
+  # Fetch the books of every listed token in a few batched requests instead of one request per token
+  token_id_to_book = orderbooks.fetch_order_books(
+    client, [token['token_id'] for market in filtered_markets for token in market['tokens']])
+
   for market in filtered_markets:
       end_date = datetime.fromisoformat(market['end_date_iso'].replace('Z', '+00:00'))
       print(f"Question: {market['question']}")
@@ -121,7 +100,7 @@ def main():
       for token in market['tokens']:
           token_id = token['token_id']
           outcome = token['outcome']
-          order_book = client.get_order_book(token_id)
+          order_book = token_id_to_book.get(token_id)
           print(f"\nOutcome: {outcome}")
           print(f"Token ID: {token_id}")
           print(f"Order Book: {order_book}")
@@ -0,0 +1,79 @@
+"""Depth-aware fills: what buying a stake through several ask levels actually costs.
+
+All functions take ask ladders as (tokens, levels) arrays sorted best (lowest) price first and
+NaN padded, as packed by `scoring.ScoringUniverse`, and walk every token's book at once.
+
+Stakes are in USDC and quantities in shares. Buying `shares` at a VWAP `vwap` pays
+`shares * vwap`, so a token with probability p has an expected profit of
+`shares * (p - vwap)` before confidence and risk adjustment.
+"""
+import numpy as np
+
+def _fillable(ask_price, max_slippage):
+  """Mask of the levels a fill may use: non-empty and within max_slippage of the best ask."""
+  fillable = ~np.isnan(ask_price) & (ask_price > 0)
+  if max_slippage is not None:
+    with np.errstate(invalid='ignore'):
+      fillable &= ask_price <= ask_price[:, :1] + max_slippage
+  return fillable
+
+def simulate_fills(ask_price, ask_size, stake=None, max_slippage=None):
+  """Walks the ask ladders and fills each token up to a stake and/or a slippage limit.
+
+  Args:
+      ask_price, ask_size (np.ndarray): (tokens, levels) ask ladders, best first.
+      stake (float or np.ndarray): USDC to spend per token. None spends whatever the allowed
+        levels hold.
+      max_slippage (float): Highest price above the best ask a fill may reach. None allows
+        the whole ladder.
+
+  Returns:
+      dict: Per-token arrays `shares`, `cost`, `vwap` (NaN when nothing fills), `levels`
+        (number of levels touched) and `worst_price`."""
+  fillable = _fillable(ask_price, max_slippage)
+  level_cost = np.where(fillable, ask_price * ask_size, 0.0)
+  cost_before = np.cumsum(level_cost, axis=1) - level_cost
+  budget = np.inf if stake is None else np.asarray(stake, dtype=float).reshape(-1, 1)
+  spent = np.clip(budget - cost_before, 0.0, level_cost)
+  shares = np.divide(spent, ask_price, out=np.zeros_like(spent), where=fillable)
+
+  total_shares = shares.sum(axis=1)
+  total_cost = spent.sum(axis=1)
+  touched = shares > 0
+  levels = touched.sum(axis=1)
+  worst_price = np.full(len(ask_price), np.nan)
+  has_fill = levels > 0
+  worst_price[has_fill] = ask_price[has_fill, levels[has_fill] - 1]
+  vwap = np.divide(total_cost, total_shares, out=np.full_like(total_cost, np.nan), where=has_fill)
+  return {
+    "shares": total_shares,
+    "cost": total_cost,
+    "vwap": vwap,
+    "levels": levels,
+    "worst_price": worst_price,
+  }
+
+def break_even(ask_price, ask_size, probability, max_slippage=None):
+  """Finds the stake at which the marginal edge of buying more reaches zero.
+
+  The marginal share costs the price of the level being filled, so buying stays profitable
+  exactly while the level price is below the probability. Ladders are sorted, so these
+  levels form a prefix of the book.
+
+  Args:
+      probability (np.ndarray): Per-token probability of the token's outcome.
+
+  Returns:
+      dict: Per-token arrays `stake` (USDC), `shares`, and `profit` (expected profit of that
+        fill before confidence and risk adjustment). All are 0 where the best ask has no edge."""
+  with np.errstate(invalid='ignore'):
+    profitable = _fillable(ask_price, max_slippage) & (ask_price < probability[:, None])
+  shares = np.where(profitable, ask_size, 0.0)
+  cost = np.where(profitable, ask_price * ask_size, 0.0)
+  total_shares = shares.sum(axis=1)
+  total_cost = cost.sum(axis=1)
+  return {
+    "stake": total_cost,
+    "shares": total_shares,
+    "profit": total_shares * probability - total_cost,
+  }
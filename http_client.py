@@ -0,0 +1,118 @@
+"""Shared HTTP client for the REST providers (Perplexity, Gamma, ...).
+
+All requests go through one `requests.Session` with keep-alive connection pools, so TLS
+handshakes are paid once per connection instead of once per call. Connections per host are
+capped. Rate limits (429) and server errors (5xx) are retried with jittered exponential
+backoff, honoring `Retry-After`. Failures are raised as `HttpError` subclasses so that a
+long batch run can skip the affected market instead of exiting.
+"""
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class HttpError(Exception):
+  """Base class for errors raised by HttpClient."""
+
+  def __init__(self, message, url):
+    super().__init__(message)
+    self.url = url
+
+class HttpStatusError(HttpError):
+  """The server answered with a non-2xx status after all retries."""
+
+  def __init__(self, url, status_code, body):
+    super().__init__(f"HTTP {status_code} from {url}: {body[:500]}", url)
+    self.status_code = status_code
+    self.body = body
+
+class HttpConnectionError(HttpError):
+  """The request failed without a response (connection error or timeout) after all retries."""
+
+def _retry_after_seconds(response):
+  """Returns the delay requested by a Retry-After header, or None."""
+  value = response.headers.get("Retry-After")
+  if not value:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+  except (TypeError, ValueError):
+    return None
+
+class HttpClient:
+  """Pooled HTTP client with retries.
+
+  Args:
+      max_connections_per_host (int): Connections kept open, and allowed at once, per host.
+      max_hosts (int): Number of per-host pools kept alive.
+      max_retries (int): Retries after the first attempt for retryable failures.
+      backoff_seconds (float): Base delay of the exponential backoff.
+      max_backoff_seconds (float): Upper bound of any single delay, including Retry-After.
+      timeout (float): Default request timeout in seconds."""
+
+  def __init__(self, max_connections_per_host=16, max_hosts=10, max_retries=5,
+               backoff_seconds=1.0, max_backoff_seconds=60.0, timeout=120):
+    self.max_retries = max_retries
+    self.backoff_seconds = backoff_seconds
+    self.max_backoff_seconds = max_backoff_seconds
+    self.timeout = timeout
+    self.session = requests.Session()
+    # pool_block makes threads wait for a free connection instead of opening extra ones.
+    adapter = HTTPAdapter(
+      pool_connections=max_hosts, pool_maxsize=max_connections_per_host, pool_block=True)
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+
+  def _backoff(self, attempt, response=None):
+    delay = None if response is None else _retry_after_seconds(response)
+    if delay is None:
+      # Full jitter keeps concurrent workers from retrying in lockstep.
+      delay = random.uniform(0, self.backoff_seconds * (2 ** attempt))
+    time.sleep(min(delay, self.max_backoff_seconds))
+
+  def request(self, method, url, **kwargs):
+    """Sends a request, retrying connection errors, 429s and 5xx responses.
+
+    Accepts the keyword arguments of `requests.Session.request`.
+
+    Returns:
+        requests.Response: The successful response.
+
+    Raises:
+        HttpStatusError: On a non-retryable status, or a retryable one after the last retry.
+        HttpConnectionError: If no response was received after the last retry."""
+    kwargs.setdefault("timeout", self.timeout)
+    for attempt in range(self.max_retries + 1):
+      last_attempt = attempt == self.max_retries
+      try:
+        response = self.session.request(method, url, **kwargs)
+      except (requests.ConnectionError, requests.Timeout) as e:
+        if last_attempt:
+          raise HttpConnectionError(f"{method} {url} failed: {e}", url) from e
+        self._backoff(attempt)
+        continue
+
+      if response.ok:
+        return response
+      if response.status_code not in RETRYABLE_STATUS_CODES or last_attempt:
+        raise HttpStatusError(url, response.status_code, response.text)
+      print(f"HTTP {response.status_code} from {url}, retrying ({attempt + 1}/{self.max_retries})")
+      self._backoff(attempt, response)
+
+  def get(self, url, **kwargs):
+    return self.request("GET", url, **kwargs)
+
+  def post(self, url, **kwargs):
+    return self.request("POST", url, **kwargs)
+
+# Client shared by every module, so all calls to a host reuse the same connections.
+default_client = HttpClient()
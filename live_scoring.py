@@ -0,0 +1,147 @@
+"""Incremental re-scoring of a `scoring.ScoringUniverse` as books and predictions change.
+
+A `LiveScorer` maps every token_id and condition_id to its rows in the universe. A book or
+prediction update repacks and re-scores only those rows, then pushes the new scores onto a
+max-heap. Superseded heap entries are skipped when read (each row carries a version) and
+the heap is rebuilt once they outnumber the live ones, so an update costs O(log n).
+
+Wire it to an `OrderBookStream` with `OrderBookStream(..., on_update=scorer.on_book)`.
+
+Threshold events are dicts:
+  {"kind": "entered" or "exited", "token_id", "condition_id", "score", "previous_score", "time"}
+"""
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+import scoring
+
+class LiveScorer:
+  """Keeps a live ranking of a universe's tokens.
+
+  Args:
+      universe (ScoringUniverse): Packed tokens to score. Updated in place.
+      risk_tolerance (float): See `scoring`.
+      metric (str): Metric to rank by. Defaults as in `ScoringUniverse.top_k`.
+      stake, max_slippage: Score a simulated fill instead of the best ask, see
+        `ScoringUniverse.fill_scores`.
+      threshold (float): Score a token has to exceed to be "in". Crossings emit events.
+      on_event (callable): Called with each threshold event.
+      max_events (int): Number of recent events kept in `events`."""
+
+  def __init__(self, universe, risk_tolerance=scoring.DEFAULT_RISK_TOLERANCE, metric=None, stake=None,
+               max_slippage=None, threshold=0.0, on_event=None, max_events=1000):
+    self.universe = universe
+    self.risk_tolerance = risk_tolerance
+    self.filling = stake is not None or max_slippage is not None
+    self.metric = metric or ("expected_profit" if self.filling else "adjusted_ev")
+    self.stake = stake
+    self.max_slippage = max_slippage
+    self.threshold = threshold
+    self.on_event = on_event
+    self.events = deque(maxlen=max_events)
+    self.stats = {"book_updates": 0, "prediction_updates": 0, "rows_scored": 0, "events": 0}
+
+    self.token_rows = dict(universe.token_index)
+    self.market_rows = defaultdict(list)
+    for row, condition_id in enumerate(universe.condition_ids):
+      self.market_rows[condition_id].append(row)
+
+    self._lock = threading.Lock()
+    self._versions = [0] * len(universe)
+    self.scores = self._score_rows(slice(None)).tolist()
+    self._heap = []
+    self._rebuild_heap()
+
+  def _score_rows(self, rows):
+    if self.filling:
+      return self.universe.fill_scores(self.stake, self.max_slippage, self.risk_tolerance, rows=rows)[self.metric]
+    return self.universe.score(self.risk_tolerance, rows=rows)[self.metric][:, 0]
+
+  def _rebuild_heap(self):
+    self._heap = [(-score, self._versions[row], row) for row, score in enumerate(self.scores)
+                  if not math.isnan(score)]
+    heapq.heapify(self._heap)
+
+  def _in(self, score):
+    return not math.isnan(score) and score > self.threshold
+
+  def _rescore(self, rows):
+    """Re-scores rows after their packed inputs changed. Returns the threshold events."""
+    start, stop = min(rows), max(rows) + 1
+    new_scores = self._score_rows(slice(start, stop))
+    self.stats["rows_scored"] += len(rows)
+    events = []
+    for row in rows:
+      previous, score = self.scores[row], float(new_scores[row - start])
+      self.scores[row] = score
+      self._versions[row] += 1
+      if not math.isnan(score):
+        heapq.heappush(self._heap, (-score, self._versions[row], row))
+      if self._in(previous) != self._in(score):
+        events.append({
+          "kind": "entered" if self._in(score) else "exited",
+          "token_id": self.universe.token_ids[row],
+          "condition_id": self.universe.condition_ids[row],
+          "score": score,
+          "previous_score": previous,
+          "time": time.time(),
+        })
+    if len(self._heap) > 2 * len(self.scores) + 64:
+      self._rebuild_heap()
+    return events
+
+  def _emit(self, events):
+    for event in events:
+      self.events.append(event)
+      self.stats["events"] += 1
+      if self.on_event is not None:
+        self.on_event(event)
+
+  def on_book(self, token_id, book):
+    """Applies a new order book (an `OrderBookSummary` or a `market_data.BookView`)."""
+    row = self.token_rows.get(token_id)
+    if row is None:
+      return
+    with self._lock:
+      self.universe.set_book(row, book)
+      self.stats["book_updates"] += 1
+      events = self._rescore([row])
+    self._emit(events)
+
+  def on_prediction(self, condition_id, prediction):
+    """Applies a new market prediction to every token of the market."""
+    rows = self.market_rows.get(condition_id)
+    if not rows:
+      return
+    with self._lock:
+      for row in rows:
+        own = (scoring.invert_prediction_probability(prediction)
+               if self.universe.outcomes[row] == 'No' else prediction)
+        self.universe.set_prediction(row, own)
+      self.stats["prediction_updates"] += 1
+      events = self._rescore(rows)
+    self._emit(events)
+
+  def top(self, k):
+    """Returns the k best rows as (row, score), best first."""
+    with self._lock:
+      best = []
+      popped = []
+      while self._heap and len(best) < k:
+        entry = heapq.heappop(self._heap)
+        negative_score, version, row = entry
+        if version != self._versions[row]:
+          continue
+        popped.append(entry)
+        best.append((row, -negative_score))
+      for entry in popped:
+        heapq.heappush(self._heap, entry)
+      return best
+
+  def summaries(self, k):
+    """Returns market summaries of the k best tokens for `pretty_print_data.pretty_print_markets`."""
+    return [self.universe.summary(row, 0, self.risk_tolerance, self.stake, self.max_slippage)
+            for row, _ in self.top(k)]
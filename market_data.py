@@ -0,0 +1,416 @@
+"""Order books kept up to date from the Polymarket websocket market channel.
+
+Instead of downloading every book again on each refresh, an `OrderBookStream` subscribes to
+the market channel and keeps a local book per token. `book` events replace a token's book and
+`price_change` events update single price levels in place. A token is resynced from a REST
+snapshot when its book hash stops matching the hash the server sends, or when a message
+carries a sequence number that skips ahead.
+
+The client library's server hash covers the REST book: market, asset_id, timestamp, levels and
+the min_order_size, tick_size, neg_risk and last_trade_price metadata. Market channel events
+carry no metadata, so the hash of each token's first `book` event is recomputed both with and
+without it, and price changes are checked with whichever matched. Tokens whose hash matches
+neither are not hash-checked, rather than resynced on every change. Updates older than the book are ignored, so a
+REST snapshot and the stream can be mixed freely.
+
+Books are read through `BookView`s, which look like `OrderBookSummary` (bids ascending and
+asks descending, best price last) but read the live book instead of copying it.
+
+Point `url` at a `replay_server.ReplayServer` to run against recorded messages. Pass
+`record_path` to record a live session for replay.
+"""
+import bisect
+import json
+import threading
+import time
+from collections.abc import Sequence
+
+import websocket
+from py_clob_client.clob_types import OrderBookSummary, OrderSummary
+from py_clob_client.utilities import generate_orderbook_summary_hash
+
+import orderbooks
+
+MARKET_CHANNEL_URL = "wss://ws-subscriptions-clob.polymarket.com/ws/market"
+
+class _Side:
+  """One side of a book: levels keyed by price, with the prices kept sorted ascending."""
+
+  def __init__(self):
+    self.prices = []
+    # price -> (price string, size string). The server's strings are kept for hashing.
+    self.levels = {}
+
+  def clear(self):
+    self.prices = []
+    self.levels = {}
+
+  def set(self, price, size):
+    key = float(price)
+    if float(size) == 0:
+      if key in self.levels:
+        del self.prices[bisect.bisect_left(self.prices, key)]
+        del self.levels[key]
+    elif key in self.levels:
+      self.levels[key] = (price, size)
+    else:
+      # The level is stored before its price is listed, so a concurrent reader never sees
+      # a listed price without a level.
+      self.levels[key] = (price, size)
+      bisect.insort(self.prices, key)
+
+class LevelsView(Sequence):
+  """Read-only view of one side of a local book, in REST order (best price last)."""
+
+  def __init__(self, side, descending):
+    self._side = side
+    self._descending = descending
+
+  def __len__(self):
+    return len(self._side.prices)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self)))]
+    prices = self._side.prices
+    if index < 0:
+      index += len(prices)
+    if not 0 <= index < len(prices):
+      raise IndexError(index)
+    price = prices[len(prices) - 1 - index] if self._descending else prices[index]
+    price_string, size = self._side.levels.get(price, (str(price), "0"))
+    return OrderSummary(price=price_string, size=size)
+
+class LocalBook:
+  """The local copy of one token's order book."""
+
+  def __init__(self, token_id):
+    self.token_id = token_id
+    self.market = None
+    self.timestamp = 0
+    self.hash = None
+    self.sequence = None
+    self.min_order_size = None
+    self.tick_size = None
+    self.neg_risk = None
+    self.last_trade_price = None
+    # Fields the server's hashes of this token cover: "book" (what market channel events carry),
+    # "summary" (plus the REST metadata), False if neither reproduces them, None until checked.
+    self.hash_fields = None
+    self.bids = _Side()
+    self.asks = _Side()
+    self.ready = False
+
+  def load(self, summary):
+    """Replaces the book with an `OrderBookSummary` or a websocket `book` event."""
+    get = summary.get if isinstance(summary, dict) else lambda key, default=None: getattr(summary, key, default)
+    for side, levels in ((self.bids, get('bids')), (self.asks, get('asks'))):
+      side.clear()
+      for level in levels or []:
+        price, size = (level['price'], level['size']) if isinstance(level, dict) else (level.price, level.size)
+        side.set(price, size)
+    self.market = get('market') or self.market
+    self.timestamp = int(get('timestamp') or 0)
+    self.hash = get('hash')
+    for key in ('min_order_size', 'tick_size', 'neg_risk', 'last_trade_price'):
+      if get(key) is not None:
+        setattr(self, key, get(key))
+    self.ready = True
+
+  def summary(self, metadata=True):
+    """Returns a copy of the book as an `OrderBookSummary`, without the REST metadata if not
+    `metadata`."""
+    return OrderBookSummary(
+      market=self.market,
+      asset_id=self.token_id,
+      timestamp=str(self.timestamp),
+      bids=list(LevelsView(self.bids, descending=False)),
+      asks=list(LevelsView(self.asks, descending=True)),
+      min_order_size=self.min_order_size if metadata else None,
+      neg_risk=self.neg_risk if metadata else None,
+      tick_size=self.tick_size if metadata else None,
+      last_trade_price=self.last_trade_price if metadata else None,
+      hash=self.hash,
+    )
+
+class BookView:
+  """Zero-copy, read-only view of a local book that can stand in for an `OrderBookSummary`.
+
+  Reads are not locked, so a view read during an update may see the book mid-change. Use
+  `snapshot()` for a consistent copy."""
+
+  def __init__(self, book, lock):
+    self._book = book
+    self._lock = lock
+    self.bids = LevelsView(book.bids, descending=False)
+    self.asks = LevelsView(book.asks, descending=True)
+
+  @property
+  def asset_id(self):
+    return self._book.token_id
+
+  @property
+  def market(self):
+    return self._book.market
+
+  @property
+  def timestamp(self):
+    return str(self._book.timestamp)
+
+  @property
+  def hash(self):
+    return self._book.hash
+
+  def best_bid(self):
+    prices = self._book.bids.prices
+    return prices[-1] if prices else None
+
+  def best_ask(self):
+    prices = self._book.asks.prices
+    return prices[0] if prices else None
+
+  def snapshot(self):
+    """Returns a consistent copy of the book as an `OrderBookSummary`."""
+    with self._lock:
+      return self._book.summary()
+
+class OrderBookStream:
+  """Keeps local order books for a set of tokens current from the market channel.
+
+  Args:
+      client (ClobClient): CLOB client used for REST resyncs.
+      token_ids (list): Tokens to subscribe to.
+      url (str): Market channel websocket URL.
+      book_hash (callable): Computes the server hash of an `OrderBookSummary`. None disables
+        hash checks.
+      on_update (callable): Called as `on_update(token_id, view)` after a book changes.
+      record_path (str): Optional JSONL file that every received message is appended to,
+        for `replay_server.load_recording`.
+      ping_interval (float): Seconds between websocket pings.
+      reconnect_seconds, max_reconnect_seconds (float): Backoff between reconnects."""
+
+  def __init__(self, client, token_ids, url=MARKET_CHANNEL_URL, book_hash=generate_orderbook_summary_hash,
+               on_update=None, record_path=None, ping_interval=10, reconnect_seconds=1.0,
+               max_reconnect_seconds=30.0):
+    self.client = client
+    self.token_ids = list(dict.fromkeys(token_ids))
+    self.url = url
+    self.book_hash = book_hash
+    self.on_update = on_update
+    self.record_path = record_path
+    self.ping_interval = ping_interval
+    self.reconnect_seconds = reconnect_seconds
+    self.max_reconnect_seconds = max_reconnect_seconds
+    self._books = {token_id: LocalBook(token_id) for token_id in self.token_ids}
+    self._lock = threading.RLock()
+    self._views = {token_id: BookView(book, self._lock) for token_id, book in self._books.items()}
+    self._ready = threading.Condition(self._lock)
+    self._stopped = threading.Event()
+    self._thread = None
+    self._app = None
+    self._record_file = None
+    self._record_start = None
+    self.stats = {
+      "messages": 0,
+      "books": 0,
+      "price_changes": 0,
+      "stale": 0,
+      "gaps": 0,
+      "hash_mismatches": 0,
+      "unverified_hashes": 0,
+      "resyncs": 0,
+      "reconnects": 0,
+    }
+
+  def start(self):
+    """Connects in a background thread. The server sends a `book` event per token on subscribe."""
+    if self.record_path:
+      self._record_file = open(self.record_path, 'a')
+      self._record_start = time.monotonic()
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._run, name="market-channel", daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._stopped.set()
+    if self._app is not None:
+      self._app.close()
+    if self._thread is not None:
+      self._thread.join(timeout=5)
+    if self._record_file is not None:
+      self._record_file.close()
+      self._record_file = None
+
+  def wait_ready(self, timeout=30.0):
+    """Waits for every token's first book, then resyncs the missing ones over REST.
+
+    Returns:
+        int: Number of tokens with a book."""
+    deadline = time.monotonic() + timeout
+    with self._ready:
+      while not all(book.ready for book in self._books.values()):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._ready.wait(remaining)
+      missing = [token_id for token_id, book in self._books.items() if not book.ready]
+    if missing:
+      print(f"No streamed book for {len(missing)} tokens after {timeout}s. Fetching them over REST.")
+      self.resync(missing)
+    return sum(book.ready for book in self._books.values())
+
+  def view(self, token_id):
+    return self._views[token_id]
+
+  def views(self, token_ids=None):
+    """Returns views of every token with a book, keyed by token_id.
+
+    Args:
+        token_ids (iterable): Only return these tokens' views. Defaults to every streamed token."""
+    if token_ids is None:
+      return {token_id: view for token_id, view in self._views.items() if self._books[token_id].ready}
+    return {token_id: self._views[token_id] for token_id in token_ids
+            if token_id in self._books and self._books[token_id].ready}
+
+  def snapshots(self):
+    """Returns consistent copies of every book as `OrderBookSummary`s, keyed by token_id."""
+    with self._lock:
+      return {token_id: book.summary() for token_id, book in self._books.items() if book.ready}
+
+  def resync(self, token_ids):
+    """Replaces the given books with fresh REST snapshots."""
+    self.stats["resyncs"] += len(token_ids)
+    for token_id, summary in orderbooks.fetch_order_books(self.client, token_ids).items():
+      if token_id not in self._books:
+        continue
+      with self._ready:
+        book = self._books[token_id]
+        book.load(summary)
+        book.sequence = None
+        self._ready.notify_all()
+      self._notify(token_id)
+
+  def handle_message(self, raw):
+    """Applies one raw market channel message. Called by the websocket thread."""
+    if self._record_file is not None:
+      self._record_file.write(json.dumps({"t": time.monotonic() - self._record_start, "message": raw}) + "\n")
+    self.stats["messages"] += 1
+    if not raw or raw in ("PONG", "PING"):
+      return
+    events = json.loads(raw)
+    changed = set()
+    resync = set()
+    with self._ready:
+      for event in events if isinstance(events, list) else [events]:
+        kind = event.get("event_type")
+        if kind == "book":
+          changed |= self._on_book(event, resync)
+        elif kind == "price_change":
+          changed |= self._on_price_change(event, resync)
+        elif kind == "tick_size_change" and event.get("asset_id") in self._books:
+          self._books[event["asset_id"]].tick_size = event.get("new_tick_size")
+        elif kind == "last_trade_price" and event.get("asset_id") in self._books:
+          self._books[event["asset_id"]].last_trade_price = event.get("price")
+      self._ready.notify_all()
+    if resync:
+      self.resync(sorted(resync))
+    for token_id in changed - resync:
+      self._notify(token_id)
+
+  def _notify(self, token_id):
+    if self.on_update is not None:
+      self.on_update(token_id, self._views[token_id])
+
+  def _in_sequence(self, book, event, resync):
+    """Returns False for stale events and for sequence gaps, which are queued for a resync."""
+    if int(event.get("timestamp") or 0) < book.timestamp:
+      self.stats["stale"] += 1
+      return False
+    sequence = event.get("seq", event.get("sequence"))
+    if sequence is None:
+      return True
+    sequence = int(sequence)
+    if book.sequence is not None and sequence != book.sequence + 1:
+      self.stats["gaps"] += 1
+      resync.add(book.token_id)
+      return False
+    book.sequence = sequence
+    return True
+
+  def _hash(self, book, fields):
+    return self.book_hash(book.summary(metadata=fields == "summary"))
+
+  def _check_hash_fields(self, book):
+    """Finds the fields the hash of a `book` event covers, for checking later price changes."""
+    if self.book_hash is None or not book.hash or book.hash_fields:
+      return
+    for fields in ("book", "summary"):
+      if self._hash(book, fields) == book.hash:
+        book.hash_fields = fields
+        return
+    book.hash_fields = False
+    self.stats["unverified_hashes"] += 1
+
+  def _on_book(self, event, resync):
+    book = self._books.get(event.get("asset_id"))
+    if book is None or not self._in_sequence(book, event, resync):
+      return set()
+    book.load(event)
+    self._check_hash_fields(book)
+    self.stats["books"] += 1
+    return {book.token_id}
+
+  def _on_price_change(self, event, resync):
+    # Newer events list changes for several assets, each with the hash of its book after the
+    # change. Older events carry one asset_id, a `changes` list and a single hash.
+    if "price_changes" in event:
+      changes = event["price_changes"]
+    else:
+      changes = [dict(change, asset_id=event.get("asset_id"), hash=event.get("hash"))
+                 for change in event.get("changes", [])]
+    expected_hashes = {}
+    for change in changes:
+      book = self._books.get(change.get("asset_id"))
+      if book is None or not book.ready or book.token_id in resync:
+        continue
+      if book.token_id not in expected_hashes and not self._in_sequence(book, event, resync):
+        continue
+      side = book.bids if change["side"] == "BUY" else book.asks
+      side.set(change["price"], change["size"])
+      expected_hashes[book.token_id] = change.get("hash")
+      self.stats["price_changes"] += 1
+
+    for token_id, expected_hash in expected_hashes.items():
+      book = self._books[token_id]
+      book.timestamp = int(event.get("timestamp") or book.timestamp)
+      book.hash = expected_hash
+      if (self.book_hash is not None and expected_hash and book.hash_fields
+          and self._hash(book, book.hash_fields) != expected_hash):
+        self.stats["hash_mismatches"] += 1
+        resync.add(token_id)
+    return set(expected_hashes)
+
+  def _on_open(self, ws):
+    ws.send(json.dumps({"assets_ids": self.token_ids, "type": "market"}))
+
+  def _on_error(self, ws, error):
+    print(f"Market channel error: {error}")
+
+  def _run(self):
+    delay = self.reconnect_seconds
+    while not self._stopped.is_set():
+      self._app = websocket.WebSocketApp(
+        self.url, on_open=self._on_open, on_message=lambda ws, raw: self.handle_message(raw),
+        on_error=self._on_error)
+      connected_at = time.monotonic()
+      self._app.run_forever(ping_interval=self.ping_interval, ping_timeout=self.ping_interval / 2)
+      if self._stopped.is_set():
+        break
+      # Deltas sent while disconnected are lost. The server resends every book on subscribe.
+      self.stats["reconnects"] += 1
+      if time.monotonic() - connected_at > self.max_reconnect_seconds:
+        delay = self.reconnect_seconds
+      print(f"Market channel disconnected. Reconnecting in {delay:.0f}s.")
+      self._stopped.wait(delay)
+      delay = min(delay * 2, self.max_reconnect_seconds)
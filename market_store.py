@@ -0,0 +1,213 @@
+"""Indexed in-memory view of the market catalog for fast screening queries.
+
+Timestamps are parsed once when the store is built. Markets are kept in a sorted end-date
+index for range queries, with inverted indexes on tags, category and active/closed state and
+a join from Gamma events to their markets. A query narrows by end date first, then by the
+inverted indexes, so its cost depends on the number of matching markets, not the catalog size.
+"""
+import bisect
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+def _timestamp(value):
+  """Returns epoch seconds for an ISO date string or datetime, or None."""
+  if isinstance(value, datetime):
+    return value.timestamp()
+  if not isinstance(value, str) or not value:
+    return None
+  try:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+  except ValueError:
+    return None
+
+def _best_prices(order_book):
+  if order_book is None:
+    return None, None
+  bids = [float(level.price) for level in order_book.bids or []]
+  asks = [float(level.price) for level in order_book.asks or []]
+  return (max(bids) if bids else None), (min(asks) if asks else None)
+
+class MarketStore:
+  """Indexes CLOB markets (and optionally Gamma events) for screening queries.
+
+  Args:
+      markets (dict): Maps condition_id to a CLOB market.
+      events (list): Optional Gamma events, used for the event-to-markets join.
+
+  Without events, negRisk markets are still grouped by their `neg_risk_market_id`."""
+
+  def __init__(self, markets, events=None):
+    self.markets = markets
+    self.end_dates = {}
+    ends = []
+    self.by_tag = defaultdict(set)
+    self.by_category = defaultdict(set)
+    self.tagged = set()
+    self.active = set()
+    self.closed = set()
+    self.token_to_market = {}
+    self.market_tokens = {}
+    for condition_id, market in markets.items():
+      end_date = _timestamp(market.get('end_date_iso'))
+      if end_date is not None:
+        self.end_dates[condition_id] = end_date
+        ends.append((end_date, condition_id))
+      for tag in market.get('tags') or []:
+        self.by_tag[tag].add(condition_id)
+        self.tagged.add(condition_id)
+      self.by_category[market.get('category') or ''].add(condition_id)
+      if market.get('active'):
+        self.active.add(condition_id)
+      if market.get('closed'):
+        self.closed.add(condition_id)
+      self.market_tokens[condition_id] = [token.get('token_id') for token in market.get('tokens', [])]
+      for token_id in self.market_tokens[condition_id]:
+        self.token_to_market[token_id] = condition_id
+    ends.sort()
+    self._end_times = [end_date for end_date, _ in ends]
+    self._end_ids = [condition_id for _, condition_id in ends]
+
+    self.events = {}
+    self.event_markets = {}
+    self.market_event = {}
+    self.gamma_markets = {}
+    for event in events or []:
+      self.events[event['id']] = event
+      for gamma_market in event.get('markets', []):
+        if gamma_market.get('conditionId'):
+          self.gamma_markets[gamma_market['conditionId']] = gamma_market
+      condition_ids = [m['conditionId'] for m in event.get('markets', []) if m.get('conditionId')]
+      self.event_markets[event['id']] = condition_ids
+      for condition_id in condition_ids:
+        self.market_event[condition_id] = event['id']
+
+    self.spreads = {}
+    self.best_bids = {}
+    self.best_asks = {}
+
+  def update_books(self, token_id_to_book):
+    """Records the best bid and ask per token from fresh order books and recomputes the
+    bid/ask spread of their markets.
+
+    A market's spread is the tightest spread among its tokens' current books. A market with no
+    two-sided book has no spread, so `query(max_spread=...)` drops it. Call again with the
+    changed books, e.g. from `market_data.OrderBookStream`, to keep the spreads current."""
+    changed = set()
+    for token_id, book in token_id_to_book.items():
+      self.best_bids[token_id], self.best_asks[token_id] = _best_prices(book)
+      condition_id = self.token_to_market.get(token_id)
+      if condition_id is not None:
+        changed.add(condition_id)
+    for condition_id in changed:
+      spreads = [self.best_asks[token_id] - self.best_bids[token_id]
+                 for token_id in self.market_tokens[condition_id]
+                 if self.best_bids.get(token_id) is not None and self.best_asks.get(token_id) is not None]
+      if spreads:
+        self.spreads[condition_id] = min(spreads)
+      else:
+        self.spreads.pop(condition_id, None)
+
+  def ending_between(self, start=None, end=None):
+    """Returns condition ids with end dates in [start, end], soonest first.
+
+    Args:
+        start, end: datetimes, ISO strings, or timedeltas relative to now. None leaves that side open."""
+    now = datetime.now(timezone.utc)
+    bounds = []
+    for bound in (start, end):
+      if isinstance(bound, timedelta):
+        bound = now + bound
+      bounds.append(_timestamp(bound))
+    low = 0 if bounds[0] is None else bisect.bisect_left(self._end_times, bounds[0])
+    high = len(self._end_times) if bounds[1] is None else bisect.bisect_right(self._end_times, bounds[1])
+    return self._end_ids[low:high]
+
+  def query(self, end_after=None, end_before=None, active=None, closed=None, tags=None,
+            exclude_tags=None, require_tags=False, category=None, exclude_category=None,
+            max_spread=None):
+    """Returns the condition ids of markets matching every given filter, soonest end first.
+
+    Args:
+        end_after, end_before: End-date range, see `ending_between`. If both are None, markets
+          without an end date are included and the result is unordered.
+        active, closed (bool): Required active/closed state.
+        tags (list): Markets must have at least one of these tags.
+        exclude_tags (list): Markets must have none of these tags.
+        require_tags (bool): Drop markets without any tags.
+        category, exclude_category (str): Required or excluded category.
+        max_spread (float): Maximum bid/ask spread; needs `update_books`. Markets with no
+          two-sided book are dropped."""
+    if end_after is None and end_before is None:
+      candidates = list(self.markets)
+    else:
+      candidates = self.ending_between(end_after, end_before)
+
+    # (indexes, wanted): a market passes if its membership in any of the indexes equals wanted.
+    # The indexes are not merged, so a filter never copies a large index.
+    required = []
+    if active is not None:
+      required.append(([self.active], active))
+    if closed is not None:
+      required.append(([self.closed], closed))
+    if tags:
+      required.append(([self.by_tag.get(tag, set()) for tag in tags], True))
+    if exclude_tags:
+      required.append(([self.by_tag.get(tag, set()) for tag in exclude_tags], False))
+    if require_tags:
+      required.append(([self.tagged], True))
+    if category is not None:
+      required.append(([self.by_category.get(category, set())], True))
+    if exclude_category is not None:
+      required.append(([self.by_category.get(exclude_category, set())], False))
+
+    result = []
+    for condition_id in candidates:
+      if all(any(condition_id in index for index in indexes) == wanted for indexes, wanted in required):
+        if max_spread is None or self.spreads.get(condition_id, float('inf')) <= max_spread:
+          result.append(condition_id)
+    return result
+
+  def markets_of_event(self, event_id):
+    """Returns the condition ids of an event's markets."""
+    return self.event_markets.get(event_id, [])
+
+  def siblings(self, condition_id):
+    """Returns the condition ids of the other markets in the same event."""
+    event_id = self.market_event.get(condition_id)
+    return [c for c in self.event_markets.get(event_id, []) if c != condition_id]
+
+  def event_groups(self, condition_ids=None, min_size=2):
+    """Groups markets by the event they belong to.
+
+    Markets are grouped by Gamma event, or by `neg_risk_market_id` for negRisk markets
+    without a known event.
+
+    Args:
+        condition_ids (iterable): Markets to group. Defaults to every market.
+        min_size (int): Groups with fewer markets are left out.
+
+    Returns:
+        dict: Maps a group id (the Gamma event id or "neg_risk:<id>") to condition ids."""
+    groups = defaultdict(list)
+    for condition_id in self.markets if condition_ids is None else condition_ids:
+      market = self.markets.get(condition_id)
+      if market is None:
+        continue
+      if condition_id in self.market_event:
+        groups[self.market_event[condition_id]].append(condition_id)
+      elif market.get('neg_risk') and market.get('neg_risk_market_id'):
+        groups[f"neg_risk:{market['neg_risk_market_id']}"].append(condition_id)
+    return {group_id: members for group_id, members in groups.items() if len(members) >= min_size}
+
+  def event_details(self, group_id):
+    """Returns (title, description) of a group from `event_groups`. Both are None without a Gamma event."""
+    event = self.events.get(group_id)
+    if event is None:
+      return None, None
+    return event.get('title'), event.get('description')
+
+  def volumes(self):
+    """Returns Gamma's traded volume (`volumeNum`) per condition id, for markets with a known event."""
+    return {condition_id: float(gamma_market['volumeNum'])
+            for condition_id, gamma_market in self.gamma_markets.items()
+            if gamma_market.get('volumeNum') is not None}
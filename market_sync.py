@@ -0,0 +1,143 @@
+"""Incremental sync of the CLOB market catalog.
+
+Instead of crawling the whole CLOB catalog, a sync loads the latest markets snapshot, asks
+Gamma for the markets updated since that snapshot (Gamma can sort by `updatedAt`), refetches
+only those from the CLOB and merges them in. Each sync writes a new snapshot generation and a
+diff record listing the added and updated condition ids. Without a previous snapshot it
+falls back to a full crawl.
+
+Files under the snapshot directory:
+  markets_snapshot_<date>_g<generation>.pkl   condition_id -> CLOB market
+  markets_diff_g<generation>.json             what changed in that generation
+  markets_sync_state.json                     latest generation and its sync time
+"""
+import json
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import py_clob_client
+
+import http_client
+import pagination
+
+GAMMA_MARKETS_URL = "https://gamma-api.polymarket.com/markets"
+STATE_FILE = "markets_sync_state.json"
+# Markets updated this long before the last sync are fetched again, to cover clock skew and
+# updates that landed while the previous sync was paging.
+OVERLAP = timedelta(minutes=5)
+
+def _parse_time(value):
+  return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def load_state(snapshot_dir):
+  """Returns the sync state of a snapshot directory, or None before the first sync."""
+  path = os.path.join(snapshot_dir, STATE_FILE)
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+def fetch_updated_condition_ids(since, limit=100):
+  """Returns the condition ids of Gamma markets created or updated at or after `since`.
+
+  Pages are walked newest first and the walk stops at the first market older than `since`."""
+  condition_ids = []
+  offset = 0
+  while True:
+    params = {"order": "updatedAt", "ascending": "false", "limit": limit, "offset": offset}
+    batch = http_client.default_client.get(GAMMA_MARKETS_URL, params=params).json()
+    if not batch:
+      return condition_ids
+    for market in batch:
+      updated_at = market.get('updatedAt') or market.get('createdAt')
+      if updated_at and _parse_time(updated_at) < since:
+        return condition_ids
+      if market.get('conditionId'):
+        condition_ids.append(market['conditionId'])
+    offset += limit
+
+def fetch_clob_markets(client, condition_ids, max_workers=8):
+  """Fetches CLOB markets by condition id concurrently. Failed fetches are logged and skipped.
+
+  Returns:
+      dict: Maps condition_id to CLOB market."""
+  def fetch(condition_id):
+    try:
+      return condition_id, client.get_market(condition_id)
+    except py_clob_client.exceptions.PolyApiException as e:
+      print(f"Error fetching market {condition_id}: {e}")
+      return condition_id, None
+
+  with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="market-sync") as pool:
+    results = pool.map(fetch, list(dict.fromkeys(condition_ids)))
+    return {condition_id: market for condition_id, market in results if market}
+
+def merge_markets(markets, changed_markets):
+  """Merges changed markets into a copy of the catalog.
+
+  Returns:
+      tuple: (merged catalog, added condition ids, updated condition ids)"""
+  merged = dict(markets)
+  added = []
+  updated = []
+  for condition_id, market in changed_markets.items():
+    if condition_id not in markets:
+      added.append(condition_id)
+    elif markets[condition_id] != market:
+      updated.append(condition_id)
+    merged[condition_id] = market
+  return merged, added, updated
+
+def sync_markets(client, snapshot_dir="snapshots", full=False):
+  """Brings the market catalog up to date and writes a new snapshot generation.
+
+  Args:
+      client (ClobClient): CLOB client.
+      snapshot_dir (str): Directory holding the snapshots and sync state.
+      full (bool): Force a full crawl instead of a delta sync.
+
+  Returns:
+      dict: The current catalog, condition_id -> CLOB market."""
+  os.makedirs(snapshot_dir, exist_ok=True)
+  state = load_state(snapshot_dir)
+  synced_at = datetime.now(timezone.utc)
+
+  if state is None or full:
+    print("Running a full market crawl...")
+    markets = {market['condition_id']: market for market in pagination.fetch_all_clob_markets(client)}
+    added, updated = list(markets), []
+    since = None
+  else:
+    with open(state['snapshot_path'], 'rb') as f:
+      previous_markets = pickle.load(f)
+    since = _parse_time(state['synced_at']) - OVERLAP
+    condition_ids = fetch_updated_condition_ids(since)
+    print(f"{len(condition_ids)} markets changed since {since.isoformat()}")
+    changed_markets = fetch_clob_markets(client, condition_ids)
+    markets, added, updated = merge_markets(previous_markets, changed_markets)
+
+  generation = 1 if state is None else state['generation'] + 1
+  snapshot_path = os.path.join(
+    snapshot_dir, f"markets_snapshot_{synced_at.strftime('%Y-%m-%d')}_g{generation}.pkl")
+  with open(snapshot_path, 'wb') as f:
+    pickle.dump(markets, f)
+  with open(os.path.join(snapshot_dir, f"markets_diff_g{generation}.json"), 'w') as f:
+    json.dump({
+      "generation": generation,
+      "since": since.isoformat() if since else None,
+      "synced_at": synced_at.isoformat(),
+      "added": added,
+      "updated": updated,
+    }, f)
+  # The state is written last, so an interrupted sync is simply redone from the old generation.
+  with open(os.path.join(snapshot_dir, STATE_FILE), 'w') as f:
+    json.dump({
+      "generation": generation,
+      "synced_at": synced_at.isoformat(),
+      "snapshot_path": snapshot_path,
+    }, f)
+  print(f"Saved generation {generation} with {len(markets)} markets "
+        f"({len(added)} added, {len(updated)} updated) to {snapshot_path}")
+  return markets
@@ -0,0 +1,189 @@
+"""Near-duplicate detection for market descriptions, used to reuse research reports.
+
+Templated recurring markets ("Will BTC close above $X on <date>?") differ in a few tokens, so
+their descriptions hash to different cache keys although the research is the same. Each
+description is reduced to a set of word shingles and a MinHash signature, whose agreement
+with another signature estimates the Jaccard similarity of the two shingle sets. An LSH
+index splits signatures into bands so that only descriptions sharing a band bucket are
+compared, which keeps lookups cheap however many descriptions are indexed.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+_PRIME = np.uint64(4294967291)  # Largest prime below 2**32.
+_WORD = re.compile(r"[a-z0-9$%.]+")
+
+def shingles(text, size=3):
+  """Returns the set of `size`-word shingles of lowercased, punctuation-stripped text."""
+  words = _WORD.findall(text.lower())
+  if len(words) < size:
+    return {" ".join(words)} if words else set()
+  return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _shingle_hashes(shingle_set):
+  return np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little')
+                   for s in shingle_set], dtype=np.uint64)
+
+class MinHasher:
+  """Computes MinHash signatures with `num_perm` random linear hash functions.
+
+  Args:
+      num_perm (int): Signature length. The similarity estimate's error shrinks with its square root.
+      seed (int): Seed of the hash functions. Signatures are only comparable with the same seed."""
+
+  def __init__(self, num_perm=128, seed=1):
+    rng = np.random.default_rng(seed)
+    # a < 2**31 keeps a * x + b below 2**64 for 32-bit x.
+    self.a = rng.integers(1, 2**31, size=num_perm, dtype=np.uint64)
+    self.b = rng.integers(0, 2**31, size=num_perm, dtype=np.uint64)
+    self.num_perm = num_perm
+
+  def signature(self, text):
+    hashes = _shingle_hashes(shingles(text))
+    if not len(hashes):
+      return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+    return ((hashes[:, None] * self.a + self.b) % _PRIME).min(axis=0)
+
+def similarity(signature, other):
+  """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+  return float(np.mean(signature == other))
+
+def _bands_for(threshold, num_perm, recall=0.95):
+  """Picks (bands, rows) for the LSH index.
+
+  A pair with similarity s shares a bucket with probability 1 - (1 - s**rows)**bands. More
+  rows per band mean fewer dissimilar candidates, so this takes the most rows that still
+  catch `recall` of the pairs at the threshold. Candidates are checked against the full
+  signatures, so the dissimilar ones only cost a comparison."""
+  options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+  for bands, rows in sorted(options, key=lambda option: -option[1]):
+    if 1 - (1 - threshold ** rows) ** bands >= recall:
+      return bands, rows
+  return num_perm, 1
+
+class LSHIndex:
+  """MinHash LSH index of texts.
+
+  Args:
+      threshold (float): Estimated Jaccard similarity above which texts are near-duplicates.
+      num_perm (int): MinHash signature length."""
+
+  def __init__(self, threshold=0.8, num_perm=128):
+    self.threshold = threshold
+    self.hasher = MinHasher(num_perm)
+    self.bands, self.rows = _bands_for(threshold, num_perm)
+    self._buckets = [dict() for _ in range(self.bands)]
+    self.signatures = {}
+
+  def __len__(self):
+    return len(self.signatures)
+
+  def _band_keys(self, signature):
+    return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+  def add(self, key, text):
+    signature = self.hasher.signature(text)
+    self.signatures[key] = signature
+    for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+      buckets.setdefault(band_key, []).append(key)
+    return signature
+
+  def query(self, text, signature=None):
+    """Returns (key, similarity) of indexed near-duplicates of `text`, most similar first."""
+    signature = self.hasher.signature(text) if signature is None else signature
+    candidates = set()
+    for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+      candidates.update(buckets.get(band_key, ()))
+    matches = [(key, similarity(signature, self.signatures[key])) for key in candidates]
+    return sorted((m for m in matches if m[1] >= self.threshold), key=lambda m: -m[1])
+
+class ReportReuseIndex:
+  """Hands out the report of a near-duplicate market description instead of a new one.
+
+  The first description of a family claims it and writes the report; later near-duplicates,
+  including ones requested while that report is still being written, wait for it. Keep one
+  index for a whole run and `save` it to reuse reports across runs.
+
+  Args:
+      threshold (float): Similarity above which a report is reused, see `LSHIndex`.
+      num_perm (int): MinHash signature length."""
+
+  def __init__(self, threshold=0.8, num_perm=128):
+    self.index = LSHIndex(threshold, num_perm)
+    self._reports = {}
+    self._written_at = {}
+    self._lock = threading.Lock()
+    self.stats = {"fresh": 0, "reused": 0, "refreshed": 0}
+
+  def claim(self, description):
+    """Returns (future, similarity) of a near-duplicate's report, or (None, None) if the caller
+    has to write the report and pass it to `resolve`. Exact repeats are left to the cache."""
+    with self._lock:
+      signature = self.index.hasher.signature(description)
+      for key, match_similarity in self.index.query(description, signature):
+        if key != description:
+          return self._reports[key], match_similarity
+      if description not in self._reports:
+        self.index.add(description, description)
+        self._reports[description] = Future()
+      return None, None
+
+  def resolve(self, description, report=None, error=None):
+    """Publishes the report (or failure) of a claimed description to waiting near-duplicates."""
+    with self._lock:
+      # Exact repeats all write the report and resolve it. The first failure forgets the
+      # description, and the first to finish settles the future for the others.
+      future = self._reports.get(description)
+      if future is None or future.done():
+        return
+      if error is not None:
+        future.set_exception(error)
+        # Forget the failed description so that the next near-duplicate tries again.
+        del self._reports[description]
+        self._rebuild_index()
+      else:
+        self._written_at[description] = time.time()
+        future.set_result(report)
+
+  def _rebuild_index(self):
+    index = LSHIndex(self.index.threshold, self.index.hasher.num_perm)
+    for key in self._reports:
+      index.add(key, key)
+    self.index = index
+
+  def count(self, outcome):
+    with self._lock:
+      self.stats[outcome] += 1
+
+  def save(self, path):
+    """Writes the finished reports and when they were written to a JSON file."""
+    with self._lock:
+      reports = {
+        description: {"report": future.result(), "written_at": self._written_at[description]}
+        for description, future in self._reports.items()
+        if future.done() and not future.exception() and description in self._written_at
+      }
+    with open(path, 'w') as f:
+      json.dump(reports, f)
+
+  def load(self, path, max_age_hours=24):
+    """Adds the reports of a file written by `save` that are younger than `max_age_hours`."""
+    with open(path) as f:
+      reports = json.load(f)
+    cutoff = time.time() - max_age_hours * 3600
+    with self._lock:
+      for description, entry in reports.items():
+        if description in self._reports or entry["written_at"] < cutoff:
+          continue
+        future = Future()
+        future.set_result(entry["report"])
+        self._reports[description] = future
+        self._written_at[description] = entry["written_at"]
+        self.index.add(description, description)
+    return self
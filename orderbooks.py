@@ -0,0 +1,144 @@
+"""Concurrent order book fetching from the Polymarket CLOB.
+
+Books are requested through the multi-token `/books` endpoint in batches, with the batches
+spread over a bounded thread pool. If the batch endpoint is unavailable or a batch keeps
+failing, the affected tokens fall back to single-token `/book` requests on the same pool.
+All requests go through the CLOB client's shared keep-alive HTTP connection pool.
+
+Point a `ClobClient` at a local host (e.g. `ClobClient("http://127.0.0.1:8080")`) to run
+this against a fake CLOB server that implements `POST /books` and `GET /book`.
+"""
+import copyreg
+import dataclasses
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import py_clob_client
+from py_clob_client.clob_types import BookParams, OrderBookSummary, OrderSummary
+
+def _reduce_dataclass(obj):
+  return type(obj), tuple(getattr(obj, field.name) for field in dataclasses.fields(obj))
+
+# The client's book classes override `__dict__` with a property returning a copy, so the default
+# pickling restores them empty. Pickle them by their fields instead, e.g. for book snapshots.
+copyreg.pickle(OrderBookSummary, _reduce_dataclass)
+copyreg.pickle(OrderSummary, _reduce_dataclass)
+
+# Status codes that indicate the batch endpoint itself is not supported by the server.
+BATCH_UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+
+def market_token_ids(markets, active_only=False):
+  """Returns the token ids of the given markets.
+
+  Args:
+      markets (dict): Maps condition_id to a CLOB market.
+      active_only (bool): Skip markets that are inactive or closed.
+
+  Returns:
+      list: Token ids in market order."""
+  token_ids = []
+  for market in markets.values():
+    if active_only and (not market.get('active') or market.get('closed')):
+      continue
+    for token in market.get('tokens', []):
+      token_id = token.get('token_id', None)
+      if token_id:
+        token_ids.append(token_id)
+  return token_ids
+
+def _is_retryable(error):
+  # Connection errors have no status code. Rate limits and server errors are transient.
+  return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+
+def _with_retries(call, retries, backoff_seconds):
+  for attempt in range(retries + 1):
+    try:
+      return call()
+    except py_clob_client.exceptions.PolyApiException as e:
+      if attempt == retries or not _is_retryable(e):
+        raise
+      time.sleep(backoff_seconds * (2 ** attempt) * (0.5 + random.random()))
+
+class OrderBookFetcher:
+  """Fetches order books for many tokens concurrently.
+
+  Args:
+      client (ClobClient): The CLOB client used for requests.
+      batch_size (int): Number of tokens per `/books` request. 0 disables the batch endpoint.
+      max_workers (int): Maximum number of concurrent requests.
+      retries (int): Retries per request on connection errors, 429s and 5xx responses.
+      backoff_seconds (float): Base delay of the jittered exponential backoff between retries."""
+
+  def __init__(self, client, batch_size=50, max_workers=8, retries=3, backoff_seconds=0.5):
+    self.client = client
+    self.batch_size = batch_size
+    self.max_workers = max_workers
+    self.retries = retries
+    self.backoff_seconds = backoff_seconds
+    self.batch_supported = batch_size > 0
+
+  def fetch_book(self, token_id):
+    """Fetches a single order book, retrying transient failures."""
+    return _with_retries(
+      lambda: self.client.get_order_book(token_id), self.retries, self.backoff_seconds)
+
+  def _fetch_batch(self, token_ids):
+    params = [BookParams(token_id=token_id) for token_id in token_ids]
+    books = _with_retries(
+      lambda: self.client.get_order_books(params), self.retries, self.backoff_seconds)
+    return {book.asset_id: book for book in books}
+
+  def _fetch_batch_or_fall_back(self, token_ids):
+    """Returns (books, token ids that still need a single-token request)."""
+    if not self.batch_supported:
+      return {}, token_ids
+    try:
+      books = self._fetch_batch(token_ids)
+    except py_clob_client.exceptions.PolyApiException as e:
+      if e.status_code in BATCH_UNSUPPORTED_STATUS_CODES:
+        if self.batch_supported:
+          print(f"Batch order book endpoint unavailable ({e.status_code}). Using single-token requests.")
+        self.batch_supported = False
+      else:
+        print(f"Error fetching order book batch of {len(token_ids)} tokens: {e}")
+      return {}, token_ids
+    # Tokens without a book are left out of the batch response and are not retried.
+    return books, []
+
+  def fetch(self, token_ids):
+    """Fetches the order books of all given tokens.
+
+    Args:
+        token_ids (list): Token ids to fetch. Duplicates are fetched once.
+
+    Returns:
+        dict: Maps token_id to OrderBookSummary. Tokens whose book could not be fetched are
+        logged and left out."""
+    token_ids = list(dict.fromkeys(token_ids))
+    token_id_to_book = {}
+    batches = [token_ids[i:i + self.batch_size] for i in range(0, len(token_ids), self.batch_size or 1)]
+
+    with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="orderbook") as pool:
+      batch_futures = [pool.submit(self._fetch_batch_or_fall_back, batch) for batch in batches]
+      single_futures = {}
+      for future in as_completed(batch_futures):
+        books, leftover_token_ids = future.result()
+        token_id_to_book.update(books)
+        for token_id in leftover_token_ids:
+          single_futures[pool.submit(self.fetch_book, token_id)] = token_id
+
+      for future in as_completed(single_futures):
+        token_id = single_futures[future]
+        try:
+          token_id_to_book[token_id] = future.result()
+        except py_clob_client.exceptions.PolyApiException as e:
+          print(f"Error fetching order book for token {token_id}: {e}")
+    return token_id_to_book
+
+def fetch_order_books(client, token_ids, **kwargs):
+  """Fetches the order books of the given tokens concurrently. See `OrderBookFetcher`.
+
+  Returns:
+      dict: Maps token_id to OrderBookSummary."""
+  return OrderBookFetcher(client, **kwargs).fetch(token_ids)
@@ -0,0 +1,104 @@
+"""Concurrent pagination for the Polymarket Gamma and CLOB APIs.
+
+Gamma pages are addressed by offset, so the offsets are known ahead of time and several pages
+are fetched at once. The crawl stops as soon as a page comes back empty (or fails) and pages
+past that point are discarded. CLOB pages are chained by `next_cursor`, so they cannot be
+fetched out of order, but the next page is requested while the current one is being consumed.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import http_client
+
+GAMMA_EVENTS_URL = "https://gamma-api.polymarket.com/events"
+# Cursor returned by the CLOB on the last page.
+CLOB_END_CURSOR = "LTE="
+
+def _fetch_gamma_page(url, params, limit, offset):
+  try:
+    response = http_client.default_client.get(url, params={**params, "limit": limit, "offset": offset})
+  except http_client.HttpError as e:
+    print(f"Error fetching {url} at offset {offset}: {e}")
+    return None
+  return response.json()
+
+def fetch_gamma_pages(url, params, limit=100, max_workers=8):
+  """Fetches every page of a Gamma list endpoint, several offsets at a time.
+
+  Args:
+      url (str): The Gamma endpoint, e.g. GAMMA_EVENTS_URL.
+      params (dict): Query parameters other than `limit` and `offset`.
+      limit (int): Page size.
+      max_workers (int): Maximum number of pages in flight.
+
+  Returns:
+      list: All items in offset order, up to the first empty or failed page."""
+  pages = {}
+  next_offset = 0
+  end_offset = None  # Offset of the first empty or failed page seen so far.
+  in_flight = {}
+  with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gamma") as pool:
+    while True:
+      while len(in_flight) < max_workers and (end_offset is None or next_offset < end_offset):
+        in_flight[pool.submit(_fetch_gamma_page, url, params, limit, next_offset)] = next_offset
+        next_offset += limit
+      if not in_flight:
+        break
+      done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+      for future in done:
+        offset = in_flight.pop(future)
+        if future.cancelled():
+          continue
+        batch = future.result()
+        if not batch:
+          end_offset = offset if end_offset is None else min(end_offset, offset)
+          # Pages beyond the end are not needed. Running ones finish and are ignored.
+          for pending in in_flight:
+            if in_flight[pending] > end_offset:
+              pending.cancel()
+        pages[offset] = batch
+
+  items = []
+  for offset in range(0, end_offset or 0, limit):
+    items.extend(pages[offset])
+  return items
+
+def fetch_all_gamma_events(limit=100, max_workers=8):
+  """Fetches all active, open events from the Gamma API, newest first."""
+  params = {
+    "closed": "false",
+    "active": "true",
+    "order": "createdAt",
+    "ascending": "false"
+  }
+  return fetch_gamma_pages(GAMMA_EVENTS_URL, params, limit=limit, max_workers=max_workers)
+
+def iter_clob_pages(fetch_page, next_cursor=""):
+  """Yields the `data` list of each page of a cursor-paginated CLOB endpoint.
+
+  The request for the next page is in flight while the caller processes the current one.
+
+  Args:
+      fetch_page (callable): Takes a cursor and returns the raw page, e.g. `client.get_markets`.
+      next_cursor (str): Cursor of the first page."""
+  with ThreadPoolExecutor(max_workers=1, thread_name_prefix="clob-pager") as pool:
+    future = pool.submit(fetch_page, next_cursor)
+    while future is not None:
+      response = future.result()
+      if not response or 'data' not in response:
+        return
+      next_cursor = response.get('next_cursor', '')
+      if next_cursor == CLOB_END_CURSOR or not next_cursor:
+        future = None
+      else:
+        future = pool.submit(fetch_page, next_cursor)
+      yield response['data']
+
+def fetch_all_clob_markets(client):
+  """Fetches all markets from the CLOB, prefetching each next page.
+
+  Returns:
+      list: All CLOB markets in page order."""
+  markets = []
+  for page in iter_clob_pages(lambda cursor: client.get_markets(next_cursor=cursor)):
+    markets.extend(page)
+  return markets
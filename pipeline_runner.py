@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Headless runner of the whole workflow, from catalog crawl to the ranked opportunity list.
+
+The notebook steps are stages of a `stage_dag.StageDag`:
+
+  crawl ── filter ── books ── triage ── report ── analyze ── parse ── score ── render
+  events ───────────────────────┘
+  (score also reads filter and books)
+
+crawl and events run concurrently, and report, analyze and parse run per market on their own
+worker pools, so each market moves on as soon as its report is written. With --no-triage the
+books are fetched while the reports are written. Every stage and every market is checkpointed
+under runs/<run id>/, and --resume continues the latest run: finished work is loaded from its
+checkpoints, and only failed, missing or stale work (changed inputs, or books and catalogs older
+than their maximum age) runs again.
+
+Usage:
+  python pipeline_runner.py [--days 1] [--stake 100] [--no-triage]
+  python pipeline_runner.py --resume [--run-id 20250101-120000]
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import dotenv
+from py_clob_client.client import ClobClient
+from py_clob_client.constants import POLYGON
+
+import cache_keys
+import disk_cache
+import market_store
+import market_sync
+import near_duplicates
+import orderbooks
+import pagination
+import prediction_pipeline
+import pretty_print_data
+import scoring
+import stage_dag
+import triage
+
+env = dotenv.dotenv_values(".env")
+HOST = "https://clob.polymarket.com"
+POLYMARKET_KEY = env["PK"]
+CHAIN_ID = POLYGON
+
+def describe_market(market):
+  """Returns the description the pipeline researches, or None for markets without question or rules."""
+  if not market.get('question') or not market.get('description'):
+    return None
+  return f"Question: {market['question']}\nDescription and Rules: {market['description']}"
+
+def filter_markets(markets, days, exclude_tags):
+  # Active, non-closed markets ending in the next `days` days, as in the notebook.
+  store = market_store.MarketStore(markets)
+  condition_ids = store.query(
+    end_after=timedelta(0), end_before=timedelta(days=days), active=True, closed=False,
+    require_tags=True, exclude_tags=exclude_tags)
+  print(f"Found {len(condition_ids)} markets ending in the next {days} days out of {len(markets)}")
+  return {condition_id: markets[condition_id] for condition_id in condition_ids}
+
+def triage_markets(markets, events, order_books, use_triage, max_spread=None):
+  """Picks the markets to research and the event report each of them shares, if any.
+
+  With `max_spread`, markets whose tightest bid/ask spread is wider, or that have no two-sided
+  book, are not researched.
+
+  Returns:
+      dict: `descriptions` (condition_id to description of the kept markets), `event_descriptions`
+        (condition_id to the description of its event report) and `skipped` (triage assessments)."""
+  descriptions = {}
+  for condition_id, market in markets.items():
+    description = describe_market(market)
+    if description:
+      descriptions[condition_id] = description
+  store = market_store.MarketStore(markets, events)
+  if max_spread is not None:
+    store.update_books(order_books)
+    tight = set(store.query(max_spread=max_spread))
+    print(f"{sum(k not in tight for k in descriptions)} markets have a spread over {max_spread}")
+    descriptions = {k: description for k, description in descriptions.items() if k in tight}
+  skipped = {}
+  if use_triage:
+    kept, skipped = triage.Triage().split(
+      {k: markets[k] for k in descriptions}, order_books, descriptions, store.volumes())
+    triage.skip_report(markets, skipped)
+    descriptions = {k: descriptions[k] for k in kept}
+  event_descriptions = {}
+  for event_description, condition_ids in prediction_pipeline.event_report_groups(store, descriptions).values():
+    for condition_id in condition_ids:
+      event_descriptions.setdefault(condition_id, event_description)
+  print(f"Researching {len(descriptions)} markets")
+  return {"descriptions": descriptions, "event_descriptions": event_descriptions, "skipped": skipped}
+
+def write_report(inputs, cache, reuse_index):
+  if inputs["event_description"]:
+    # Markets of one event ask for the same report at once; the tiered cache makes one call for them.
+    return prediction_pipeline.create_event_report(inputs["event_description"], cache=cache)
+  return prediction_pipeline.create_report(inputs["description"], cache=cache, reuse_index=reuse_index)
+
+def analyze(inputs, cache):
+  """Returns {"prediction": ...} when the prediction is cached, else {"analysis": raw analysis text}."""
+  key = cache_keys.make_key(
+    "prediction", prediction_pipeline.PREDICTION_CACHE_VERSION, inputs["report"], inputs["description"])
+  prediction = cache.get(key)
+  if prediction:
+    return {"prediction": prediction}
+  report = prediction_pipeline.compact_report(inputs["report"], inputs["description"])
+  return {"analysis": prediction_pipeline.create_market_prediction(report, inputs["description"])}
+
+def parse(inputs, cache):
+  prediction = inputs["analyzed"].get("prediction")
+  if not prediction:
+    prediction = prediction_pipeline.clean_parse_raw_prediction(inputs["analyzed"]["analysis"])
+    if not prediction:
+      raise ValueError("the analysis holds no valid prediction")
+    key = cache_keys.make_key(
+      "prediction", prediction_pipeline.PREDICTION_CACHE_VERSION, inputs["report"], inputs["description"])
+    cache.set(key, prediction)
+  return prediction
+
+def score(markets, order_books, predictions, args):
+  return scoring.rank_opportunities(
+    markets, order_books, predictions, risk_tolerance=args.risk_tolerance, stake=args.stake,
+    max_slippage=args.max_slippage)
+
+def render(summaries, run_dir, top):
+  pretty_print_data.pretty_print_markets(summaries[:top])
+  path = os.path.join(run_dir, "opportunities.json")
+  with open(path, 'w') as f:
+    json.dump(summaries, f, indent=2, default=str)
+  print(f"Wrote {len(summaries)} ranked tokens to {path}")
+  return path
+
+def build_stages(args, client, cache, reuse_index, run_dir):
+  """Returns the `stage_dag.Stage`s of the workflow."""
+  triage_deps = ["filter", "events"] + (["books"] if args.triage or args.max_spread is not None else [])
+  return [
+    stage_dag.Stage("crawl", [], lambda inputs: market_sync.sync_markets(client, snapshot_dir=args.snapshot_dir),
+                    version=args.snapshot_dir, max_age_hours=args.crawl_max_age_hours),
+    stage_dag.Stage("events", [], lambda inputs: pagination.fetch_all_gamma_events(),
+                    max_age_hours=args.crawl_max_age_hours),
+    stage_dag.Stage("filter", ["crawl"], lambda inputs: filter_markets(inputs["crawl"], args.days, args.exclude_tags),
+                    version=[args.days, args.exclude_tags]),
+    stage_dag.Stage("books", ["filter"],
+                    lambda inputs: orderbooks.fetch_order_books(client, orderbooks.market_token_ids(inputs["filter"])),
+                    max_age_hours=args.books_max_age_minutes / 60),
+    stage_dag.Stage("triage", triage_deps,
+                    lambda inputs: triage_markets(
+                      inputs["filter"], inputs["events"], inputs.get("books", {}), args.triage, args.max_spread),
+                    version=[args.triage, args.max_spread]),
+    stage_dag.Stage(
+      "report", ["triage"], lambda key, inputs: write_report(inputs, cache, reuse_index), per_market=True,
+      markets=lambda outputs: list(outputs["triage"]["descriptions"]),
+      market_inputs=lambda key, outputs: {
+        "description": outputs["triage"]["descriptions"][key],
+        "event_description": outputs["triage"]["event_descriptions"].get(key),
+      },
+      version=[prediction_pipeline.REPORT_CACHE_VERSION, prediction_pipeline.EVENT_REPORT_CACHE_VERSION],
+      pool="perplexity"),
+    stage_dag.Stage(
+      "analyze", ["report", "triage"], lambda key, inputs: analyze(inputs, cache), per_market=True,
+      market_inputs=lambda key, outputs: {
+        "report": outputs["report"][key], "description": outputs["triage"]["descriptions"][key]},
+      version=prediction_pipeline.PREDICTION_CACHE_VERSION, pool="gemini"),
+    stage_dag.Stage(
+      "parse", ["analyze", "report", "triage"], lambda key, inputs: parse(inputs, cache), per_market=True,
+      market_inputs=lambda key, outputs: {
+        "analyzed": outputs["analyze"][key], "report": outputs["report"][key],
+        "description": outputs["triage"]["descriptions"][key]},
+      version=prediction_pipeline.PREDICTION_CACHE_VERSION),
+    stage_dag.Stage("score", ["filter", "books", "parse"],
+                    lambda inputs: score(inputs["filter"], inputs["books"], inputs["parse"], args),
+                    version=[args.risk_tolerance, args.stake, args.max_slippage]),
+    stage_dag.Stage("render", ["score"], lambda inputs: render(inputs["score"], run_dir, args.top), version=args.top),
+  ]
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--resume", action="store_true", help="continue the latest run (or --run-id)")
+  parser.add_argument("--run-id", help="run to create or resume, defaults to a timestamp")
+  parser.add_argument("--runs-dir", default="runs")
+  parser.add_argument("--snapshot-dir", default="snapshots")
+  parser.add_argument("--days", type=float, default=1, help="research markets ending within this many days")
+  parser.add_argument("--exclude-tags", nargs="*", default=["Sports"])
+  parser.add_argument("--no-triage", dest="triage", action="store_false", help="research every filtered market")
+  parser.add_argument("--max-spread", type=float, help="skip markets with a wider bid/ask spread, e.g. 0.03")
+  parser.add_argument("--risk-tolerance", type=float, default=scoring.DEFAULT_RISK_TOLERANCE)
+  parser.add_argument("--stake", type=float, default=100, help="dollars simulated through each book")
+  parser.add_argument("--max-slippage", type=float)
+  parser.add_argument("--top", type=int, default=20, help="opportunities to print")
+  parser.add_argument("--report-concurrency", type=int, default=4)
+  parser.add_argument("--analysis-concurrency", type=int, default=8)
+  parser.add_argument("--crawl-max-age-hours", type=float, default=6, help="recrawl older catalogs on resume")
+  parser.add_argument("--books-max-age-minutes", type=float, default=15, help="refetch older books on resume")
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_args(argv)
+  run_id = args.run_id
+  if run_id is None and args.resume:
+    runs = sorted(os.listdir(args.runs_dir)) if os.path.isdir(args.runs_dir) else []
+    if not runs:
+      print(f"No run to resume in {args.runs_dir}")
+      return 1
+    run_id = runs[-1]
+  run_id = run_id or datetime.now().strftime('%Y%m%d-%H%M%S')
+  run_dir = os.path.join(args.runs_dir, run_id)
+  print(f"{'Resuming' if args.resume else 'Starting'} run {run_id}")
+
+  client = ClobClient(HOST, key=POLYMARKET_KEY, chain_id=CHAIN_ID)
+  client.set_api_creds(client.create_or_derive_api_creds())
+  cache = disk_cache.TieredCache(
+    disk_cache.SQLiteCache(path="api_cache.sqlite", expiry_hours=24, max_bytes=2 * 1024**3), max_items=2048)
+  reuse_index_path = os.path.join(args.snapshot_dir, "report_reuse_index.json")
+  reuse_index = near_duplicates.ReportReuseIndex(threshold=0.7)
+  if os.path.exists(reuse_index_path):
+    reuse_index.load(reuse_index_path, max_age_hours=24)
+
+  dag = stage_dag.StageDag(
+    build_stages(args, client, cache, reuse_index, run_dir), run_dir, resume=args.resume,
+    pools={"perplexity": args.report_concurrency, "gemini": args.analysis_concurrency, "local": 4})
+  dag.run()
+  os.makedirs(args.snapshot_dir, exist_ok=True)
+  reuse_index.save(reuse_index_path)
+  dag.report()
+  if dag.errors:
+    print(f"{len(dag.errors)} tasks failed. Rerun with --resume --run-id {run_id} to retry them.")
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""Long-running mode that keeps predictions and the ranked opportunity list current.
+
+Instead of re-researching every market once a day, each market gets a research deadline and
+waits in a priority queue. The time between researches shrinks as the market nears its close
+and as its price moves:
+
+  interval = clamp(hours_to_close * close_fraction, min, max) / (1 + price_move / move_scale)
+
+and a market is due once its report is older than its interval. Book updates keep the price
+moves current and pull a market's deadline forward when its price starts moving.
+
+Only the stages whose inputs changed run again:
+  - a book update re-scores that token (`live_scoring.LiveScorer`), without any LLM call;
+  - a due market's report is updated with the developments since it was written, by the
+    cheaper refresh model (`prediction_pipeline.update_report`). When the model finds no
+    material change, the report and prediction are kept and no analysis runs;
+  - a new market, or one whose rules changed, gets a new report, and every market gets a full
+    new report after `full_report_hours` so that errors do not pile up over many updates.
+The market catalog is re-synced periodically, and markets that triage skips are reconsidered
+at each sync.
+
+Usage:
+  python prediction_daemon.py [--days 1] [--stake 100] [--sync-hours 1]
+"""
+import argparse
+import heapq
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from py_clob_client.client import ClobClient
+
+import disk_cache
+import live_scoring
+import market_data
+import market_store
+import market_sync
+import near_duplicates
+import orderbooks
+import pipeline_runner
+import prediction_pipeline
+import pretty_print_data
+import rate_limiter
+import scoring
+import triage
+
+class ResearchPolicy:
+  """Decides how long a market's research stays fresh.
+
+  Args:
+      min_interval_hours (float): Shortest time between two researches of a market.
+      max_interval_hours (float): Longest time, for far-out and quiet markets.
+      close_fraction (float): Fraction of the time to close between researches of a quiet market,
+        e.g. 0.25 re-researches a market closing in 8 hours every 2 hours.
+      move_scale (float): A mid-price move of this size (in probability) halves the interval.
+      move_window_minutes (float): Window over which price moves are measured.
+      full_report_hours (float): Age of a market's last full report after which it is written
+        anew instead of updated."""
+
+  def __init__(self, min_interval_hours=0.25, max_interval_hours=24.0, close_fraction=0.25, move_scale=0.05,
+               move_window_minutes=60, full_report_hours=12.0):
+    self.min_interval_hours = min_interval_hours
+    self.max_interval_hours = max_interval_hours
+    self.close_fraction = close_fraction
+    self.move_scale = move_scale
+    self.move_window_minutes = move_window_minutes
+    self.full_report_hours = full_report_hours
+
+  def interval_hours(self, hours_to_close, price_move):
+    if hours_to_close is None:
+      base = self.max_interval_hours
+    else:
+      base = min(max(hours_to_close * self.close_fraction, self.min_interval_hours), self.max_interval_hours)
+    return max(self.min_interval_hours, base / (1 + price_move / self.move_scale))
+
+class PriceMoves:
+  """Tracks each market's mid price over a sliding window.
+
+  Args:
+      window_seconds (float): How far back moves are measured."""
+
+  def __init__(self, window_seconds=3600):
+    self.window_seconds = window_seconds
+    self._mids = defaultdict(deque)
+    self._lock = threading.Lock()
+
+  def record(self, condition_id, mid, now=None):
+    now = time.time() if now is None else now
+    with self._lock:
+      mids = self._mids[condition_id]
+      mids.append((now, mid))
+      while mids and mids[0][0] < now - self.window_seconds:
+        mids.popleft()
+
+  def move(self, condition_id):
+    """Returns the range (max - min) of the market's mid over the window, 0 without data."""
+    with self._lock:
+      mids = [mid for _, mid in self._mids.get(condition_id, ())]
+    return max(mids) - min(mids) if mids else 0.0
+
+  def forget(self, condition_id):
+    with self._lock:
+      self._mids.pop(condition_id, None)
+
+class ResearchQueue:
+  """Priority queue of markets by research deadline (epoch seconds), earliest first.
+
+  Rescheduling a market pushes a new entry and bumps its version, so superseded entries are
+  skipped when popped."""
+
+  def __init__(self):
+    self._heap = []
+    self._deadlines = {}
+    self._versions = defaultdict(int)
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._deadlines)
+
+  def __contains__(self, condition_id):
+    return condition_id in self._deadlines
+
+  def deadline(self, condition_id):
+    return self._deadlines.get(condition_id)
+
+  def schedule(self, condition_id, deadline):
+    with self._lock:
+      self._versions[condition_id] += 1
+      self._deadlines[condition_id] = deadline
+      heapq.heappush(self._heap, (deadline, self._versions[condition_id], condition_id))
+
+  def remove(self, condition_id):
+    with self._lock:
+      self._versions[condition_id] += 1
+      self._deadlines.pop(condition_id, None)
+
+  def _drop_stale(self):
+    while self._heap:
+      deadline, version, condition_id = self._heap[0]
+      if self._versions[condition_id] == version:
+        return
+      heapq.heappop(self._heap)
+
+  def pop_due(self, now, limit):
+    """Removes and returns up to `limit` markets whose deadline has passed, most overdue first."""
+    due = []
+    with self._lock:
+      self._drop_stale()
+      while self._heap and len(due) < limit and self._heap[0][0] <= now:
+        _, _, condition_id = heapq.heappop(self._heap)
+        del self._deadlines[condition_id]
+        self._versions[condition_id] += 1
+        due.append(condition_id)
+        self._drop_stale()
+    return due
+
+  def next_deadline(self):
+    with self._lock:
+      self._drop_stale()
+      return self._heap[0][0] if self._heap else None
+
+class PredictionDaemon:
+  """Keeps the research of a filtered market universe fresh and its ranking live.
+
+  Args:
+      client (ClobClient): CLOB client for catalog syncs and book resyncs.
+      cache: Cache of reports and predictions, see `prediction_pipeline.create_predictions`.
+      policy (ResearchPolicy): When research is due.
+      days (float): Markets ending within this many days are followed.
+      exclude_tags (list): Tags of markets that are not followed.
+      risk_tolerance, stake, max_slippage: Ranking settings, see `live_scoring.LiveScorer`.
+      sync_hours (float): Time between catalog syncs.
+      max_concurrency (int): Markets researched at once.
+      reuse_index (ReportReuseIndex): Optional index for reusing near-duplicate reports.
+      market_triage (Triage): Skips markets without a realistic edge. None researches every market.
+      max_spread (float): Skips markets whose tightest bid/ask spread is wider, or that have no
+        two-sided book, at each sync. None follows markets of any spread."""
+
+  def __init__(self, client, cache, policy=None, days=1, exclude_tags=("Sports",),
+               risk_tolerance=scoring.DEFAULT_RISK_TOLERANCE, stake=100, max_slippage=None, sync_hours=1.0,
+               max_concurrency=4, reuse_index=None, market_triage=None, snapshot_dir="snapshots",
+               max_spread=None):
+    self.client = client
+    self.cache = cache
+    self.policy = policy or ResearchPolicy()
+    self.days = days
+    self.exclude_tags = list(exclude_tags)
+    self.risk_tolerance = risk_tolerance
+    self.stake = stake
+    self.max_slippage = max_slippage
+    self.sync_hours = sync_hours
+    self.max_concurrency = max_concurrency
+    self.reuse_index = reuse_index
+    self.market_triage = market_triage
+    self.snapshot_dir = snapshot_dir
+    self.max_spread = max_spread
+
+    self.markets = {}
+    self.descriptions = {}
+    # condition_id -> {report, description it was written for, written_at (last written or
+    # updated), full_at (last full report), checked_at (last research)}, as epoch seconds.
+    self.reports = {}
+    self.predictions = {}
+    self.queue = ResearchQueue()
+    self.moves = PriceMoves(self.policy.move_window_minutes * 60)
+    self.stream = None
+    self.scorer = None
+    self._token_markets = {}
+    self._last_sync = None
+    self._running = set()
+    self._stop = threading.Event()
+    # Guards reports, predictions and stats, which the book stream's thread reads.
+    self._lock = threading.Lock()
+    self.stats = {"syncs": 0, "new_reports": 0, "updates": 0, "unchanged": 0, "book_updates": 0,
+                  "pulled_forward": 0, "failures": 0}
+
+  def _hours_to_close(self, condition_id, now):
+    end = market_store._timestamp(self.markets.get(condition_id, {}).get('end_date_iso'))
+    return None if end is None else (end - now) / 3600
+
+  def _deadline(self, condition_id, written_at, now):
+    interval = self.policy.interval_hours(self._hours_to_close(condition_id, now), self.moves.move(condition_id))
+    return written_at + interval * 3600
+
+  def sync(self):
+    """Syncs the catalog, follows new markets, drops finished ones and restarts the book stream."""
+    now = time.time()
+    catalog = market_sync.sync_markets(self.client, snapshot_dir=self.snapshot_dir)
+    markets = pipeline_runner.filter_markets(catalog, self.days, self.exclude_tags)
+    descriptions = {}
+    for condition_id, market in markets.items():
+      description = pipeline_runner.describe_market(market)
+      if description:
+        descriptions[condition_id] = description
+    with self._lock:
+      for condition_id in set(self.markets) - set(markets):
+        self.queue.remove(condition_id)
+        self.moves.forget(condition_id)
+        self.reports.pop(condition_id, None)
+        self.predictions.pop(condition_id, None)
+    self.markets = markets
+    self.descriptions = descriptions
+    self._token_markets = {token['token_id']: condition_id for condition_id, market in markets.items()
+                           for token in market.get('tokens', [])}
+
+    token_ids = orderbooks.market_token_ids(markets)
+    if self.stream is None or set(token_ids) != set(self.stream.token_ids):
+      if self.stream is not None:
+        self.stream.stop()
+      self.stream = market_data.OrderBookStream(self.client, token_ids, on_update=self._on_book)
+      self.stream.start()
+      print(f"Streaming {self.stream.wait_ready(timeout=30)} of {len(token_ids)} order books")
+    books = self.stream.views()
+
+    store = market_store.MarketStore(markets)
+    followed = list(descriptions)
+    if self.max_spread is not None:
+      store.update_books(books)
+      tight = set(store.query(max_spread=self.max_spread))
+      for condition_id in followed:
+        if condition_id not in tight:
+          self.queue.remove(condition_id)
+      print(f"{sum(k not in tight for k in followed)} markets have a spread over {self.max_spread}")
+      followed = [condition_id for condition_id in followed if condition_id in tight]
+    if self.market_triage is not None:
+      followed, skipped = self.market_triage.split(
+        {k: markets[k] for k in descriptions}, books, descriptions, store.volumes())
+      for condition_id in skipped:
+        self.queue.remove(condition_id)
+    for condition_id in followed:
+      with self._lock:
+        report = self.reports.get(condition_id)
+        if report is not None and report["description"] != descriptions[condition_id]:
+          # The rules changed, so the old report no longer applies.
+          del self.reports[condition_id]
+          report = None
+      if condition_id not in self.queue and condition_id not in self._running:
+        self.queue.schedule(
+          condition_id, now if report is None else self._deadline(condition_id, report["checked_at"], now))
+    self._rebuild_scorer()
+    self._last_sync = now
+    with self._lock:
+      self.stats["syncs"] += 1
+    print(f"Following {len(followed)} of {len(markets)} markets, {len(self.predictions)} with predictions")
+
+  def _rebuild_scorer(self):
+    with self._lock:
+      predictions = dict(self.predictions)
+    universe = scoring.ScoringUniverse(self.markets, self.stream.views(), predictions)
+    self.scorer = live_scoring.LiveScorer(
+      universe, risk_tolerance=self.risk_tolerance, stake=self.stake, max_slippage=self.max_slippage)
+
+  def _on_book(self, token_id, book):
+    with self._lock:
+      self.stats["book_updates"] += 1
+    scorer = self.scorer
+    if scorer is not None:
+      scorer.on_book(token_id, book)
+    condition_id = self._token_markets.get(token_id)
+    market = self.markets.get(condition_id)
+    if market is None:
+      return
+    # Only this market's books, so a book update does not cost a pass over every streamed token.
+    books = self.stream.views(token['token_id'] for token in market.get('tokens', []))
+    mid = triage.market_features(market, books)["mid"]
+    if mid is None:
+      return
+    self.moves.record(condition_id, mid)
+    # A moving price pulls the deadline forward. Quiet markets keep theirs until researched.
+    with self._lock:
+      report = self.reports.get(condition_id)
+    deadline = self.queue.deadline(condition_id)
+    if report is not None and deadline is not None:
+      moved_deadline = self._deadline(condition_id, report["checked_at"], time.time())
+      if moved_deadline < deadline - 60:
+        self.queue.schedule(condition_id, moved_deadline)
+        with self._lock:
+          self.stats["pulled_forward"] += 1
+
+  def research(self, description, previous):
+    """Brings one market's report and prediction up to date. Runs on a worker thread, so it only
+    reads its arguments; `run` stores the result.
+
+    Args:
+        description (str): The market's description.
+        previous (dict): The market's entry in `reports`, or None.
+
+    Returns:
+        tuple: (new `reports` entry, prediction or None to keep the current one, kind of
+          research: new_reports, updates or unchanged)"""
+    now = time.time()
+    if previous is None or now - previous["full_at"] > self.policy.full_report_hours * 3600:
+      if previous is None:
+        report = prediction_pipeline.create_report(description, cache=self.cache, reuse_index=self.reuse_index)
+      else:
+        # Cached reports of the description would be as old as this one.
+        report = prediction_pipeline.write_report(description)
+      entry = {"report": report, "description": description, "written_at": now, "full_at": now, "checked_at": now}
+      kind = "new_reports"
+    else:
+      report = prediction_pipeline.update_report(
+        previous["report"], description, datetime.fromtimestamp(previous["written_at"], timezone.utc))
+      if report is None:
+        return dict(previous, checked_at=now), None, "unchanged"
+      entry = dict(previous, report=report, written_at=now, checked_at=now)
+      kind = "updates"
+    return entry, prediction_pipeline.create_prediction_from_report(report, description, cache=self.cache), kind
+
+  def _apply(self, condition_id, prediction):
+    with self._lock:
+      new_market = condition_id not in self.predictions
+      self.predictions[condition_id] = prediction
+    if new_market:
+      # The universe packs only predicted markets, so a first prediction adds rows.
+      self._rebuild_scorer()
+    else:
+      self.scorer.on_prediction(condition_id, prediction)
+
+  def top(self, k=10):
+    return self.scorer.summaries(k) if self.scorer is not None else []
+
+  def stop(self):
+    self._stop.set()
+
+  def run(self, render_seconds=300, top=10, idle_seconds=5):
+    """Runs until `stop` is called: syncs, researches due markets and prints the ranking."""
+    pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="research")
+    running = {}
+    last_render = 0.0
+    try:
+      while not self._stop.is_set():
+        now = time.time()
+        if self._last_sync is None or now - self._last_sync > self.sync_hours * 3600:
+          try:
+            self.sync()
+          except Exception as e:
+            # Keep following the current markets and try again at the next sync.
+            print(f"Error: market sync failed: {e}. Retrying in {self.sync_hours} hours.")
+            self._last_sync = now
+        for condition_id in self.queue.pop_due(now, self.max_concurrency - len(running)):
+          description = self.descriptions.get(condition_id)
+          if description is None:
+            continue
+          with self._lock:
+            # Without a prediction to keep, an update that finds no change would leave none.
+            previous = self.reports.get(condition_id) if condition_id in self.predictions else None
+          running[pool.submit(self.research, description, previous)] = (condition_id, description)
+          self._running.add(condition_id)
+        if running:
+          done, _ = wait(running, timeout=idle_seconds, return_when=FIRST_COMPLETED)
+        else:
+          done = ()
+          next_deadline = self.queue.next_deadline()
+          self._stop.wait(idle_seconds if next_deadline is None else min(idle_seconds, max(0, next_deadline - now)))
+        for future in done:
+          condition_id, description = running.pop(future)
+          self._running.discard(condition_id)
+          if condition_id not in self.markets:
+            continue
+          if self.descriptions.get(condition_id) != description:
+            # The rules changed while the market was researched. Research it again.
+            self.queue.schedule(condition_id, time.time())
+            continue
+          try:
+            entry, prediction, kind = future.result()
+          except rate_limiter.BudgetExceeded as e:
+            print(f"Error: {e}. Retrying {condition_id} later.")
+            self.queue.schedule(condition_id, time.time() + self.policy.max_interval_hours * 3600 / 4)
+            continue
+          except Exception as e:
+            with self._lock:
+              self.stats["failures"] += 1
+            print(f"Error: research failed for {condition_id}: {e}")
+            self.queue.schedule(condition_id, time.time() + self.policy.min_interval_hours * 3600)
+            continue
+          with self._lock:
+            self.reports[condition_id] = entry
+            self.stats[kind] += 1
+          if prediction:
+            self._apply(condition_id, prediction)
+          self.queue.schedule(condition_id, self._deadline(condition_id, entry["checked_at"], time.time()))
+        if time.time() - last_render > render_seconds:
+          last_render = time.time()
+          self.render(top)
+    finally:
+      pool.shutdown(wait=False, cancel_futures=True)
+      if self.stream is not None:
+        self.stream.stop()
+
+  def render(self, top=10):
+    with self._lock:
+      predictions = len(self.predictions)
+      stats = dict(self.stats)
+    print(f"\n{datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC: {predictions} predictions, "
+          f"{len(self.queue)} queued, next due {self._next_due_text()}. {stats}")
+    pretty_print_data.pretty_print_markets(self.top(top))
+
+  def _next_due_text(self):
+    deadline = self.queue.next_deadline()
+    if deadline is None:
+      return "never"
+    return f"in {max(0, deadline - time.time()) / 60:.0f} min"
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--days", type=float, default=1)
+  parser.add_argument("--exclude-tags", nargs="*", default=["Sports"])
+  parser.add_argument("--no-triage", dest="triage", action="store_false")
+  parser.add_argument("--risk-tolerance", type=float, default=scoring.DEFAULT_RISK_TOLERANCE)
+  parser.add_argument("--stake", type=float, default=100)
+  parser.add_argument("--max-slippage", type=float)
+  parser.add_argument("--sync-hours", type=float, default=1.0)
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--min-interval-hours", type=float, default=0.25)
+  parser.add_argument("--max-interval-hours", type=float, default=24.0)
+  parser.add_argument("--full-report-hours", type=float, default=12.0)
+  parser.add_argument("--max-spread", type=float, help="skip markets with a wider bid/ask spread")
+  parser.add_argument("--render-minutes", type=float, default=5)
+  parser.add_argument("--top", type=int, default=10)
+  args = parser.parse_args(argv)
+
+  client = ClobClient(pipeline_runner.HOST, key=pipeline_runner.POLYMARKET_KEY, chain_id=pipeline_runner.CHAIN_ID)
+  client.set_api_creds(client.create_or_derive_api_creds())
+  cache = disk_cache.TieredCache(
+    disk_cache.SQLiteCache(path="api_cache.sqlite", expiry_hours=24, max_bytes=2 * 1024**3), max_items=2048)
+  daemon = PredictionDaemon(
+    client, cache, ResearchPolicy(
+      args.min_interval_hours, args.max_interval_hours, full_report_hours=args.full_report_hours), days=args.days,
+    exclude_tags=args.exclude_tags, risk_tolerance=args.risk_tolerance, stake=args.stake,
+    max_slippage=args.max_slippage, sync_hours=args.sync_hours, max_concurrency=args.concurrency,
+    reuse_index=near_duplicates.ReportReuseIndex(threshold=0.7),
+    market_triage=triage.Triage() if args.triage else None, max_spread=args.max_spread)
+  try:
+    daemon.run(render_seconds=args.render_minutes * 60, top=args.top)
+  except KeyboardInterrupt:
+    daemon.stop()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,145 @@
+"""Local extraction and validation of the prediction JSON written by the analysis model.
+
+The analysis model is asked for JSON only, but often wraps it in code fences, puts prose
+before or after it, leaves trailing commas or writes raw newlines inside `reasoning`.
+`parse_prediction` repairs these cases without another LLM call and checks the result
+against the prediction schema.
+"""
+import json
+import re
+
+class PredictionParseError(ValueError):
+  """Raised when text does not contain a valid prediction object."""
+
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+
+def _json_object_candidates(text):
+  """Yields each balanced top-level {...} span in text, outermost first."""
+  start = None
+  depth = 0
+  in_string = False
+  escaped = False
+  for i, char in enumerate(text):
+    if in_string:
+      if escaped:
+        escaped = False
+      elif char == '\\':
+        escaped = True
+      elif char == '"':
+        in_string = False
+    elif char == '"' and depth > 0:
+      in_string = True
+    elif char == '{':
+      if depth == 0:
+        start = i
+      depth += 1
+    elif char == '}' and depth > 0:
+      depth -= 1
+      if depth == 0:
+        yield text[start:i + 1]
+
+def _remove_trailing_commas(candidate):
+  # Only outside strings: split on string literals and clean the parts in between.
+  parts = re.split(r'("(?:\\.|[^"\\])*")', candidate)
+  return ''.join(
+    part if index % 2 else _TRAILING_COMMA.sub(r'\1', part) for index, part in enumerate(parts))
+
+def _probability(value, name):
+  if isinstance(value, str):
+    try:
+      value = float(value.strip())
+    except ValueError:
+      raise PredictionParseError(f"{name} is not a number: {value!r}")
+  if isinstance(value, bool) or not isinstance(value, (int, float)):
+    raise PredictionParseError(f"{name} is not a number: {value!r}")
+  if not 0 <= value <= 1:
+    raise PredictionParseError(f"{name} is outside [0, 1]: {value}")
+  return float(value)
+
+def validate_prediction(prediction):
+  """Checks a decoded prediction against the schema and returns a normalized copy.
+
+  Args:
+      prediction (dict): The decoded prediction.
+
+  Returns:
+      dict: The prediction with numeric fields as floats.
+
+  Raises:
+      PredictionParseError: If a required field is missing or out of range."""
+  if not isinstance(prediction, dict):
+    raise PredictionParseError("Prediction is not a JSON object")
+  uncertainty = prediction.get('uncertainty')
+  if not isinstance(uncertainty, dict):
+    raise PredictionParseError("Missing uncertainty object")
+  for key in ('probability', 'model_confidence'):
+    if key not in prediction:
+      raise PredictionParseError(f"Missing {key}")
+  for key in ('lower_bound', 'upper_bound', 'confidence_level'):
+    if key not in uncertainty:
+      raise PredictionParseError(f"Missing uncertainty.{key}")
+
+  normalized = dict(prediction)
+  normalized['probability'] = _probability(prediction['probability'], 'probability')
+  normalized['model_confidence'] = _probability(prediction['model_confidence'], 'model_confidence')
+  normalized['uncertainty'] = {
+    **uncertainty,
+    'lower_bound': _probability(uncertainty['lower_bound'], 'uncertainty.lower_bound'),
+    'upper_bound': _probability(uncertainty['upper_bound'], 'uncertainty.upper_bound'),
+    'confidence_level': _probability(uncertainty['confidence_level'], 'uncertainty.confidence_level'),
+  }
+  if normalized['uncertainty']['lower_bound'] > normalized['uncertainty']['upper_bound']:
+    raise PredictionParseError("uncertainty.lower_bound is above uncertainty.upper_bound")
+  reasoning = prediction.get('reasoning', '')
+  normalized['reasoning'] = reasoning if isinstance(reasoning, str) else json.dumps(reasoning)
+  return normalized
+
+def parse_prediction(text):
+  """Extracts and validates the prediction object from raw model output.
+
+  Args:
+      text (str): Raw analysis output.
+
+  Returns:
+      dict: The validated prediction, see `validate_prediction`.
+
+  Raises:
+      PredictionParseError: If no valid prediction object can be recovered."""
+  text = text.replace('```json', '').replace('```', '')
+  last_error = PredictionParseError("No JSON object found")
+  for candidate in _json_object_candidates(text):
+    for attempt in (candidate, _remove_trailing_commas(candidate)):
+      try:
+        # strict=False accepts raw newlines and tabs inside strings.
+        return validate_prediction(json.loads(attempt, strict=False))
+      except json.JSONDecodeError as e:
+        last_error = PredictionParseError(f"Invalid JSON: {e}")
+      except PredictionParseError as e:
+        last_error = e
+        break
+  raise last_error
+
+def parse_final_prediction(text):
+  """Returns the prediction once a streamed analysis has finished writing it, else None.
+
+  The analysis answers with one JSON object. It counts as final once it has closed and opens
+  the response, with nothing but whitespace or a code fence before it. An example object quoted
+  in prose before the answer therefore never ends a stream early.
+
+  Args:
+      text (str): The analysis output received so far."""
+  text = text.lstrip()
+  if text.startswith('```'):
+    text = text[3:]
+    if text.startswith('json'):
+      text = text[4:]
+    text = text.lstrip()
+  if not text.startswith('{'):
+    return None
+  candidate = next(_json_object_candidates(text), None)
+  if candidate is None:
+    return None
+  try:
+    return parse_prediction(candidate)
+  except PredictionParseError:
+    return None
@@ -1,11 +1,21 @@
+import collections
 import json
 import dotenv
 import os
-import requests
+import statistics
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import google.generativeai as genai
 from google.ai.generativelanguage_v1beta.types import content
 
+import cache_keys
+import http_client
+import prediction_parser
 import prompts
+import rate_limiter
+import region_router
+import report_compaction
 
 env = dotenv.dotenv_values(".env")
 genai.configure(api_key=env["GEMINI_API_KEY"])
@@ -42,27 +52,409 @@ regions = [
 	"me-west1"
 ]
 
-def create_report(market_description, cache=None):
+REPORT_MODEL = "sonar-pro"
+REPORT_CONFIG = {
+  "max_tokens": "65536",
+  "temperature": 0.2,
+  "top_p": 0.3,
+  "search_domain_filter": [],
+  "return_images": False,
+  "return_related_questions": False,
+  "search_recency_filter": "month",
+  "top_k": 40,
+  "stream": False,
+  "frequency_penalty": 1.1,
+  "response_format": None
+}
+
+ANALYSIS_MODEL = "gemini-2.0-flash-thinking-exp-01-21"
+# ANALYSIS_MODEL = "gemini-2.0-flash"
+ANALYSIS_CONFIG = {
+  "temperature": 0.2,
+  "top_p": 0.1,
+  "top_k": 40,
+  "max_output_tokens": 65536,
+  "response_mime_type": "text/plain",
+}
+# Reports are compacted to this many tokens before the analysis, see `report_compaction`. Event
+# reports cover several markets, so most of one is irrelevant to any single market's analysis.
+# None passes reports through unchanged.
+REPORT_TOKEN_BUDGET = 3000
+
+# Cheaper search model that updates a near-duplicate market's report instead of writing a new one,
+# and a market's own report with what happened since it was written (`update_report`).
+REFRESH_MODEL = "sonar"
+# Reply of `update_report`'s model when nothing material changed.
+NO_MATERIAL_CHANGE = "NO MATERIAL CHANGE"
+
+JSON_PARSE_MODEL = "gemini-2.0-flash-lite-preview-02-05"
+JSON_PARSE_CONFIG = {
+  "temperature": 0.0,
+  "top_p": 0.1,
+  "top_k": 20,
+  "max_output_tokens": 8192,
+  "response_schema": content.Schema(
+    type = content.Type.OBJECT,
+    enum = [],
+    required = ["reasoning", "probability", "uncertainty", "model_confidence"],
+    properties = {
+      "probability": content.Schema(
+        type = content.Type.NUMBER,
+      ),
+      "uncertainty": content.Schema(
+        type = content.Type.OBJECT,
+        enum = [],
+        required = ["lower_bound", "upper_bound", "confidence_level"],
+        properties = {
+          "lower_bound": content.Schema(
+            type = content.Type.NUMBER,
+          ),
+          "upper_bound": content.Schema(
+            type = content.Type.NUMBER,
+          ),
+          "confidence_level": content.Schema(
+            type = content.Type.NUMBER,
+          ),
+        },
+      ),
+      "model_confidence": content.Schema(
+        type = content.Type.NUMBER,
+      ),
+      "reasoning": content.Schema(
+        type = content.Type.STRING,
+      ),
+    },
+  ),
+  "response_mime_type": "application/json",
+}
+
+# Fast model for the triage estimate that decides whether a market is worth a report.
+TRIAGE_MODEL = JSON_PARSE_MODEL
+TRIAGE_CONFIG = {
+  "temperature": 0.0,
+  "max_output_tokens": 64,
+  "response_schema": content.Schema(
+    type = content.Type.OBJECT,
+    required = ["probability"],
+    properties = {
+      "probability": content.Schema(
+        type = content.Type.NUMBER,
+      ),
+    },
+  ),
+  "response_mime_type": "application/json",
+}
+
+# Cache key versions per stage. They change whenever a stage's model, config or prompts change,
+# so a deploy only cold-starts the stages that were edited. Bump the first argument when a
+# stage's code changes the shape of its cached output.
+REPORT_CACHE_VERSION = cache_keys.stage_version(
+  1, REPORT_MODEL, REPORT_CONFIG,
+  prompts.report_system_prompt, prompts.report_content_template("{market_description}"))
+EVENT_REPORT_CACHE_VERSION = cache_keys.stage_version(
+  1, REPORT_MODEL, REPORT_CONFIG,
+  prompts.report_system_prompt, prompts.event_report_content_template("{event_description}"))
+REFRESH_CACHE_VERSION = cache_keys.stage_version(
+  1, REFRESH_MODEL, REPORT_CONFIG,
+  prompts.report_system_prompt, prompts.report_refresh_content_template("{previous_report}", "{market_description}"))
+PREDICTION_CACHE_VERSION = cache_keys.stage_version(
+  1, [ANALYSIS_MODEL, JSON_PARSE_MODEL], [ANALYSIS_CONFIG, JSON_PARSE_CONFIG, {"report_token_budget": REPORT_TOKEN_BUDGET}],
+  prompts.prediction_system_prompt,
+  prompts.prediction_content_template("{report}", "{market_description}"),
+  prompts.json_parse_system_prompt, prompts.json_parse_content_template("{prediction}"))
+TRIAGE_CACHE_VERSION = cache_keys.stage_version(
+  1, TRIAGE_MODEL, TRIAGE_CONFIG, prompts.triage_system_prompt, prompts.triage_content_template("{market_description}"))
+CACHE_VERSIONS = {
+  "report": REPORT_CACHE_VERSION,
+  "event_report": EVENT_REPORT_CACHE_VERSION,
+  "report_refresh": REFRESH_CACHE_VERSION,
+  "prediction": PREDICTION_CACHE_VERSION,
+  "triage": TRIAGE_CACHE_VERSION,
+}
+
+# Admits every LLM call under the per-model quotas and the optional daily dollar budget.
+scheduler = rate_limiter.Scheduler(
+  daily_budget_dollars=float(env["DAILY_BUDGET_DOLLARS"]) if env.get("DAILY_BUDGET_DOLLARS") else None)
+
+# Stream the report and analysis responses. Streaming records time to first token and throughput
+# per call, and an analysis stops as soon as its prediction JSON is complete instead of waiting
+# for whatever the model writes after it.
+STREAM_RESPONSES = True
+
+# One entry per streamed call, see `stream_stats`.
+stream_metrics = []
+_stream_metrics_lock = threading.Lock()
+
+class _StreamTimer:
+  """Measures one streamed call: time to first token, duration and output tokens per second."""
+
+  def __init__(self, stage, model):
+    self.stage = stage
+    self.model = model
+    self.started_at = time.monotonic()
+    self.first_token_at = None
+    # Region of a routed Gemini stream, whose latency is recorded once the stream has finished.
+    self.region = None
+
+  def chunk(self):
+    if self.first_token_at is None:
+      self.first_token_at = time.monotonic()
+
+  def _record_region(self, seconds, error=None):
+    if self.region is not None:
+      gemini_router.record(self.region, seconds, error=error)
+      self.region = None
+
+  def fail(self, error):
+    self._record_region(time.monotonic() - self.started_at, error=error)
+
+  def release(self):
+    """Frees a routed stream's region if neither `finish` nor `fail` recorded it, e.g. when the
+    stream was abandoned. Call it in a `finally` around the stream's consumer."""
+    if self.region is not None:
+      gemini_router.release(self.region)
+      self.region = None
+
+  def finish(self, output_tokens, stopped_early=False):
+    finished_at = time.monotonic()
+    first_token_at = self.first_token_at or finished_at
+    generation_seconds = finished_at - first_token_at
+    metrics = {
+      "stage": self.stage,
+      "model": self.model,
+      "time_to_first_token": first_token_at - self.started_at,
+      "seconds": finished_at - self.started_at,
+      "output_tokens": output_tokens,
+      "tokens_per_second": output_tokens / generation_seconds if generation_seconds > 0 else None,
+      "stopped_early": stopped_early,
+    }
+    with _stream_metrics_lock:
+      stream_metrics.append(metrics)
+    self._record_region(metrics["seconds"])
+    return metrics
+
+def stream_stats():
+  """Summarizes `stream_metrics` per stage: calls, median time to first token, median tokens per
+  second, median duration and the number of analyses stopped early."""
+  with _stream_metrics_lock:
+    metrics = list(stream_metrics)
+  stats = {}
+  for stage in sorted({m["stage"] for m in metrics}):
+    calls = [m for m in metrics if m["stage"] == stage]
+    rates = [m["tokens_per_second"] for m in calls if m["tokens_per_second"]]
+    stats[stage] = {
+      "calls": len(calls),
+      "median_time_to_first_token": statistics.median(m["time_to_first_token"] for m in calls),
+      "median_tokens_per_second": statistics.median(rates) if rates else None,
+      "median_seconds": statistics.median(m["seconds"] for m in calls),
+      "stopped_early": sum(m["stopped_early"] for m in calls),
+    }
+  return stats
+
+# One entry per compacted report, see `compaction_stats`.
+compaction_metrics = []
+_compaction_metrics_lock = threading.Lock()
+
+def compaction_stats():
+  """Summarizes `compaction_metrics`: reports compacted, total tokens before and after, and the
+  fraction of report tokens removed from the analysis prompts."""
+  with _compaction_metrics_lock:
+    metrics = list(compaction_metrics)
+  tokens_before = sum(m["tokens_before"] for m in metrics)
+  tokens_after = sum(m["tokens_after"] for m in metrics)
+  return {
+    "reports": len(metrics),
+    "tokens_before": tokens_before,
+    "tokens_after": tokens_after,
+    "saved": 1 - tokens_after / tokens_before if tokens_before else 0.0,
+  }
+
+# Regions each model may be routed to. Models not listed use every region.
+REGION_PINS = {}
+
+# Spreads Gemini calls over the Vertex AI `regions` when VERTEX_PROJECT (a Google Cloud project with
+# Vertex AI enabled) is set in .env. The calls authenticate with Application Default Credentials,
+# and the models must be available on Vertex AI; pin models to the regions that serve them. Without
+# VERTEX_PROJECT every call goes to the Gemini API with GEMINI_API_KEY.
+gemini_router = None
+if env.get("VERTEX_PROJECT"):
+  gemini_router = region_router.RegionRouter(regions, env["VERTEX_PROJECT"], pinned_regions=REGION_PINS)
+
+def _send_gemini_message(model_name, generation_config, system_instruction, prompt, timer=None):
+  """Sends a single-turn message, through the region router when one is configured.
+
+  With a `_StreamTimer`, the response is streamed as an iterator of chunks, and the region's
+  latency is recorded by the timer once the stream has finished. The caller must call the
+  timer's `release` in a `finally`. Only errors raised before the first chunk fail over to
+  another region."""
+  stream = timer is not None
+  if gemini_router is None:
+    model = genai.GenerativeModel(
+      model_name=model_name, generation_config=generation_config, system_instruction=system_instruction)
+    return model.start_chat().send_message(prompt, stream=stream)
+
+  def send(client):
+    return client.generate_content(model_name, prompt, generation_config, system_instruction, stream=stream)
+  if not stream:
+    return gemini_router.call(model_name, send)
+  response, timer.region = gemini_router.call(model_name, send, deferred=True)
+  return response
+
+def _record_gemini_usage(reservation, response):
+  usage = getattr(response, "usage_metadata", None)
+  if usage:
+    reservation.record(usage.prompt_token_count, usage.candidates_token_count)
+
+def create_report(market_description, cache=None, reuse_index=None, refresh_reused=False):
   """Creates a report based on the provided market description using the Perplexity AI API.
   
   Args:
       market_description (str): The description of the market to generate the report for.
+      reuse_index (ReportReuseIndex): Optional index of reports by description. The report of a
+        near-duplicate market (e.g. the same templated question for another date) is reused
+        instead of writing a new one.
+      refresh_reused (bool): Update a reused report for this market with the cheaper
+        REFRESH_MODEL, see `refresh_report`.
   
   Returns:
       str: The generated report response in an uncleaned and unverified JSON string."""
 
+  if reuse_index is not None:
+    return _create_report_with_reuse(market_description, cache, reuse_index, refresh_reused)
   if cache:
     print("Checking for cached report...")
-    cache_result = cache.get(market_description)
-    if cache_result:
-      print("Cached report found!")
-      return cache_result
-    else:
-      print("No cached report found. Generating new report...")
+    key = cache_keys.make_key("report", REPORT_CACHE_VERSION, market_description)
+    return cache.get_or_compute(key, lambda: write_report(market_description))
+  return write_report(market_description)
+
+def _create_report_with_reuse(market_description, cache, reuse_index, refresh_reused):
+  while True:
+    shared_report, match_similarity = reuse_index.claim(market_description)
+    if shared_report is None:
+      break
+    try:
+      report = shared_report.result()
+    except Exception:
+      # The near-duplicate's report failed and was dropped from the index. Claim again.
+      continue
+    if refresh_reused:
+      reuse_index.count("refreshed")
+      print(f"Refreshing the report of a near-duplicate market (similarity {match_similarity:.2f})...")
+      return refresh_report(report, market_description, cache=cache)
+    reuse_index.count("reused")
+    print(f"Reusing the report of a near-duplicate market (similarity {match_similarity:.2f})")
+    return report
+
+  try:
+    report = create_report(market_description, cache=cache)
+  except Exception as e:
+    reuse_index.resolve(market_description, error=e)
+    raise
+  reuse_index.resolve(market_description, report)
+  reuse_index.count("fresh")
+  return report
+
+def refresh_report(previous_report, market_description, cache=None):
+  """Updates a near-duplicate market's report for this market with REFRESH_MODEL.
+
+  Returns:
+      str: The updated report."""
+  if cache:
+    key = cache_keys.make_key("report_refresh", REFRESH_CACHE_VERSION, previous_report, market_description)
+    return cache.get_or_compute(key, lambda: _write_perplexity_report(
+      prompts.report_refresh_content_template(previous_report, market_description), model=REFRESH_MODEL))
+  return _write_perplexity_report(
+    prompts.report_refresh_content_template(previous_report, market_description), model=REFRESH_MODEL)
+
+def update_report(report, market_description, written_at):
+  """Updates this market's own report with the developments since it was written, with REFRESH_MODEL.
+
+  Not cached, since the answer depends on when it is asked.
+
+  Args:
+      report (str): The market's current report.
+      written_at (datetime): When the report was written or last updated.
+
+  Returns:
+      str: The updated report, or None if the model found no material change."""
+  updated = _write_perplexity_report(prompts.report_update_content_template(
+    report, written_at.strftime('%Y-%m-%d %H:%M UTC'), market_description), model=REFRESH_MODEL)
+  if updated.strip().upper().startswith(NO_MATERIAL_CHANGE):
+    return None
+  return updated
+
+def quick_probability(market_description, cache=None):
+  """Asks TRIAGE_MODEL for a quick probability estimate without any research.
+
+  Returns:
+      float: The estimated YES probability, or None if the call or its output failed."""
+  def estimate():
+    prompt = prompts.triage_content_template(market_description)
+    with scheduler.reserve("gemini", TRIAGE_MODEL, prompts.triage_system_prompt, prompt) as reservation:
+      response = _send_gemini_message(TRIAGE_MODEL, TRIAGE_CONFIG, prompts.triage_system_prompt, prompt)
+      _record_gemini_usage(reservation, response)
+    probability = float(json.loads(response.text)["probability"])
+    # Wrapped in a dict so that a probability of 0 is still cached.
+    return {"probability": min(max(probability, 0.0), 1.0)}
+
+  try:
+    if cache:
+      key = cache_keys.make_key("triage", TRIAGE_CACHE_VERSION, market_description)
+      return cache.get_or_compute(key, estimate)["probability"]
+    return estimate()["probability"]
+  except rate_limiter.BudgetExceeded:
+    raise
+  except Exception as e:
+    print(f"Error: Triage estimate failed: {e}")
+    return None
+
+def write_report(market_description):
+  """Calls the Perplexity AI API to write a report for the market, bypassing any cache.
+
+  Args:
+      market_description (str): The description of the market to generate the report for.
+
+  Returns:
+      str: The generated report.
+
+  Raises:
+      http_client.HttpError: If the API call fails after retries."""
+  return _write_perplexity_report(prompts.report_content_template(market_description))
 
+def describe_event(title, description, market_questions):
+  """Builds the description of a group of sibling markets that `create_event_report` researches.
+
+  Args:
+      title (str): Event title, or None when the group has no Gamma event.
+      description (str): Event description and rules, or None.
+      market_questions (list): The question of every market in the group."""
+  lines = []
+  if title:
+    lines.append(f"Event: {title}")
+  if description:
+    lines.append(f"Description and Rules: {description}")
+  lines.append("Markets:")
+  lines.extend(f"- {question}" for question in market_questions)
+  return "\n".join(lines)
+
+def create_event_report(event_description, cache=None):
+  """Creates one report shared by all markets of an event, see `describe_event`.
+
+  Returns:
+      str: The generated report."""
+  if cache:
+    key = cache_keys.make_key("event_report", EVENT_REPORT_CACHE_VERSION, event_description)
+    return cache.get_or_compute(key, lambda: write_event_report(event_description))
+  return write_event_report(event_description)
+
+def write_event_report(event_description):
+  """Calls the Perplexity AI API to write an event report, bypassing any cache."""
+  return _write_perplexity_report(prompts.event_report_content_template(event_description))
+
+def _write_perplexity_report(user_content, model=REPORT_MODEL):
   url = "https://api.perplexity.ai/chat/completions"
   payload = {
-    "model": "sonar-pro",
+    "model": model,
     "messages": [
       {
         "role": "system",
@@ -70,20 +462,10 @@ def create_report(market_description, cache=None):
       },
       {
         "role": "user",
-        "content": prompts.report_content_template(market_description),
+        "content": user_content,
       }
     ],
-      "max_tokens": "65536",
-      "temperature": 0.2,
-      "top_p": 0.3,
-      "search_domain_filter": [],
-      "return_images": False,
-      "return_related_questions": False,
-      "search_recency_filter": "month",
-      "top_k": 40,
-      "stream": False,
-      "frequency_penalty": 1.1,
-      "response_format": None
+    **REPORT_CONFIG,
   }
 
   headers = {
@@ -92,17 +474,47 @@ def create_report(market_description, cache=None):
   }
 
   print("Writing report...")
-  report_response = requests.request("POST", url, json=payload, headers=headers, timeout=120)
-  if report_response.status_code != 200:
-    print(f"Error: {report_response.status_code} - {report_response.text}")
-    exit(1)
-  report = report_response.json()["choices"][-1]["message"]["content"]
+  with scheduler.reserve("perplexity", model,
+                         *(message["content"] for message in payload["messages"])) as reservation:
+    if STREAM_RESPONSES:
+      report, usage = _stream_perplexity_report(url, payload, headers, model)
+    else:
+      report_response = http_client.default_client.post(url, json=payload, headers=headers, timeout=120)
+      response_json = report_response.json()
+      usage = response_json.get("usage") or {}
+      report = response_json["choices"][-1]["message"]["content"]
+    if usage:
+      reservation.record(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
   print("Report:", report)
-  if cache:
-    print("caching report...")
-    cache.set(market_description, report)
   return report
 
+def _stream_perplexity_report(url, payload, headers, model):
+  """Streams a Perplexity completion (server-sent events). Returns (text, usage)."""
+  timer = _StreamTimer("report", model)
+  parts = []
+  usage = {}
+  response = http_client.default_client.post(
+    url, json={**payload, "stream": True}, headers=headers, timeout=120, stream=True)
+  try:
+    for line in response.iter_lines(decode_unicode=True):
+      if not line or not line.startswith("data:"):
+        continue
+      data = line[len("data:"):].strip()
+      if data == "[DONE]":
+        break
+      chunk = json.loads(data)
+      usage = chunk.get("usage") or usage
+      choices = chunk.get("choices") or [{}]
+      delta = (choices[0].get("delta") or {}).get("content")
+      if delta:
+        timer.chunk()
+        parts.append(delta)
+  finally:
+    response.close()
+  text = "".join(parts)
+  timer.finish(usage.get("completion_tokens") or rate_limiter.estimate_tokens(text))
+  return text, usage
+
 def create_market_prediction(report, market_description):
   """Creates a market prediction based on the provided report and market description.
   
@@ -113,28 +525,67 @@ def create_market_prediction(report, market_description):
   Returns:
       str: The generated prediction response in an uncleaned and unverified json string."""
 
-  analysis_generation_config = {
-    "temperature": 0.2,
-    "top_p": 0.1,
-    "top_k": 40,
-    "max_output_tokens": 65536,
-    "response_mime_type": "text/plain",
-  }
-
-  prediction_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash-thinking-exp-01-21",
-    # model_name="gemini-2.0-flash",
-    generation_config=analysis_generation_config,
-    system_instruction=prompts.prediction_system_prompt,
-  )
+  print("Starting analysis...")
+  prediction_prompt = prompts.prediction_content_template(report, market_description)
+  with scheduler.reserve("gemini", ANALYSIS_MODEL,
+                         prompts.prediction_system_prompt, prediction_prompt) as reservation:
+    if STREAM_RESPONSES:
+      prediction_text = _stream_analysis(prediction_prompt, reservation)
+    else:
+      prediction_response = _send_gemini_message(
+        ANALYSIS_MODEL, ANALYSIS_CONFIG, prompts.prediction_system_prompt, prediction_prompt)
+      _record_gemini_usage(reservation, prediction_response)
+      prediction_text = prediction_response.text
+  print("Analysis:", prediction_text)
+  return prediction_text
 
-  prediction_chat_session = prediction_model.start_chat()
+def _close_stream(response):
+  """Cancels a streamed Gemini response, so the rest of the completion is neither generated nor
+  billed. The SDK has no public cancel, so this closes the underlying gRPC or REST stream."""
+  cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+  if callable(cancel):
+    cancel()
 
-  print("Starting analysis...")
-  prediction_response = prediction_chat_session.send_message(
-  prompts.prediction_content_template(report, market_description))
-  print("Analysis:", prediction_response.text)
-  return prediction_response.text
+def _stream_analysis(prediction_prompt, reservation):
+  """Streams an analysis and cancels the stream once its final prediction object is complete,
+  see `prediction_parser.parse_final_prediction`."""
+  timer = _StreamTimer("analysis", ANALYSIS_MODEL)
+  response = _send_gemini_message(
+    ANALYSIS_MODEL, ANALYSIS_CONFIG, prompts.prediction_system_prompt, prediction_prompt, timer=timer)
+  try:
+    parts = []
+    stopped_early = False
+    try:
+      for chunk in response:
+        try:
+          text = chunk.text
+        except ValueError:
+          # Chunks without text parts, e.g. a final chunk that only carries the finish reason.
+          continue
+        timer.chunk()
+        parts.append(text)
+        if "}" in text and prediction_parser.parse_final_prediction("".join(parts)) is not None:
+          stopped_early = True
+          break
+    except Exception as e:
+      timer.fail(e)
+      raise
+    if stopped_early:
+      _close_stream(response)
+    prediction_text = "".join(parts)
+    usage = getattr(response, "usage_metadata", None)
+    output_tokens = rate_limiter.estimate_tokens(prediction_text)
+    if stopped_early or not usage:
+      # Usage is only reported once the stream has been read to the end.
+      reservation.record(rate_limiter.estimate_tokens(prediction_prompt), output_tokens)
+    else:
+      _record_gemini_usage(reservation, response)
+      output_tokens = usage.candidates_token_count or output_tokens
+    timer.finish(output_tokens, stopped_early=stopped_early)
+    return prediction_text
+  finally:
+    # Frees the region's slot when the stream is abandoned, e.g. by an interrupt.
+    timer.release()
 
 def llm_parse_raw_prediction(prediction):
   """Parses the analysis text and returns a JSON object with the following structure:
@@ -146,57 +597,24 @@ def llm_parse_raw_prediction(prediction):
     - `confidence_level`: float representing the confidence level of the prediction, between 0 and 1.
   - `model_confidence`: float representing the model's confidence in the prediction, between 0 and 1."""
 
-  analysis_generation_config = {
-    "temperature": 0.0,
-    "top_p": 0.1,
-    "top_k": 20,
-    "max_output_tokens": 8192,
-    "response_schema": content.Schema(
-      type = content.Type.OBJECT,
-      enum = [],
-      required = ["reasoning", "probability", "uncertainty", "model_confidence"],
-      properties = {
-        "probability": content.Schema(
-          type = content.Type.NUMBER,
-        ),
-        "uncertainty": content.Schema(
-          type = content.Type.OBJECT,
-          enum = [],
-          required = ["lower_bound", "upper_bound", "confidence_level"],
-          properties = {
-            "lower_bound": content.Schema(
-              type = content.Type.NUMBER,
-            ),
-            "upper_bound": content.Schema(
-              type = content.Type.NUMBER,
-            ),
-            "confidence_level": content.Schema(
-              type = content.Type.NUMBER,
-            ),
-          },
-        ),
-        "model_confidence": content.Schema(
-          type = content.Type.NUMBER,
-        ),
-        "reasoning": content.Schema(
-          type = content.Type.STRING,
-        ),
-      },
-    ),
-    "response_mime_type": "application/json",
-  }
-  json_parse_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash-lite-preview-02-05",
-    generation_config=analysis_generation_config,
-    system_instruction=prompts.json_parse_system_prompt,
-  )
-  json_parse_chat_session = json_parse_model.start_chat()
-  output_response = json_parse_chat_session.send_message(
-      prompts.json_parse_content_template(prediction))
+  json_parse_prompt = prompts.json_parse_content_template(prediction)
+  with scheduler.reserve("gemini", JSON_PARSE_MODEL,
+                         prompts.json_parse_system_prompt, json_parse_prompt) as reservation:
+    output_response = _send_gemini_message(
+      JSON_PARSE_MODEL, JSON_PARSE_CONFIG, prompts.json_parse_system_prompt, json_parse_prompt)
+    _record_gemini_usage(reservation, output_response)
   return output_response.text
 
+# How raw predictions were parsed: "local", "llm_fallback" (a second Gemini call) and "failed".
+parse_stats = collections.Counter()
+_parse_stats_lock = threading.Lock()
+
+def _count_parse(outcome):
+  with _parse_stats_lock:
+    parse_stats[outcome] += 1
+
 def clean_parse_raw_prediction(raw_prediction):
-  """Cleans and parses the raw prediction output, handling any JSON parsing errors by falling back to LLM parsing.
+  """Cleans and parses the raw prediction output locally, falling back to LLM parsing only if that fails.
   
   Args:
       raw_prediction (str): The raw prediction output to be cleaned and parsed.
@@ -204,14 +622,18 @@ def clean_parse_raw_prediction(raw_prediction):
   Returns:
       dict: A dictionary containing the parsed prediction data, or an empty dictionary if parsing fails."""
   try:
-    clean_json = raw_prediction.replace('```json', '').replace('```', '').strip()
-    prediction_json = json.loads(clean_json)
-  except (ValueError, json.decoder.JSONDecodeError) as e:
-    print("Error: Market Analysis did not have JSON-only output. Falling back to LLM Parsing:", e)
+    prediction_json = prediction_parser.parse_prediction(raw_prediction)
+    _count_parse("local")
+    return prediction_json
+  except prediction_parser.PredictionParseError as e:
+    print("Error: Market Analysis did not have valid JSON output. Falling back to LLM Parsing:", e)
+  _count_parse("llm_fallback")
   try:
-    prediction_json = json.loads(llm_parse_raw_prediction(raw_prediction))
-  except json.decoder.JSONDecodeError as e:
+    prediction_json = prediction_parser.validate_prediction(
+      json.loads(llm_parse_raw_prediction(raw_prediction)))
+  except (json.decoder.JSONDecodeError, prediction_parser.PredictionParseError) as e:
     print("Error: LLM Parsing Failed. Invalid JSON output. Error:", e)
+    _count_parse("failed")
     return {}
   return prediction_json
 
@@ -232,18 +654,156 @@ def create_prediction(market_description, cache=None):
           - model_confidence (float): Model's confidence in prediction between 0-1
   """
   report = create_report(market_description, cache=cache)
+  return create_prediction_from_report(report, market_description, cache=cache)
+
+def create_prediction_from_report(report, market_description, cache=None):
+  """Runs the analysis and parse stages of the pipeline against an existing report.
+
+  The report is compacted for this market with `compact_report` before the analysis. Cache keys
+  use the full report, and `REPORT_TOKEN_BUDGET` is part of the stage version.
+
+  Args:
+      report (str): The Perplexity report for the market.
+      market_description (str): Description of the prediction market to analyze
+
+  Returns:
+      dict: The parsed prediction, see `create_prediction`.
+  """
   if cache:
     print("Checking for cached prediction...")
-    cache_result = cache.get(report)
-    if cache_result:
-      print("Cached prediction found!")
-      return cache_result
-    else:
-      print("No cached prediction found. Generating new prediction...")
+    key = cache_keys.make_key("prediction", PREDICTION_CACHE_VERSION, report, market_description)
+    return cache.get_or_compute(key, lambda: _analyze_report(report, market_description))
+  return _analyze_report(report, market_description)
+
+def compact_report(report, market_description):
+  """Compacts a report to `REPORT_TOKEN_BUDGET` tokens for one market's analysis and records the
+  token counts in `compaction_metrics`."""
+  compacted, stats = report_compaction.compact_report(report, market_description, REPORT_TOKEN_BUDGET)
+  with _compaction_metrics_lock:
+    compaction_metrics.append(stats)
+  print(f"Compacted report from {stats['tokens_before']} to {stats['tokens_after']} tokens")
+  return compacted
 
+def _analyze_report(report, market_description):
+  report = compact_report(report, market_description)
   prediction_raw_ouput = create_market_prediction(report, market_description)
-  cleaned_prediction = clean_parse_raw_prediction(prediction_raw_ouput)
-  if cache:
-    print("caching parsed prediction...")
-    cache.set(report, cleaned_prediction)
-  return cleaned_prediction
+  return clean_parse_raw_prediction(prediction_raw_ouput)
+
+
+def create_predictions(market_descriptions, cache=None, max_concurrency=8,
+                       max_report_concurrency=None, max_analysis_concurrency=None, report_groups=None,
+                       reuse_index=None, refresh_reused=False):
+  """Creates predictions for many markets concurrently, yielding each one as soon as it finishes.
+
+  The report (Perplexity) and analysis (Gemini) stages run as a pipeline on two separate
+  worker pools, so a market's analysis starts as soon as its report is ready while other
+  reports are still being written. Each pool has its own concurrency limit so the two
+  providers can be throttled independently.
+
+  Args:
+      market_descriptions (dict): Maps a caller chosen key (e.g. condition_id) to a market description.
+      cache (DiskCache): Optional cache shared by both stages, used exactly as in `create_prediction`.
+        Wrap it in a `disk_cache.TieredCache` so concurrent requests for the same key make a
+        single upstream call.
+      max_concurrency (int): Default number of in-flight calls per stage.
+      max_report_concurrency (int): Number of concurrent Perplexity calls. Defaults to max_concurrency.
+      max_analysis_concurrency (int): Number of concurrent Gemini calls. Defaults to max_concurrency.
+      report_groups (dict): Optional map of a group id to (event description, keys), e.g. from
+        `event_report_groups`. The markets of a group share one `create_event_report`, and each
+        is then analyzed against it on its own. Other markets get their own report.
+      reuse_index (ReportReuseIndex): Optional index for reusing the reports of near-duplicate
+        markets, see `create_report`. Its `stats` count the reports reused per run.
+      refresh_reused (bool): See `create_report`.
+
+  Yields:
+      tuple: (key, prediction) in completion order. Markets whose prediction is empty or
+      whose stages raised an error are logged and skipped. Once the scheduler's daily budget
+      runs out, queued markets are dropped and the run ends after the in-flight calls.
+  """
+  report_pool = ThreadPoolExecutor(
+    max_workers=max_report_concurrency or max_concurrency, thread_name_prefix="report")
+  analysis_pool = ThreadPoolExecutor(
+    max_workers=max_analysis_concurrency or max_concurrency, thread_name_prefix="analysis")
+  budget_exhausted = False
+  try:
+    # Each pending future maps to (label, [(key, market_description)], stage).
+    pending = {}
+    grouped = set()
+    for group_id, (event_description, keys) in (report_groups or {}).items():
+      members = [(key, market_descriptions[key]) for key in keys
+                 if key in market_descriptions and key not in grouped]
+      if not members:
+        continue
+      grouped.update(key for key, _ in members)
+      future = report_pool.submit(create_event_report, event_description, cache=cache)
+      pending[future] = (group_id, members, "event report")
+    for key, market_description in market_descriptions.items():
+      if key not in grouped:
+        future = report_pool.submit(create_report, market_description, cache=cache,
+                                    reuse_index=reuse_index, refresh_reused=refresh_reused)
+        pending[future] = (key, [(key, market_description)], "report")
+    if grouped:
+      print(f"Researching {len(market_descriptions)} markets with {len(pending)} reports "
+            f"({len(pending) - len(market_descriptions) + len(grouped)} shared by {len(grouped)} markets)")
+
+    while pending:
+      done, _ = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        label, members, stage = pending.pop(future)
+        try:
+          result = future.result()
+        except rate_limiter.BudgetExceeded as e:
+          if not budget_exhausted:
+            print(f"Error: {e}. Not starting any new markets.")
+            budget_exhausted = True
+            for pending_future in pending:
+              pending_future.cancel()
+          continue
+        except CancelledError:
+          continue
+        except Exception as e:
+          print(f"Error: {stage} stage failed for {label}: {e}")
+          continue
+        if stage != "analysis":
+          if budget_exhausted:
+            continue
+          for key, market_description in members:
+            future = analysis_pool.submit(
+              create_prediction_from_report, result, market_description, cache=cache)
+            pending[future] = (key, [(key, market_description)], "analysis")
+        elif result:
+          yield label, result
+  finally:
+    # Drop queued work if the caller stops consuming results early.
+    report_pool.shutdown(wait=False, cancel_futures=True)
+    analysis_pool.shutdown(wait=False, cancel_futures=True)
+
+def event_report_groups(store, market_descriptions, min_markets=2):
+  """Groups markets that belong to the same event so they can share one report.
+
+  Args:
+      store (MarketStore): Market store built with the Gamma events, see `MarketStore.event_groups`.
+      market_descriptions (dict): Maps condition_id to market description.
+      min_markets (int): Smallest group worth a shared report.
+
+  Returns:
+      dict: Maps a group id to (event description, condition ids), for `create_predictions`."""
+  groups = {}
+  for group_id, condition_ids in store.event_groups(market_descriptions, min_markets).items():
+    title, description = store.event_details(group_id)
+    if description is None:
+      # Sibling negRisk markets share their rules text, so the first market's stands in.
+      description = store.markets[condition_ids[0]].get('description')
+    questions = [store.markets[condition_id].get('question', '') for condition_id in condition_ids]
+    groups[group_id] = (describe_event(title, description, questions), condition_ids)
+  return groups
+
+def prune_cache(cache):
+  """Deletes cached reports and predictions from versions other than the current ones.
+
+  Returns:
+      dict: Number of deleted entries per namespace."""
+  return {
+    namespace: cache.invalidate(namespace, keep_version=version)
+    for namespace, version in CACHE_VERSIONS.items()
+  }
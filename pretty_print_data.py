@@ -37,6 +37,9 @@ def pretty_print_markets(markets_data: List[Dict[str, Any]]) -> None:
     print(f"  {edge_color}Edge: {market_summary['edge']:.3f}{Style.RESET_ALL}")
     print(f"  {ev_color}Adjusted EV: {market_summary['adjusted_ev']:.3f} {symbol}{Style.RESET_ALL}")
     print(f"  Best Ask: {market_summary['best_ask_price']} (Size: {market_summary['best_ask_size']})")
+    if 'fill_vwap' in market_summary:
+      print(f"  Fill: {market_summary['fill_shares']:.1f} shares for ${market_summary['fill_cost']:.2f} at VWAP {market_summary['fill_vwap']:.3f} ({market_summary['fill_levels']} levels)")
+      print(f"  {ev_color}Expected Profit: ${market_summary['expected_profit']:.2f}{Style.RESET_ALL} (edge runs out after ${market_summary['break_even_stake']:.2f})")
     
     # Print uncertainty range if available
     if 'uncertainty' in market_summary:
@@ -29,6 +29,46 @@ def report_content_template (market_description):
 
   Organize the information by relevance and chronology."""
 
+def event_report_content_template (event_description):
+  return f"""
+  Conduct a comprehensive search for all relevant information related to this group of prediction markets. The markets belong to one event and differ only in the outcome, candidate or threshold they ask about, so cover every listed market and the factors that decide between them. Focus on authoritative sources and recent developments. Exclude information from prediction markets themselves.
+
+  Event to analyze:
+  {event_description}
+
+  For each relevant piece of information, include:
+  - Source name and date
+  - Key findings or claims
+  - Which of the markets it is relevant to and how
+  - Any quantitative data or metrics
+  - Source reliability assessment
+
+  Organize the information by relevance and chronology."""
+
+def report_refresh_content_template (previous_report, market_description):
+  return f"""
+  The research report below was written for a closely related prediction market that differs only in details such as a date, threshold or ticker. Update it for the market to analyze: search for recent developments, correct anything specific to the other market, and add the facts and figures this market depends on. Exclude information from prediction markets themselves.
+
+  Market to analyze:
+  {market_description}
+
+  Existing report:
+  {previous_report}
+
+  Return the complete updated report in the same structure."""
+
+def report_update_content_template (report, written_at, market_description):
+  return f"""
+  The research report below was written for this prediction market on {written_at}. Search for developments since then that bear on the outcome: new facts, figures, announcements or schedule changes. Exclude information from prediction markets themselves.
+
+  Market to analyze:
+  {market_description}
+
+  Report of {written_at}:
+  {report}
+
+  If nothing material to the outcome has changed since {written_at}, reply with exactly NO MATERIAL CHANGE and nothing else. Otherwise return the complete updated report in the same structure, with the new developments and their dates added and anything they supersede corrected."""
+
 prediction_system_prompt = """
   You are a senior research analyst trained in the principles of superforecasting as outlined by Philip Tetlock. You approach predictions by:
 
@@ -103,4 +143,17 @@ def json_parse_content_template(prediction):
   Assessment: 
   {prediction}
 
-  Return only valid JSON that matches the schema. Ensure all numerical values are proper decimals between 0 and 1."""
\ No newline at end of file
+  Return only valid JSON that matches the schema. Ensure all numerical values are proper decimals between 0 and 1."""
+
+triage_system_prompt = """
+You are a forecaster giving a quick first estimate for a prediction market without doing any research.
+Use only what you already know and the base rate of similar events."""
+
+def triage_content_template(market_description):
+  return f"""
+  Estimate the probability that this market resolves YES.
+
+  Market:
+  {market_description}
+
+  Return a JSON object with a single "probability" field, a decimal between 0 and 1."""
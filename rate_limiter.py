@@ -0,0 +1,221 @@
+"""Per-provider request/token rate limiting and a daily cost budget for the LLM calls.
+
+Each (provider, model) pair gets a requests-per-minute and a tokens-per-minute token bucket.
+A call first waits until both buckets can cover it, then reserves its estimated cost against
+the daily dollar budget. Once the budget is spent, new calls raise `BudgetExceeded` instead of
+starting. Buckets refill continuously, so a parallel run settles just under the quota instead
+of bursting into 429s.
+"""
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+# Quotas and prices (USD per million tokens) per (provider, model). Adjust to your account tier.
+DEFAULT_LIMITS = {
+  ("perplexity", "sonar-pro"): {
+    "rpm": 50,
+    "tpm": None,
+    "input_price": 3.0,
+    "output_price": 15.0,
+    "request_price": 0.006,
+    "expected_output_tokens": 2000,
+  },
+  ("perplexity", "sonar"): {
+    "rpm": 50,
+    "tpm": None,
+    "input_price": 1.0,
+    "output_price": 1.0,
+    "request_price": 0.005,
+    "expected_output_tokens": 1500,
+  },
+  ("gemini", "gemini-2.0-flash-thinking-exp-01-21"): {
+    "rpm": 10,
+    "tpm": 4_000_000,
+    "input_price": 0.10,
+    "output_price": 0.40,
+    "request_price": 0.0,
+    "expected_output_tokens": 4000,
+  },
+  ("gemini", "gemini-2.0-flash-lite-preview-02-05"): {
+    "rpm": 30,
+    "tpm": 1_000_000,
+    "input_price": 0.075,
+    "output_price": 0.30,
+    "request_price": 0.0,
+    "expected_output_tokens": 500,
+  },
+}
+
+class BudgetExceeded(Exception):
+  """Raised when a call would exceed the daily cost budget."""
+
+def estimate_tokens(*texts):
+  """Roughly estimates the token count of the given texts (about four characters per token)."""
+  return sum(math.ceil(len(text) / 4) for text in texts if text)
+
+class TokenBucket:
+  """Thread-safe token bucket that refills `rate_per_minute` tokens per minute.
+
+  Args:
+      rate_per_minute (float): Refill rate, and the bucket capacity unless `capacity` is given."""
+
+  def __init__(self, rate_per_minute, capacity=None):
+    self.rate_per_second = rate_per_minute / 60.0
+    self.capacity = capacity or rate_per_minute
+    self._tokens = self.capacity
+    self._updated_at = time.monotonic()
+    self._lock = threading.Lock()
+
+  def _refill(self):
+    now = time.monotonic()
+    self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+    self._updated_at = now
+
+  def acquire(self, amount=1):
+    """Blocks until `amount` tokens are available and takes them.
+
+    Amounts above the capacity are capped to it, so oversized calls wait for a full bucket."""
+    amount = min(amount, self.capacity)
+    while True:
+      with self._lock:
+        self._refill()
+        if self._tokens >= amount:
+          self._tokens -= amount
+          return
+        wait_seconds = (amount - self._tokens) / self.rate_per_second
+      time.sleep(wait_seconds)
+
+  def adjust(self, amount):
+    """Takes (or with a negative amount returns) tokens without blocking, e.g. to settle an estimate."""
+    with self._lock:
+      self._refill()
+      self._tokens = min(self.capacity, self._tokens - amount)
+
+class _Reservation:
+  """A call admitted by the Scheduler. Call `record` with the actual usage when known."""
+
+  def __init__(self, scheduler, key, input_tokens, output_tokens, cost):
+    self.scheduler = scheduler
+    self.key = key
+    self.estimated_tokens = input_tokens + output_tokens
+    self.estimated_cost = cost
+    self.input_tokens = None
+    self.output_tokens = None
+
+  def record(self, input_tokens, output_tokens):
+    self.input_tokens = input_tokens
+    self.output_tokens = output_tokens
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, traceback):
+    self.scheduler._settle(self)
+    return False
+
+class Scheduler:
+  """Admits LLM calls under per-model RPM/TPM limits and a daily dollar budget.
+
+  Args:
+      limits (dict): Maps (provider, model) to a dict with `rpm`, `tpm`, `input_price`,
+        `output_price`, `request_price` and `expected_output_tokens`. See DEFAULT_LIMITS.
+        Calls to unlisted models are not limited and cost nothing.
+      daily_budget_dollars (float): Spend allowed per UTC day. None disables the budget."""
+
+  def __init__(self, limits=None, daily_budget_dollars=None):
+    self.limits = DEFAULT_LIMITS if limits is None else limits
+    self.daily_budget_dollars = daily_budget_dollars
+    self._buckets = {}
+    for key, limit in self.limits.items():
+      self._buckets[key] = (
+        TokenBucket(limit["rpm"]) if limit.get("rpm") else None,
+        TokenBucket(limit["tpm"]) if limit.get("tpm") else None,
+      )
+    self._lock = threading.Lock()
+    self._day = None
+    self.spent_today = 0.0
+    self.usage = {}
+
+  def _cost(self, key, input_tokens, output_tokens):
+    limit = self.limits.get(key)
+    if limit is None:
+      return 0.0
+    return (limit.get("request_price", 0.0)
+            + input_tokens * limit.get("input_price", 0.0) / 1e6
+            + output_tokens * limit.get("output_price", 0.0) / 1e6)
+
+  def _roll_day(self):
+    # Must be called with the lock held.
+    today = datetime.now(timezone.utc).date()
+    if today != self._day:
+      self._day = today
+      self.spent_today = 0.0
+
+  def reserve(self, provider, model, *prompt_texts):
+    """Waits for quota and reserves budget for one call.
+
+    Args:
+        provider (str): e.g. "perplexity" or "gemini".
+        model (str): The model name.
+        *prompt_texts (str): The prompt parts sent with the call, used to estimate tokens.
+
+    Returns:
+        A context manager for the call. Call `record(input_tokens, output_tokens)` on it with
+        the provider's reported usage so the buckets and budget reflect the actual cost.
+
+    Raises:
+        BudgetExceeded: If the estimated cost does not fit in today's remaining budget."""
+    key = (provider, model)
+    limit = self.limits.get(key, {})
+    input_tokens = estimate_tokens(*prompt_texts)
+    output_tokens = limit.get("expected_output_tokens", 0)
+    cost = self._cost(key, input_tokens, output_tokens)
+
+    with self._lock:
+      self._roll_day()
+      if self.daily_budget_dollars is not None and self.spent_today + cost > self.daily_budget_dollars:
+        raise BudgetExceeded(
+          f"Daily budget of ${self.daily_budget_dollars:.2f} exhausted (spent ${self.spent_today:.2f})")
+      self.spent_today += cost
+
+    request_bucket, token_bucket = self._buckets.get(key, (None, None))
+    if request_bucket:
+      request_bucket.acquire()
+    if token_bucket:
+      token_bucket.acquire(input_tokens + output_tokens)
+    return _Reservation(self, key, input_tokens, output_tokens, cost)
+
+  def _settle(self, reservation):
+    if reservation.input_tokens is None:
+      tokens = reservation.estimated_tokens
+      cost = reservation.estimated_cost
+    else:
+      tokens = reservation.input_tokens + reservation.output_tokens
+      cost = self._cost(reservation.key, reservation.input_tokens, reservation.output_tokens)
+      _, token_bucket = self._buckets.get(reservation.key, (None, None))
+      if token_bucket:
+        token_bucket.adjust(tokens - reservation.estimated_tokens)
+    with self._lock:
+      self._roll_day()
+      self.spent_today = max(0.0, self.spent_today + cost - reservation.estimated_cost)
+      usage = self.usage.setdefault(reservation.key, {"calls": 0, "tokens": 0, "cost": 0.0})
+      usage["calls"] += 1
+      usage["tokens"] += tokens
+      usage["cost"] += cost
+
+  def record_batch(self, provider, model, input_tokens, output_tokens, price_factor=0.5):
+    """Books the usage of a finished batch job, which bypasses the per-call quotas.
+
+    Args:
+        price_factor (float): Batch price relative to the listed prices. Batch APIs usually
+          charge half."""
+    key = (provider, model)
+    cost = self._cost(key, input_tokens, output_tokens) * price_factor
+    with self._lock:
+      self._roll_day()
+      self.spent_today += cost
+      usage = self.usage.setdefault(key, {"calls": 0, "tokens": 0, "cost": 0.0})
+      usage["tokens"] += input_tokens + output_tokens
+      usage["cost"] += cost
+    return cost
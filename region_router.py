@@ -0,0 +1,271 @@
+"""Spreads Gemini calls across Vertex AI regions and routes around slow or failing regions.
+
+The Gemini API (generativelanguage.googleapis.com) has a single global host, so the regions are
+Vertex AI regions: each call goes to `https://{region}-aiplatform.googleapis.com` for a Google
+Cloud project with Vertex AI enabled, authenticated with Application Default Credentials. The
+responses are returned as the `google.generativeai` response types the pipeline already reads.
+
+Every region keeps an exponentially weighted moving average of its latency and error rate.
+Each call samples two candidate regions and takes the one with the better score (the "power
+of two choices"), so load spreads out while slow regions get fewer calls. A region that
+fails is put in a short cooldown, and the call fails over to another region when the
+error is a throttling or availability error.
+"""
+import json
+import random
+import threading
+import time
+
+import google.auth
+import proto
+import requests
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.auth.transport.requests import AuthorizedSession
+from google.generativeai import types as genai_types
+from requests.adapters import HTTPAdapter
+
+VERTEX_ENDPOINT_TEMPLATE = (
+  "https://{region}-aiplatform.googleapis.com/v1"
+  "/projects/{project}/locations/{region}/publishers/google/models/{model}")
+
+# Errors that say something about the region rather than the request, so another region may succeed.
+# TooManyRequests includes ResourceExhausted.
+FAILOVER_ERRORS = (
+  google_exceptions.TooManyRequests,
+  google_exceptions.ServiceUnavailable,
+  google_exceptions.DeadlineExceeded,
+  google_exceptions.GatewayTimeout,
+  google_exceptions.InternalServerError,
+)
+
+def _json_value(value):
+  """Converts proto messages in a generation config, e.g. a response schema, to their JSON form."""
+  if isinstance(value, proto.Message):
+    return json.loads(type(value).to_json(
+      value, use_integers_for_enums=False, always_print_fields_with_no_presence=False))
+  return value
+
+def generate_content_request(prompt, generation_config=None, system_instruction=None):
+  """Returns the JSON body of a single-turn generateContent call."""
+  body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+  if system_instruction:
+    body["system_instruction"] = {"parts": [{"text": system_instruction}]}
+  if generation_config:
+    body["generation_config"] = {key: _json_value(value) for key, value in generation_config.items()}
+  return body
+
+def _api_error(response):
+  try:
+    message = response.json()["error"]["message"]
+  except (ValueError, KeyError, TypeError):
+    message = response.text[:500]
+  return google_exceptions.from_http_status(response.status_code, message)
+
+class _ChunkStream:
+  """Iterates the chunks of a streamGenerateContent server-sent event stream. `cancel` closes the
+  connection, so the rest of the completion is neither generated nor billed."""
+
+  def __init__(self, response):
+    self._response = response
+    self._lines = response.iter_lines(decode_unicode=True)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    try:
+      for line in self._lines:
+        if line.startswith("data:"):
+          return glm.GenerateContentResponse.from_json(line[len("data:"):].strip(), ignore_unknown_fields=True)
+    except requests.RequestException as e:
+      raise google_exceptions.ServiceUnavailable(str(e)) from e
+    self._response.close()
+    raise StopIteration
+
+  def cancel(self):
+    self._response.close()
+
+class VertexRegionClient:
+  """Calls Gemini models in one Vertex AI region.
+
+  Args:
+      session (requests.Session): Authorized session, see `RegionRouter`.
+      project (str): Google Cloud project.
+      region (str): Vertex AI region.
+      endpoint_template (str): Model URL with `{region}`, `{project}` and `{model}` placeholders.
+      timeout (float): Request timeout in seconds."""
+
+  def __init__(self, session, project, region, endpoint_template=VERTEX_ENDPOINT_TEMPLATE, timeout=600):
+    self.session = session
+    self.project = project
+    self.region = region
+    self.endpoint_template = endpoint_template
+    self.timeout = timeout
+
+  def generate_content(self, model, prompt, generation_config=None, system_instruction=None, stream=False):
+    """Sends a single-turn prompt.
+
+    Returns:
+        google.generativeai.types.GenerateContentResponse: The response, or with `stream` the
+          response iterating its chunks. The first chunk is read here, so a region that fails
+          to start the stream raises before this returns.
+
+    Raises:
+        google.api_core.exceptions.GoogleAPICallError: For an error status or a failed connection."""
+    url = self.endpoint_template.format(region=self.region, project=self.project, model=model)
+    url += ":streamGenerateContent?alt=sse" if stream else ":generateContent"
+    try:
+      response = self.session.post(
+        url, json=generate_content_request(prompt, generation_config, system_instruction), stream=stream,
+        timeout=self.timeout)
+    except requests.RequestException as e:
+      raise google_exceptions.ServiceUnavailable(f"{self.region}: {e}") from e
+    if response.status_code != 200:
+      error = _api_error(response)
+      response.close()
+      raise error
+    if stream:
+      return genai_types.GenerateContentResponse.from_iterator(_ChunkStream(response))
+    return genai_types.GenerateContentResponse.from_response(
+      glm.GenerateContentResponse.from_json(response.text, ignore_unknown_fields=True))
+
+class RegionStats:
+  """Moving averages of latency and error rate for one region."""
+
+  def __init__(self):
+    self.latency_seconds = None
+    self.error_rate = 0.0
+    self.in_flight = 0
+    self.calls = 0
+    self.errors = 0
+    self.cooldown_until = 0.0
+
+  def score(self):
+    # Unmeasured regions score best so that every region gets probed.
+    if self.latency_seconds is None:
+      return 0.0
+    return self.latency_seconds * (1 + self.in_flight) / max(1e-3, 1 - self.error_rate)
+
+class RegionRouter:
+  """Chooses a region per call and keeps per-region Gemini clients.
+
+  Args:
+      regions (list): Vertex AI region names, e.g. `prediction_pipeline.regions`.
+      project (str): Google Cloud project the calls are billed to.
+      session (requests.Session): Session for the calls. Defaults to an `AuthorizedSession` with
+        the Application Default Credentials.
+      endpoint_template (str): Model URL with `{region}`, `{project}` and `{model}` placeholders.
+      pinned_regions (dict): Optional map of model name to the only regions it may use.
+      smoothing (float): Weight of the newest sample in the moving averages.
+      cooldown_seconds (float): How long a region is skipped after a failover error.
+      max_attempts (int): Regions tried per call before the error is raised."""
+
+  def __init__(self, regions, project, session=None, endpoint_template=VERTEX_ENDPOINT_TEMPLATE,
+               pinned_regions=None, smoothing=0.2, cooldown_seconds=30.0, max_attempts=3):
+    self.regions = list(regions)
+    self.project = project
+    if session is None:
+      credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+      session = AuthorizedSession(credentials)
+      # One pool per regional host, so concurrent calls to a region reuse their connections.
+      adapter = HTTPAdapter(pool_connections=len(self.regions), pool_maxsize=16)
+      session.mount("https://", adapter)
+    self.session = session
+    self.endpoint_template = endpoint_template
+    self.pinned_regions = pinned_regions or {}
+    self.smoothing = smoothing
+    self.cooldown_seconds = cooldown_seconds
+    self.max_attempts = max_attempts
+    self._stats = {region: RegionStats() for region in self.regions}
+    self._clients = {}
+    self._lock = threading.Lock()
+
+  def client(self, region):
+    """Returns the (cached) Gemini client for a region."""
+    with self._lock:
+      client = self._clients.get(region)
+      if client is None:
+        client = VertexRegionClient(self.session, self.project, region, self.endpoint_template)
+        self._clients[region] = client
+      return client
+
+  def choose(self, model, exclude=()):
+    """Picks a region for the model, preferring fast, healthy regions not in cooldown."""
+    candidates = [r for r in self.pinned_regions.get(model, self.regions) if r not in exclude]
+    if not candidates:
+      raise ValueError(f"No regions left for {model}")
+    now = time.monotonic()
+    with self._lock:
+      healthy = [r for r in candidates if self._stats[r].cooldown_until <= now] or candidates
+      sample = random.sample(healthy, min(2, len(healthy)))
+      region = min(sample, key=lambda r: self._stats[r].score())
+      self._stats[region].in_flight += 1
+    return region
+
+  def record(self, region, latency_seconds, error=None):
+    """Updates a region's moving averages with the outcome of one call."""
+    with self._lock:
+      stats = self._stats[region]
+      stats.in_flight -= 1
+      stats.calls += 1
+      failed = error is not None
+      stats.errors += failed
+      stats.error_rate += self.smoothing * (failed - stats.error_rate)
+      if not failed:
+        if stats.latency_seconds is None:
+          stats.latency_seconds = latency_seconds
+        else:
+          stats.latency_seconds += self.smoothing * (latency_seconds - stats.latency_seconds)
+      if isinstance(error, FAILOVER_ERRORS):
+        stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+  def release(self, region):
+    """Frees a deferred call's slot without a latency sample, e.g. for an abandoned stream."""
+    with self._lock:
+      self._stats[region].in_flight -= 1
+
+  def call(self, model, send, deferred=False):
+    """Runs `send(client)` against a chosen region, failing over on regional errors.
+
+    Args:
+        model (str): Model name, used for region pinning.
+        send (callable): Takes a `VertexRegionClient` and performs the call.
+        deferred (bool): The call is not finished when `send` returns, e.g. a stream. The caller
+          must `record` its latency once it has finished, or `release` the region in a
+          `finally`, so the region's in-flight count does not leak.
+
+    Returns:
+        The return value of `send`, or (return value, region) when deferred."""
+    tried = []
+    while True:
+      region = self.choose(model, exclude=tried)
+      tried.append(region)
+      start = time.monotonic()
+      try:
+        result = send(self.client(region))
+      except Exception as e:
+        self.record(region, time.monotonic() - start, error=e)
+        retry = isinstance(e, FAILOVER_ERRORS) and len(tried) < self.max_attempts
+        if not retry or len(tried) == len(self.pinned_regions.get(model, self.regions)):
+          raise
+        print(f"Gemini call to {region} failed ({type(e).__name__}). Failing over.")
+        continue
+      if deferred:
+        return result, region
+      self.record(region, time.monotonic() - start)
+      return result
+
+  def stats(self):
+    """Returns a snapshot of the per-region statistics."""
+    with self._lock:
+      return {
+        region: {
+          "latency_seconds": stats.latency_seconds,
+          "error_rate": stats.error_rate,
+          "calls": stats.calls,
+          "errors": stats.errors,
+          "in_cooldown": stats.cooldown_until > time.monotonic(),
+        }
+        for region, stats in self._stats.items()
+      }
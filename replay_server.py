@@ -0,0 +1,179 @@
+"""Local websocket server that replays recorded market channel messages.
+
+Used to run `market_data.OrderBookStream` without a live connection:
+
+  server = replay_server.ReplayServer(replay_server.load_recording("session.jsonl")).start()
+  stream = market_data.OrderBookStream(client, token_ids, url=server.url).start()
+
+Each connection waits for the subscribe message, then plays the messages from where the
+previous connection stopped. `disconnect_every` drops the connection after that many messages
+to exercise reconnects. Only the parts of the websocket protocol a client needs for this
+are implemented: the handshake, unfragmented text frames, ping/pong and close.
+"""
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_TEXT = 0x1
+_CLOSE = 0x8
+_PING = 0x9
+_PONG = 0xA
+
+def load_recording(path):
+  """Loads a JSONL recording written by `OrderBookStream(record_path=...)`.
+
+  Returns:
+      list: (seconds since the start of the recording, raw message) tuples."""
+  with open(path) as f:
+    return [(entry["t"], entry["message"]) for entry in map(json.loads, f) if entry.get("message")]
+
+def _recv_exactly(conn, n):
+  data = b""
+  while len(data) < n:
+    chunk = conn.recv(n - len(data))
+    if not chunk:
+      raise ConnectionError("Client closed the connection")
+    data += chunk
+  return data
+
+def _read_frame(conn):
+  """Reads one client frame. Returns (opcode, payload)."""
+  first, second = _recv_exactly(conn, 2)
+  length = second & 0x7F
+  if length == 126:
+    length = struct.unpack(">H", _recv_exactly(conn, 2))[0]
+  elif length == 127:
+    length = struct.unpack(">Q", _recv_exactly(conn, 8))[0]
+  mask = _recv_exactly(conn, 4) if second & 0x80 else b"\0\0\0\0"
+  payload = _recv_exactly(conn, length)
+  return first & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+def _frame(opcode, payload):
+  header = bytes([0x80 | opcode])
+  if len(payload) < 126:
+    header += bytes([len(payload)])
+  elif len(payload) < 1 << 16:
+    header += bytes([126]) + struct.pack(">H", len(payload))
+  else:
+    header += bytes([127]) + struct.pack(">Q", len(payload))
+  return header + payload
+
+class ReplayServer:
+  """Plays recorded messages to websocket clients.
+
+  Args:
+      messages (list): Raw messages, or (seconds, raw message) tuples as returned by
+        `load_recording`.
+      host (str): Interface to listen on.
+      port (int): Port to listen on. 0 picks a free port; see `url`.
+      speed (float): Playback speed relative to the recorded timing. None sends as fast as
+        possible.
+      disconnect_every (int): Close each connection after this many messages."""
+
+  def __init__(self, messages, host="127.0.0.1", port=0, speed=None, disconnect_every=None):
+    self.messages = [m if isinstance(m, tuple) else (0.0, m) for m in messages]
+    self.speed = speed
+    self.disconnect_every = disconnect_every
+    self.subscriptions = []
+    self.connections = 0
+    self.position = 0
+    self._socket = socket.create_server((host, port))
+    self._stopped = threading.Event()
+    self._lock = threading.Lock()
+
+  @property
+  def url(self):
+    host, port = self._socket.getsockname()[:2]
+    return f"ws://{host}:{port}"
+
+  def start(self):
+    threading.Thread(target=self._serve, name="replay-server", daemon=True).start()
+    return self
+
+  def stop(self):
+    self._stopped.set()
+    self._socket.close()
+
+  def done(self):
+    """True once every message has been sent."""
+    return self.position >= len(self.messages)
+
+  def _serve(self):
+    while not self._stopped.is_set():
+      try:
+        conn, _ = self._socket.accept()
+      except OSError:
+        return
+      threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+  def _handshake(self, conn):
+    request = b""
+    while b"\r\n\r\n" not in request:
+      chunk = conn.recv(4096)
+      if not chunk:
+        raise ConnectionError("Client closed the connection during the handshake")
+      request += chunk
+    headers = {}
+    for line in request.decode('latin-1').split("\r\n")[1:]:
+      if ":" in line:
+        name, value = line.split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    accept = base64.b64encode(
+      hashlib.sha1((headers["sec-websocket-key"] + _WEBSOCKET_GUID).encode()).digest()).decode()
+    conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+  def _read_control_frames(self, conn, closed):
+    try:
+      while not closed.is_set():
+        opcode, payload = _read_frame(conn)
+        if opcode == _PING:
+          with self._lock:
+            conn.sendall(_frame(_PONG, payload))
+        elif opcode == _CLOSE:
+          break
+    except (ConnectionError, OSError):
+      pass
+    closed.set()
+
+  def _handle(self, conn):
+    closed = threading.Event()
+    try:
+      self._handshake(conn)
+      opcode, payload = _read_frame(conn)
+      if opcode == _TEXT:
+        self.subscriptions.append(json.loads(payload))
+      self.connections += 1
+      threading.Thread(target=self._read_control_frames, args=(conn, closed), daemon=True).start()
+
+      sent = 0
+      previous_time = None
+      while self.position < len(self.messages) and not closed.is_set() and not self._stopped.is_set():
+        if self.disconnect_every and sent >= self.disconnect_every:
+          break
+        recorded_time, message = self.messages[self.position]
+        if self.speed and previous_time is not None:
+          time.sleep(max(0.0, recorded_time - previous_time) / self.speed)
+        previous_time = recorded_time
+        with self._lock:
+          conn.sendall(_frame(_TEXT, message.encode('utf-8')))
+        self.position += 1
+        sent += 1
+
+      if self.disconnect_every and sent >= self.disconnect_every:
+        with self._lock:
+          conn.sendall(_frame(_CLOSE, struct.pack(">H", 1001)))
+      else:
+        # Keep the connection open like the live feed until the client leaves.
+        while not closed.wait(0.1) and not self._stopped.is_set():
+          pass
+    except (ConnectionError, OSError):
+      pass
+    finally:
+      closed.set()
+      conn.close()
@@ -0,0 +1,140 @@
+"""Compacts research reports to a token budget before they go into the analysis prompt.
+
+A report is split into blocks (paragraphs, with a heading kept together with the block after
+it). Boilerplate lines and repeated citations are dropped, duplicate blocks are removed, and
+if the report is still over budget the blocks are ranked by BM25 relevance to the market
+description and the best ones are kept, in their original order, until the budget is used.
+Token counts use `rate_limiter.estimate_tokens`, the same estimate the scheduler uses.
+"""
+import math
+import re
+from collections import Counter
+
+import rate_limiter
+
+# Lines that carry no information for the analysis.
+BOILERPLATE_PATTERNS = [
+  r"^(i'?ll|i will|let me) (search|look|research|compile|provide)\b.*",
+  r"^(here is|here's|below is) (a|the|my) .*(report|summary|overview).*:?$",
+  r"^(note|disclaimer): .*(not (financial|investment) advice|for informational purposes).*",
+  r"^(i hope|hope) this (helps|report).*",
+  r"^(let me know|feel free to) .*",
+  r"^-{3,}$",
+]
+_BOILERPLATE = [re.compile(pattern, re.IGNORECASE) for pattern in BOILERPLATE_PATTERNS]
+_CITATION_RUN = re.compile(r"((\[\d+\])+)")
+_CITATION = re.compile(r"\[\d+\]")
+_URL = re.compile(r"https?://\S+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+  "a an and are as at be by for from has have in is it its of on or that the this to was were will "
+  "with which who what when where would should could been their there these those than then".split())
+
+def count_tokens(text):
+  return rate_limiter.estimate_tokens(text)
+
+def _terms(text):
+  return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+def _dedupe_citations(line):
+  """Collapses runs of citation markers to their distinct markers, e.g. [1][1][2] -> [1][2]."""
+  def collapse(match):
+    return "".join(dict.fromkeys(_CITATION.findall(match.group(1))))
+  return _CITATION_RUN.sub(collapse, line)
+
+def split_blocks(report):
+  """Splits a report into blocks of lines, attaching headings to the block that follows."""
+  blocks = []
+  current = []
+  pending_heading = []
+  for line in report.splitlines():
+    stripped = line.strip()
+    if not stripped:
+      if current:
+        blocks.append("\n".join(pending_heading + current))
+        pending_heading, current = [], []
+      continue
+    is_heading = stripped.startswith("#") or (stripped.endswith(":") and len(stripped) < 80)
+    if is_heading and not current:
+      pending_heading.append(line)
+    elif is_heading:
+      blocks.append("\n".join(pending_heading + current))
+      pending_heading, current = [line], []
+    else:
+      current.append(line)
+  if current or pending_heading:
+    blocks.append("\n".join(pending_heading + current))
+  return blocks
+
+def clean_blocks(blocks):
+  """Drops boilerplate lines, repeated citation markers and source lines, and duplicate blocks."""
+  seen_blocks = set()
+  seen_urls = set()
+  cleaned = []
+  for block in blocks:
+    lines = []
+    for line in block.splitlines():
+      stripped = line.strip()
+      if any(pattern.match(stripped) for pattern in _BOILERPLATE):
+        continue
+      urls = _URL.findall(stripped)
+      # A line that is only a source reference is dropped when the source was already listed.
+      if urls and len(_URL.sub("", _CITATION.sub("", stripped)).strip(" -*:.")) < 20:
+        if all(url in seen_urls for url in urls):
+          continue
+      seen_urls.update(urls)
+      lines.append(_dedupe_citations(line))
+    text = "\n".join(lines).strip()
+    normalized = " ".join(_terms(_CITATION.sub("", text)))
+    if not text or normalized in seen_blocks:
+      continue
+    seen_blocks.add(normalized)
+    cleaned.append(text)
+  return cleaned
+
+def bm25_scores(blocks, query, k1=1.5, b=0.75):
+  """Scores each block's relevance to the query with BM25, using the blocks as the corpus."""
+  documents = [Counter(_terms(block)) for block in blocks]
+  lengths = [sum(document.values()) for document in documents]
+  average_length = sum(lengths) / len(lengths) if lengths else 0
+  document_frequency = Counter(term for document in documents for term in document)
+  scores = []
+  for document, length in zip(documents, lengths):
+    score = 0.0
+    for term in set(_terms(query)):
+      frequency = document.get(term, 0)
+      if not frequency:
+        continue
+      idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+      score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / (average_length or 1)))
+    scores.append(score)
+  return scores
+
+def compact_report(report, market_description, token_budget):
+  """Compacts a report for one market to at most `token_budget` tokens.
+
+  The first block (usually the summary) is always kept. A single block larger than the
+  budget is kept whole rather than cut mid-sentence.
+
+  Returns:
+      tuple: (compacted report, stats dict with `tokens_before`, `tokens_after`,
+        `blocks_before` and `blocks_after`)"""
+  blocks = split_blocks(report)
+  cleaned = clean_blocks(blocks)
+  stats = {"tokens_before": count_tokens(report), "blocks_before": len(blocks)}
+  if token_budget is None or count_tokens("\n\n".join(cleaned)) <= token_budget:
+    kept = cleaned
+  else:
+    scores = bm25_scores(cleaned, market_description)
+    chosen = {0}
+    used = count_tokens(cleaned[0])
+    for index in sorted(range(1, len(cleaned)), key=lambda i: -scores[i]):
+      tokens = count_tokens(cleaned[index])
+      if used + tokens <= token_budget:
+        chosen.add(index)
+        used += tokens
+    kept = [cleaned[index] for index in sorted(chosen)]
+  compacted = "\n\n".join(kept)
+  stats["tokens_after"] = count_tokens(compacted)
+  stats["blocks_after"] = len(kept)
+  return compacted, stats
@@ -0,0 +1,228 @@
+"""Vectorized edge and expected value scoring over every token and every ask level.
+
+Predictions, uncertainty bounds and the full bid/ask ladders are packed into NumPy arrays once
+per book refresh. Edge, confidence-weighted EV and risk-adjusted EV are then computed for all
+tokens and all ask levels in one pass, and the top K opportunities are selected with a partial
+partition instead of a full sort.
+
+Scores per token t and ask level l:
+  edge[t, l]        = probability[t] - ask_price[t, l]
+  ev[t, l]          = edge[t, l] * model_confidence[t]
+  adjusted_ev[t, l] = ev[t, l] * (1 - (1 - risk_tolerance) * (upper_bound[t] - lower_bound[t]))
+
+`probability` and the bounds are for the token's own outcome, so they are inverted for "No".
+
+Given a stake or a slippage limit, tokens are instead scored at the VWAP of the simulated fill
+(see fill_simulator), and `expected_profit` is the risk-adjusted EV times the shares filled.
+"""
+import numpy as np
+
+import fill_simulator
+
+DEFAULT_RISK_TOLERANCE = 0.7
+METRICS = ("edge", "ev", "adjusted_ev")
+FILL_METRICS = METRICS + ("expected_profit",)
+
+def invert_prediction_probability(pred):
+  """Returns the prediction for the "No" outcome of a market."""
+  return {
+    "probability": 1 - pred["probability"],
+    "model_confidence": pred["model_confidence"],
+    "uncertainty": {
+      "upper_bound": 1 - pred["uncertainty"]["lower_bound"],
+      "lower_bound": 1 - pred["uncertainty"]["upper_bound"],
+      "confidence_level": pred["uncertainty"]["confidence_level"],
+    }
+  }
+
+def _ladder(levels, max_levels, descending):
+  """Returns (prices, sizes) sorted best first, NaN padded to max_levels."""
+  prices = np.full(max_levels, np.nan)
+  sizes = np.full(max_levels, np.nan)
+  pairs = sorted(((float(level.price), float(level.size)) for level in levels or []),
+                 reverse=descending)[:max_levels]
+  for i, (price, size) in enumerate(pairs):
+    prices[i] = price
+    sizes[i] = size
+  return prices, sizes
+
+class ScoringUniverse:
+  """Packed arrays for every token that has both a prediction and an order book.
+
+  Args:
+      markets (dict): Maps condition_id to a CLOB market.
+      order_books (dict): Maps token_id to OrderBookSummary.
+      predictions (dict): Maps condition_id to a parsed prediction.
+      max_levels (int): Book levels kept per side. Defaults to the deepest book."""
+
+  def __init__(self, markets, order_books, predictions, max_levels=None):
+    rows = []
+    for condition_id, market in markets.items():
+      prediction = predictions.get(condition_id)
+      if not prediction:
+        continue
+      for token in market.get('tokens', []):
+        book = order_books.get(token.get('token_id'))
+        if book is None:
+          continue
+        token_prediction = (invert_prediction_probability(prediction)
+                            if token.get('outcome') == 'No' else prediction)
+        rows.append((condition_id, market, token, book, token_prediction))
+
+    if max_levels is None:
+      max_levels = max([max(len(r[3].asks or []), len(r[3].bids or [])) for r in rows] or [0])
+    self.max_levels = max(1, max_levels)
+
+    n = len(rows)
+    self.condition_ids = [r[0] for r in rows]
+    self.token_ids = [r[2]['token_id'] for r in rows]
+    self.titles = [r[1].get('question', '') for r in rows]
+    self.outcomes = [r[2].get('outcome', '') for r in rows]
+    self.predictions = [r[4] for r in rows]
+    self.token_index = {token_id: i for i, token_id in enumerate(self.token_ids)}
+    self.probability = np.array([p['probability'] for p in self.predictions], dtype=float).reshape(n)
+    self.model_confidence = np.array([p['model_confidence'] for p in self.predictions], dtype=float).reshape(n)
+    self.lower_bound = np.array([p['uncertainty']['lower_bound'] for p in self.predictions], dtype=float).reshape(n)
+    self.upper_bound = np.array([p['uncertainty']['upper_bound'] for p in self.predictions], dtype=float).reshape(n)
+    self.ask_price = np.full((n, self.max_levels), np.nan)
+    self.ask_size = np.full((n, self.max_levels), np.nan)
+    self.bid_price = np.full((n, self.max_levels), np.nan)
+    self.bid_size = np.full((n, self.max_levels), np.nan)
+    for i, row in enumerate(rows):
+      self.set_book(i, row[3])
+
+  def __len__(self):
+    return len(self.token_ids)
+
+  def set_book(self, index, book):
+    """Replaces the packed ladders of one token, e.g. after a book update."""
+    self.ask_price[index], self.ask_size[index] = _ladder(book.asks, self.max_levels, descending=False)
+    self.bid_price[index], self.bid_size[index] = _ladder(book.bids, self.max_levels, descending=True)
+
+  def set_prediction(self, index, prediction):
+    """Replaces the packed prediction of one token. Pass the token's own-outcome prediction."""
+    self.predictions[index] = prediction
+    self.probability[index] = prediction['probability']
+    self.model_confidence[index] = prediction['model_confidence']
+    self.lower_bound[index] = prediction['uncertainty']['lower_bound']
+    self.upper_bound[index] = prediction['uncertainty']['upper_bound']
+
+  def risk_factor(self, risk_tolerance=DEFAULT_RISK_TOLERANCE):
+    """Per-token multiplier that turns EV into risk-adjusted EV."""
+    return 1 - (1 - risk_tolerance) * (self.upper_bound - self.lower_bound)
+
+  def score(self, risk_tolerance=DEFAULT_RISK_TOLERANCE, rows=slice(None)):
+    """Scores every ask level of the selected tokens.
+
+    Returns:
+        dict: `edge`, `ev` and `adjusted_ev` arrays of shape (tokens, levels). Empty levels are NaN."""
+    edge = self.probability[rows, None] - self.ask_price[rows]
+    ev = edge * self.model_confidence[rows, None]
+    adjusted_ev = ev * self.risk_factor(risk_tolerance)[rows, None]
+    return {"edge": edge, "ev": ev, "adjusted_ev": adjusted_ev}
+
+  def fill_scores(self, stake=None, max_slippage=None, risk_tolerance=DEFAULT_RISK_TOLERANCE, rows=slice(None)):
+    """Scores the selected tokens at the VWAP of a simulated fill through their ask ladders.
+
+    Args:
+        stake (float or np.ndarray): USDC to spend per token, see `fill_simulator.simulate_fills`.
+        max_slippage (float): Highest price above the best ask a fill may reach.
+
+    Returns:
+        dict: Per-token arrays. `edge`, `ev` and `adjusted_ev` are per share at the fill VWAP,
+          `expected_profit` is `adjusted_ev` times the shares filled. `fill_shares`,
+          `fill_cost`, `fill_vwap` and `fill_levels` describe the fill, and `break_even_stake`
+          and `break_even_shares` the largest fill whose marginal edge is still positive."""
+    ask_price, ask_size = self.ask_price[rows], self.ask_size[rows]
+    if np.ndim(stake):
+      stake = np.asarray(stake, dtype=float)[rows]
+    probability = self.probability[rows]
+    fill = fill_simulator.simulate_fills(ask_price, ask_size, stake, max_slippage)
+    limit = fill_simulator.break_even(ask_price, ask_size, probability, max_slippage)
+    edge = probability - fill["vwap"]
+    ev = edge * self.model_confidence[rows]
+    adjusted_ev = ev * self.risk_factor(risk_tolerance)[rows]
+    return {
+      "edge": edge,
+      "ev": ev,
+      "adjusted_ev": adjusted_ev,
+      "expected_profit": adjusted_ev * fill["shares"],
+      "fill_shares": fill["shares"],
+      "fill_cost": fill["cost"],
+      "fill_vwap": fill["vwap"],
+      "fill_levels": fill["levels"],
+      "break_even_stake": limit["stake"],
+      "break_even_shares": limit["shares"],
+    }
+
+  def top_k(self, k, metric=None, risk_tolerance=DEFAULT_RISK_TOLERANCE, all_levels=False,
+            stake=None, max_slippage=None):
+    """Returns the k best (token index, level) pairs by a metric, best first.
+
+    Args:
+        k (int): Number of results.
+        metric (str): One of METRICS, or of FILL_METRICS when filling. Defaults to
+          `expected_profit` when filling and to `adjusted_ev` otherwise.
+        risk_tolerance (float): See the module docstring.
+        all_levels (bool): Rank every ask level; by default only each token's best ask.
+          Ignored when filling.
+        stake, max_slippage: If either is given, rank by a simulated fill (see `fill_scores`)
+          instead of by the best ask alone. Levels are then always 0."""
+    filling = stake is not None or max_slippage is not None
+    if metric is None:
+      metric = "expected_profit" if filling else "adjusted_ev"
+    if filling:
+      scores = self.fill_scores(stake, max_slippage, risk_tolerance)[metric][:, None]
+    else:
+      scores = self.score(risk_tolerance)[metric]
+      if not all_levels:
+        scores = scores[:, :1]
+    flat = np.where(np.isnan(scores), -np.inf, scores).ravel()
+    k = min(k, np.count_nonzero(np.isfinite(flat)))
+    if k <= 0:
+      return []
+    # Partition out the top k, then sort only those.
+    top = np.argpartition(-flat, k - 1)[:k]
+    top = top[np.argsort(-flat[top], kind='stable')]
+    levels = scores.shape[1]
+    return [(int(i // levels), int(i % levels)) for i in top]
+
+  def summary(self, index, level=0, risk_tolerance=DEFAULT_RISK_TOLERANCE, stake=None, max_slippage=None):
+    """Returns the market summary dict used by pretty_print_data for one token and ask level.
+
+    With a stake or slippage limit, the scores are those of the simulated fill and the
+    `fill_*`, `expected_profit` and `break_even_*` keys of `fill_scores` are added."""
+    scores = self.score(risk_tolerance, rows=slice(index, index + 1))
+    prediction = self.predictions[index]
+    summary = {
+      'title': self.titles[index],
+      'outcome': self.outcomes[index],
+      'condition_id': self.condition_ids[index],
+      'token_id': self.token_ids[index],
+      'probability': prediction['probability'],
+      'model_confidence': prediction['model_confidence'],
+      'uncertainty': prediction['uncertainty'],
+      'best_ask_price': float(self.ask_price[index, level]),
+      'best_ask_size': float(self.ask_size[index, level]),
+      'ask_level': level,
+      'edge': float(scores['edge'][0, level]),
+      'ev': float(scores['ev'][0, level]),
+      'adjusted_ev': float(scores['adjusted_ev'][0, level]),
+    }
+    if stake is not None or max_slippage is not None:
+      fill = self.fill_scores(stake, max_slippage, risk_tolerance, rows=slice(index, index + 1))
+      summary.update({key: value[0].item() for key, value in fill.items()})
+    return summary
+
+def rank_opportunities(markets, order_books, predictions, k=None, risk_tolerance=DEFAULT_RISK_TOLERANCE,
+                       metric=None, stake=None, max_slippage=None):
+  """Scores every token and returns market summaries, best first.
+
+  Args:
+      k (int): Number of summaries to return. Defaults to all tokens with an ask.
+      stake, max_slippage: Rank by a fill of this size through the book instead of by the best
+        ask alone, see `ScoringUniverse.top_k`."""
+  universe = ScoringUniverse(markets, order_books, predictions)
+  k = len(universe) if k is None else k
+  ranked = universe.top_k(k, metric=metric, risk_tolerance=risk_tolerance, stake=stake, max_slippage=max_slippage)
+  return [universe.summary(index, level, risk_tolerance, stake, max_slippage) for index, level in ranked]
@@ -0,0 +1,294 @@
+"""Columnar, memory-mapped Polymarket snapshots.
+
+A snapshot is a directory with one `.npy` file per column and a `manifest.json`. Opening a
+snapshot only reads the manifest; columns are memory-mapped when first used, so a reader
+only pays for the columns and rows it touches. Tables:
+
+  markets:      condition_id, question, description, category, end_date, active, closed, neg_risk
+  market_tags:  market, tag
+  tokens:       token_id, market, outcome, price
+  book_levels:  token, side, price, size
+  predictions:  market, probability, lower_bound, upper_bound, confidence_level,
+                model_confidence, reasoning
+
+`market` and `token` columns are row numbers into the markets and tokens tables. `end_date`
+is in epoch seconds (MISSING_TIME when unknown) and `side` is BID or ASK.
+
+String columns are stored either as a dictionary (`codes` plus the distinct values in the
+manifest) for low-cardinality columns, or as `text` (UTF-8 bytes plus int64 offsets).
+"""
+import json
+import operator
+import os
+from datetime import datetime
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+MISSING_TIME = -1
+BID = 0
+ASK = 1
+
+# (column, dtype or string encoding) per table, in file order.
+SCHEMA = {
+  "markets": [
+    ("condition_id", "text"),
+    ("question", "text"),
+    ("description", "text"),
+    ("category", "dict"),
+    ("end_date", "int64"),
+    ("active", "bool"),
+    ("closed", "bool"),
+    ("neg_risk", "bool"),
+  ],
+  "market_tags": [("market", "int32"), ("tag", "dict")],
+  "tokens": [("token_id", "text"), ("market", "int32"), ("outcome", "dict"), ("price", "float64")],
+  "book_levels": [("token", "int32"), ("side", "int8"), ("price", "float64"), ("size", "float64")],
+  "predictions": [
+    ("market", "int32"),
+    ("probability", "float64"),
+    ("lower_bound", "float64"),
+    ("upper_bound", "float64"),
+    ("confidence_level", "float64"),
+    ("model_confidence", "float64"),
+    ("reasoning", "text"),
+  ],
+}
+
+_OPERATORS = {
+  "==": operator.eq,
+  "!=": operator.ne,
+  "<": operator.lt,
+  "<=": operator.le,
+  ">": operator.gt,
+  ">=": operator.ge,
+}
+
+def _epoch_seconds(iso_date):
+  if not isinstance(iso_date, str) or not iso_date:
+    return MISSING_TIME
+  try:
+    return int(datetime.fromisoformat(iso_date.replace('Z', '+00:00')).timestamp())
+  except ValueError:
+    return MISSING_TIME
+
+def _float(value, default=np.nan):
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return default
+
+def _write_column(path, table, column, kind, values):
+  prefix = os.path.join(path, f"{table}.{column}")
+  if kind == "text":
+    encoded = [("" if value is None else str(value)).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.array([len(value) for value in encoded], dtype=np.int64))
+    np.save(prefix + ".offsets.npy", offsets)
+    np.save(prefix + ".data.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    return None
+  if kind == "dict":
+    values = ["" if value is None else str(value) for value in values]
+    dictionary = sorted(set(values))
+    index = {value: code for code, value in enumerate(dictionary)}
+    np.save(prefix + ".codes.npy", np.array([index[value] for value in values], dtype=np.int32))
+    return dictionary
+  np.save(prefix + ".npy", np.array(values, dtype=kind))
+  return None
+
+def write_snapshot(path, markets, order_books=None, predictions=None):
+  """Writes markets, their order books and predictions as a columnar snapshot.
+
+  Args:
+      path (str): Snapshot directory. Created if missing; existing columns are overwritten.
+      markets (dict): Maps condition_id to a CLOB market.
+      order_books (dict): Maps token_id to OrderBookSummary.
+      predictions (dict): Maps condition_id to a parsed prediction.
+
+  Returns:
+      dict: Row counts per table."""
+  order_books = order_books or {}
+  predictions = predictions or {}
+  os.makedirs(path, exist_ok=True)
+
+  rows = {table: {column: [] for column, _ in columns} for table, columns in SCHEMA.items()}
+  condition_id_to_row = {}
+  token_id_to_row = {}
+  for condition_id, market in markets.items():
+    market_row = len(condition_id_to_row)
+    condition_id_to_row[condition_id] = market_row
+    table = rows["markets"]
+    table["condition_id"].append(condition_id)
+    table["question"].append(market.get('question', ''))
+    table["description"].append(market.get('description', ''))
+    table["category"].append(market.get('category', ''))
+    table["end_date"].append(_epoch_seconds(market.get('end_date_iso')))
+    table["active"].append(bool(market.get('active')))
+    table["closed"].append(bool(market.get('closed')))
+    table["neg_risk"].append(bool(market.get('neg_risk')))
+    for tag in market.get('tags') or []:
+      rows["market_tags"]["market"].append(market_row)
+      rows["market_tags"]["tag"].append(tag)
+    for token in market.get('tokens', []):
+      token_id_to_row[token['token_id']] = len(token_id_to_row)
+      rows["tokens"]["token_id"].append(token['token_id'])
+      rows["tokens"]["market"].append(market_row)
+      rows["tokens"]["outcome"].append(token.get('outcome', ''))
+      rows["tokens"]["price"].append(_float(token.get('price')))
+
+  for token_id, book in order_books.items():
+    if token_id not in token_id_to_row:
+      # Books of tokens outside the given markets are kept with no market.
+      token_id_to_row[token_id] = len(token_id_to_row)
+      rows["tokens"]["token_id"].append(token_id)
+      rows["tokens"]["market"].append(-1)
+      rows["tokens"]["outcome"].append('')
+      rows["tokens"]["price"].append(np.nan)
+    for side, levels in ((BID, book.bids or []), (ASK, book.asks or [])):
+      for level in levels:
+        rows["book_levels"]["token"].append(token_id_to_row[token_id])
+        rows["book_levels"]["side"].append(side)
+        rows["book_levels"]["price"].append(_float(level.price))
+        rows["book_levels"]["size"].append(_float(level.size))
+
+  for condition_id, prediction in predictions.items():
+    if condition_id not in condition_id_to_row or not prediction:
+      continue
+    uncertainty = prediction.get('uncertainty', {})
+    table = rows["predictions"]
+    table["market"].append(condition_id_to_row[condition_id])
+    table["probability"].append(_float(prediction.get('probability')))
+    table["lower_bound"].append(_float(uncertainty.get('lower_bound')))
+    table["upper_bound"].append(_float(uncertainty.get('upper_bound')))
+    table["confidence_level"].append(_float(uncertainty.get('confidence_level')))
+    table["model_confidence"].append(_float(prediction.get('model_confidence')))
+    table["reasoning"].append(prediction.get('reasoning', ''))
+
+  manifest = {"tables": {}}
+  for table, columns in SCHEMA.items():
+    table_manifest = {"rows": len(rows[table][columns[0][0]]), "columns": {}}
+    for column, kind in columns:
+      dictionary = _write_column(path, table, column, kind, rows[table][column])
+      table_manifest["columns"][column] = {"kind": kind}
+      if dictionary is not None:
+        table_manifest["columns"][column]["dictionary"] = dictionary
+    manifest["tables"][table] = table_manifest
+  with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+    json.dump(manifest, f)
+  return {table: manifest["tables"][table]["rows"] for table in SCHEMA}
+
+class TextColumn:
+  """Memory-mapped UTF-8 string column. Strings are decoded only when indexed."""
+
+  def __init__(self, offsets, data):
+    self.offsets = offsets
+    self.data = data
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, row):
+    start, end = self.offsets[row], self.offsets[row + 1]
+    return bytes(self.data[start:end]).decode('utf-8')
+
+  def take(self, rows):
+    return [self[row] for row in rows]
+
+class SnapshotReader:
+  """Reads a snapshot written by `write_snapshot` with column projection and predicate pushdown.
+
+  Args:
+      path (str): Snapshot directory."""
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+      self.manifest = json.load(f)
+    self._columns = {}
+
+  def rows(self, table):
+    return self.manifest["tables"][table]["rows"]
+
+  def column(self, table, column):
+    """Returns a column as a memory-mapped array (dict columns as codes) or a TextColumn."""
+    key = (table, column)
+    if key not in self._columns:
+      kind = self.manifest["tables"][table]["columns"][column]["kind"]
+      prefix = os.path.join(self.path, f"{table}.{column}")
+      if kind == "text":
+        self._columns[key] = TextColumn(
+          np.load(prefix + ".offsets.npy", mmap_mode='r'), np.load(prefix + ".data.npy", mmap_mode='r'))
+      elif kind == "dict":
+        self._columns[key] = np.load(prefix + ".codes.npy", mmap_mode='r')
+      else:
+        self._columns[key] = np.load(prefix + ".npy", mmap_mode='r')
+    return self._columns[key]
+
+  def _dictionary(self, table, column):
+    return self.manifest["tables"][table]["columns"][column].get("dictionary")
+
+  def _mask(self, table, column, op, value):
+    kind = self.manifest["tables"][table]["columns"][column]["kind"]
+    data = self.column(table, column)
+    if isinstance(value, datetime):
+      value = int(value.timestamp())
+    if kind == "dict":
+      # Compare codes instead of strings. Unknown values match nothing.
+      dictionary = self._dictionary(table, column)
+      values = value if op in ("in", "not in") else [value]
+      codes = [dictionary.index(v) for v in values if v in dictionary]
+      if op in ("in", "==", "not in", "!="):
+        mask = np.isin(data, codes)
+        return ~mask if op in ("not in", "!=") else mask
+      raise ValueError(f"Operator {op} is not supported on dictionary column {column}")
+    if kind == "text":
+      # Text columns are decoded row by row, so prefer filtering on other columns first.
+      strings = data.take(range(len(data)))
+      if op in ("in", "not in"):
+        mask = np.array([s in value for s in strings], dtype=bool)
+        return ~mask if op == "not in" else mask
+      return np.array([_OPERATORS[op](s, value) for s in strings], dtype=bool)
+    if op in ("in", "not in"):
+      mask = np.isin(data, list(value))
+      return ~mask if op == "not in" else mask
+    return _OPERATORS[op](data, value)
+
+  def select(self, table, where=()):
+    """Returns the row numbers of a table that match every predicate.
+
+    Args:
+        table (str): Table name.
+        where (list): (column, op, value) predicates. Ops are ==, !=, <, <=, >, >=, in and
+          not in. Datetime values are compared against epoch-second columns."""
+    mask = np.ones(self.rows(table), dtype=bool)
+    for column, op, value in where:
+      mask &= self._mask(table, column, op, value)
+    return np.flatnonzero(mask)
+
+  def read(self, table, columns=None, where=()):
+    """Reads the selected columns of the rows that match `where`.
+
+    Returns:
+        dict: Maps column name to a NumPy array, or to a list of str for string columns."""
+    rows = self.select(table, where)
+    columns = columns or [column for column, _ in SCHEMA[table]]
+    result = {}
+    for column in columns:
+      data = self.column(table, column)
+      if isinstance(data, TextColumn):
+        result[column] = data.take(rows)
+      elif self._dictionary(table, column) is not None:
+        dictionary = self._dictionary(table, column)
+        result[column] = [dictionary[code] for code in data[rows]]
+      else:
+        result[column] = np.asarray(data[rows])
+    return result
+
+def open_snapshots(directory, prefix="polymarket_snapshot_"):
+  """Opens every columnar snapshot under a directory, keyed by the name suffix (e.g. the date)."""
+  readers = {}
+  for name in sorted(os.listdir(directory)):
+    path = os.path.join(directory, name)
+    if name.startswith(prefix) and os.path.isfile(os.path.join(path, MANIFEST_FILE)):
+      readers[name[len(prefix):]] = SnapshotReader(path)
+  return readers
@@ -0,0 +1,299 @@
+"""Runs a DAG of pipeline stages with content-hashed checkpoints, so a failed run can resume.
+
+A stage either runs once (its output is one value) or once per market (its output is a dict of
+market key to value). Per-market stages are pipelined: a market's task for a stage is started
+as soon as that market's upstream tasks are done, not when the whole upstream stage is, so one
+market's analysis can run while other markets' reports are still being written. Stages whose
+dependencies are met run concurrently, and each task runs on the worker pool its stage names,
+which caps the concurrent calls per provider.
+
+Every finished task is pickled under `<run_dir>/checkpoints/<stage>/<key>.pkl` and recorded in
+the append-only `<run_dir>/journal.jsonl`. The key is a hash of the stage name and version and
+of the task's inputs: the digests of the upstream outputs for a stage that runs once, the
+values returned by `market_inputs` for a per-market task. Resuming a run reuses a task's
+checkpoint when its key is unchanged and it is younger than the stage's `max_age_hours`, and
+runs everything else: the tasks that failed, never ran, or whose inputs changed.
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import cache_keys
+
+class Stage:
+  """A node of the DAG.
+
+  Args:
+      name (str): Unique stage name.
+      deps (list): Names of the stages whose outputs this stage reads.
+      run (callable): `run(inputs)` for a stage that runs once, with `inputs` mapping each
+        dependency to its output. `run(key, inputs)` for a per-market stage, with `inputs` as
+        returned by `market_inputs`. Raise to fail the task.
+      per_market (bool): Run once per market.
+      markets (callable): `markets(outputs) -> keys` of a per-market stage without per-market
+        dependencies. Other per-market stages run for the markets their upstream stages finished.
+      market_inputs (callable): `market_inputs(key, outputs) -> JSON-serializable inputs` of one
+        market's task. `outputs` maps each dependency to its output, per-market ones as dicts.
+      version: Anything whose change should invalidate the stage's checkpoints, e.g. model,
+        prompts and settings.
+      pool (str): Worker pool of the stage's tasks.
+      max_age_hours (float): Checkpoints older than this are redone on resume, e.g. for order
+        books. None keeps them for the life of the run."""
+
+  def __init__(self, name, deps, run, per_market=False, markets=None, market_inputs=None, version=1,
+               pool="local", max_age_hours=None):
+    self.name = name
+    self.deps = list(deps)
+    self.run = run
+    self.per_market = per_market
+    self.markets = markets
+    self.market_inputs = market_inputs
+    self.version = version
+    self.pool = pool
+    self.max_age_hours = max_age_hours
+
+class StageDag:
+  """Runs stages in dependency order with checkpoints under `run_dir`.
+
+  Args:
+      stages (list): The `Stage`s, in any order.
+      run_dir (str): Directory of the run's checkpoints and journal.
+      resume (bool): Reuse the checkpoints of an earlier run in `run_dir`.
+      pools (dict): Maps a pool name to its number of workers. Unlisted pools get one worker."""
+
+  def __init__(self, stages, run_dir, resume=False, pools=None):
+    self.stages = {stage.name: stage for stage in stages}
+    for stage in stages:
+      for dep in stage.deps:
+        if dep not in self.stages:
+          raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+    self.run_dir = run_dir
+    self.pools = pools or {}
+    self.journal_path = os.path.join(run_dir, "journal.jsonl")
+    self._journal_lock = threading.Lock()
+    self.previous = self._load_journal() if resume else {}
+    self.outputs = {}
+    self.digests = {}
+    # Per stage: tasks run, reused, failed and blocked (upstream failed), and seconds spent running.
+    self.stats = defaultdict(lambda: {"ran": 0, "reused": 0, "failed": 0, "blocked": 0, "seconds": 0.0})
+    self.errors = {}
+
+  def _load_journal(self):
+    entries = {}
+    if os.path.exists(self.journal_path):
+      with open(self.journal_path) as f:
+        for line in f:
+          if line.strip():
+            entry = json.loads(line)
+            entries[entry["task"]] = entry
+    return entries
+
+  def _record(self, entry):
+    with self._journal_lock:
+      with open(self.journal_path, 'a') as f:
+        f.write(json.dumps(entry) + "\n")
+
+  def _checkpoint_path(self, stage, key):
+    return os.path.join(self.run_dir, "checkpoints", stage.name, f"{key}.pkl")
+
+  def _reusable(self, stage, task_id, key):
+    entry = self.previous.get(task_id)
+    if entry is None or entry["status"] != "done" or entry["key"] != key:
+      return None
+    if stage.max_age_hours is not None and time.time() - entry["finished_at"] > stage.max_age_hours * 3600:
+      return None
+    if not os.path.exists(self._checkpoint_path(stage, key)):
+      return None
+    return entry
+
+  def _execute(self, stage, task_id, key, call):
+    """Runs one task in a worker thread, or loads its checkpoint.
+
+    Returns:
+        tuple: (output, digest of the pickled output, whether it was reused, seconds spent)"""
+    entry = self._reusable(stage, task_id, key)
+    if entry is not None:
+      with open(self._checkpoint_path(stage, key), 'rb') as f:
+        return pickle.load(f), entry["digest"], True, 0.0
+    started_at = time.time()
+    try:
+      output = call()
+    except Exception as e:
+      self._record({"task": task_id, "key": key, "status": "failed", "error": str(e),
+                    "finished_at": time.time(), "seconds": time.time() - started_at})
+      raise
+    data = pickle.dumps(output)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    path = self._checkpoint_path(stage, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'wb') as f:
+      f.write(data)
+    os.replace(path + ".tmp", path)
+    seconds = time.time() - started_at
+    self._record({"task": task_id, "key": key, "status": "done", "digest": digest,
+                  "finished_at": time.time(), "seconds": seconds})
+    return output, digest, False, seconds
+
+  def run(self):
+    """Runs the DAG to completion.
+
+    Returns:
+        dict: Maps each completed stage to its output. Per-market stages map to a dict of the
+          markets that succeeded. Stages behind a failed stage are left out."""
+    os.makedirs(self.run_dir, exist_ok=True)
+    self._executors = {}
+    for stage in self.stages.values():
+      if stage.pool not in self._executors:
+        self._executors[stage.pool] = ThreadPoolExecutor(
+          max_workers=self.pools.get(stage.pool, 1), thread_name_prefix=stage.pool)
+    self._pending = {}
+    self._started = set()
+    self._complete = set()
+    self._failed = set()
+    # Markets handed to each per-market stage (blocked ones included) and markets it finished.
+    self._submitted = defaultdict(set)
+    self._finished = defaultdict(set)
+    self._market_digests = {}
+    try:
+      self._schedule()
+      while self._pending:
+        done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          self._task_done(future)
+    finally:
+      for executor in self._executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    return {name: self.outputs[name] for name in self._complete}
+
+  def _market_deps(self, stage):
+    return [dep for dep in stage.deps if self.stages[dep].per_market]
+
+  def _dependents(self, name):
+    return [stage for stage in self.stages.values() if name in stage.deps]
+
+  def _ready(self, stage):
+    """A stage starts once its dependencies are complete. A per-market stage only needs its
+    per-market dependencies to have started, and then follows them market by market."""
+    for dep in stage.deps:
+      if dep in self._complete:
+        continue
+      if not (stage.per_market and self.stages[dep].per_market and dep in self._started):
+        return False
+    return True
+
+  def _schedule(self):
+    for stage in self.stages.values():
+      if stage.name not in self._started and stage.name not in self._failed and self._ready(stage):
+        self._start(stage)
+
+  def _submit(self, stage, task_id, key, call, market=None):
+    future = self._executors[stage.pool].submit(self._execute, stage, task_id, key, call)
+    self._pending[future] = (stage, market, task_id)
+
+  def _start(self, stage):
+    self._started.add(stage.name)
+    if not stage.per_market:
+      inputs = {dep: self.outputs[dep] for dep in stage.deps}
+      key = cache_keys.fingerprint(stage.name, stage.version, [self.digests[dep] for dep in stage.deps], length=32)
+      self._submit(stage, stage.name, key, lambda: stage.run(inputs))
+      return
+    self.outputs[stage.name] = {}
+    upstream = self._market_deps(stage)
+    if upstream:
+      markets = set.intersection(*(self._finished[dep] for dep in upstream))
+    else:
+      markets = stage.markets(self.outputs)
+    for market in markets:
+      self._submit_market(stage, market)
+    self._check_complete(stage)
+
+  def _submit_market(self, stage, market):
+    if market in self._submitted[stage.name]:
+      return
+    self._submitted[stage.name].add(market)
+    if any(market not in self.outputs[dep] for dep in self._market_deps(stage)):
+      # An upstream task of this market failed.
+      self._finished[stage.name].add(market)
+      self.stats[stage.name]["blocked"] += 1
+      self._market_finished(stage, market)
+      return
+    inputs = stage.market_inputs(market, self.outputs) if stage.market_inputs else None
+    key = cache_keys.fingerprint(stage.name, stage.version, inputs, length=32)
+    self._submit(stage, f"{stage.name}/{market}", key, lambda: stage.run(market, inputs), market)
+
+  def _market_finished(self, stage, market):
+    """Passes a market that finished (or failed) a stage on to the started downstream stages."""
+    for dependent in self._dependents(stage.name):
+      if dependent.per_market and dependent.name in self._started:
+        if all(market in self._finished[dep] for dep in self._market_deps(dependent)):
+          self._submit_market(dependent, market)
+    self._check_complete(stage)
+
+  def _check_complete(self, stage):
+    """Completes a per-market stage once its upstream stages are complete and its markets finished."""
+    if stage.name in self._complete:
+      return
+    upstream = self._market_deps(stage)
+    if any(dep not in self._complete for dep in upstream):
+      return
+    if upstream and set.intersection(*(self._finished[dep] for dep in upstream)) - self._submitted[stage.name]:
+      return
+    if self._finished[stage.name] != self._submitted[stage.name]:
+      return
+    self.digests[stage.name] = cache_keys.fingerprint(
+      sorted((market, self._market_digests[(stage.name, market)]) for market in self.outputs[stage.name]))
+    self._complete_stage(stage)
+
+  def _complete_stage(self, stage):
+    self._complete.add(stage.name)
+    for dependent in self._dependents(stage.name):
+      if dependent.per_market and dependent.name in self._started:
+        self._check_complete(dependent)
+    self._schedule()
+
+  def _fail_stage(self, stage):
+    self._failed.add(stage.name)
+    for dependent in self._dependents(stage.name):
+      if dependent.name not in self._started and dependent.name not in self._failed:
+        self.stats[dependent.name]["blocked"] += 1
+        self._fail_stage(dependent)
+
+  def _task_done(self, future):
+    stage, market, task_id = self._pending.pop(future)
+    stats = self.stats[stage.name]
+    try:
+      output, digest, reused, seconds = future.result()
+    except Exception as e:
+      stats["failed"] += 1
+      self.errors[task_id] = str(e)
+      print(f"Error: {task_id} failed: {e}")
+      if market is None:
+        self._fail_stage(stage)
+      else:
+        self._finished[stage.name].add(market)
+        self._market_finished(stage, market)
+      return
+    stats["reused" if reused else "ran"] += 1
+    stats["seconds"] += seconds
+    if market is None:
+      self.outputs[stage.name] = output
+      self.digests[stage.name] = digest
+      self._complete_stage(stage)
+    else:
+      self.outputs[stage.name][market] = output
+      self._market_digests[(stage.name, market)] = digest
+      self._finished[stage.name].add(market)
+      self._market_finished(stage, market)
+
+  def report(self):
+    """Prints the tasks run, reused, failed and blocked per stage."""
+    print(f"{'stage':10} {'ran':>6} {'reused':>6} {'failed':>6} {'blocked':>7} {'seconds':>8}")
+    for name in self.stages:
+      stats = self.stats[name]
+      print(f"{name:10} {stats['ran']:6d} {stats['reused']:6d} {stats['failed']:6d} {stats['blocked']:7d} "
+            f"{stats['seconds']:8.1f}")
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.path.exists(".env"):
+  # prediction_pipeline reads its API keys from ./.env on import. The tests never reach the
+  # real APIs, so placeholder keys do.
+  os.chdir(tempfile.mkdtemp(prefix="prediction-trader-tests-"))
+  with open(".env", "w") as f:
+    f.write(f'PK="0x{"1" * 64}"\nGEMINI_API_KEY="test"\nPERPLEXITY_API_KEY="test"\n')
@@ -0,0 +1,94 @@
+import json
+import re
+
+import pytest
+
+import batch_predictions
+import cache_keys
+import disk_cache
+import fake_batch_server
+import prediction_pipeline
+
+MARKETS = {
+  "c1": "Question: Will it rain in Paris?\nDescription and Rules: Resolves YES if it rains.",
+  "c2": "Question: Will the bill pass?\nDescription and Rules: Resolves YES if it passes.",
+  "c3": "Question: Will the launch slip?\nDescription and Rules: Resolves YES if it slips.",
+}
+PROBABILITIES = {"Paris": 0.62, "bill": 0.35}
+
+def respond(request):
+  prompt = request["contents"][0]["parts"][0]["text"]
+  for word, probability in PROBABILITIES.items():
+    if word in prompt:
+      return "```json\n" + json.dumps({
+        "reasoning": f"Base rate for {word}.", "probability": probability, "model_confidence": 0.7,
+        "uncertainty": {"lower_bound": probability - 0.1, "upper_bound": probability + 0.1, "confidence_level": 0.9},
+      }) + "\n```"
+  raise ValueError("model overloaded")
+
+@pytest.fixture
+def reports(monkeypatch):
+  monkeypatch.setattr(prediction_pipeline, "create_report",
+                      lambda description, **kwargs: "Report on " + description.splitlines()[0])
+
+@pytest.fixture
+def cache(tmp_path):
+  return disk_cache.SQLiteCache(path=str(tmp_path / "cache.sqlite"))
+
+def serve(**kwargs):
+  server = fake_batch_server.FakeBatchServer(respond, api_key="test-key", **kwargs).start()
+  provider = batch_predictions.GeminiBatchProvider(
+    "test-key", base_url=server.api_url, download_url=server.download_url)
+  return server, provider
+
+@pytest.mark.parametrize("responses_file", [False, True])
+def test_submit_poll_and_load(reports, cache, tmp_path, responses_file):
+  server, provider = serve(running_polls=2, responses_file=responses_file)
+  try:
+    job_id, path, cached = batch_predictions.submit_batch(MARKETS, provider, cache=cache, batch_dir=str(tmp_path))
+    assert cached == {}
+    assert sorted(line["key"] for line in batch_predictions.read_batch_file(path)) == sorted(MARKETS)
+    model = prediction_pipeline.ANALYSIS_MODEL
+    assert ("POST", f"/v1beta/models/{model}:batchGenerateContent") in server.requests
+
+    assert batch_predictions.wait_for_batch(provider, job_id, poll_seconds=0) == "succeeded"
+    assert server.jobs[job_id]["polls"] == 4
+
+    spent_before = prediction_pipeline.scheduler.spent_today
+    predictions = batch_predictions.load_batch_results(provider, job_id, path, cache=cache)
+    assert prediction_pipeline.scheduler.spent_today > spent_before
+    downloads = [p for method, p in server.requests if re.match(r"/download/v1beta/files/.*:download$", p)]
+    assert bool(downloads) == responses_file
+  finally:
+    server.stop()
+
+  assert sorted(predictions) == ["c1", "c2"]
+  assert predictions["c1"]["probability"] == 0.62
+  assert predictions["c2"]["uncertainty"]["upper_bound"] == pytest.approx(0.45)
+  for key in ("c1", "c2"):
+    report = "Report on " + MARKETS[key].splitlines()[0]
+    cache_key = cache_keys.make_key("prediction", prediction_pipeline.PREDICTION_CACHE_VERSION, report, MARKETS[key])
+    assert cache.get(cache_key) == predictions[key]
+
+def test_cached_predictions_are_not_resubmitted(reports, cache, tmp_path):
+  server, provider = serve(running_polls=0)
+  try:
+    first = batch_predictions.create_batch_predictions(
+      MARKETS, provider, cache=cache, batch_dir=str(tmp_path), poll_seconds=0)
+    second = batch_predictions.create_batch_predictions(
+      MARKETS, provider, cache=cache, batch_dir=str(tmp_path), poll_seconds=0)
+  finally:
+    server.stop()
+  assert sorted(first) == ["c1", "c2"]
+  assert second == first
+  # The second run only resubmits the market whose analysis failed.
+  assert [len(job["responses"]) for job in server.jobs.values()] == [3, 1]
+
+def test_rejected_key(reports, cache, tmp_path):
+  server = fake_batch_server.FakeBatchServer(respond, api_key="test-key").start()
+  provider = batch_predictions.GeminiBatchProvider("wrong-key", base_url=server.api_url)
+  try:
+    with pytest.raises(Exception):
+      batch_predictions.submit_batch(MARKETS, provider, cache=cache, batch_dir=str(tmp_path))
+  finally:
+    server.stop()
@@ -0,0 +1,99 @@
+import pytest
+
+import cache_keys
+import disk_cache
+
+class Clock:
+  def __init__(self):
+    self.now = 1_700_000_000.0
+
+  def __call__(self):
+    return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+  clock = Clock()
+  monkeypatch.setattr(disk_cache.time, "time", clock)
+  return clock
+
+def make_cache(tmp_path, **kwargs):
+  return disk_cache.SQLiteCache(path=str(tmp_path / "cache.sqlite"), sweep_interval_seconds=None, **kwargs)
+
+def rows(cache):
+  return cache._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+def test_entries_expire_and_sweep_deletes_them(tmp_path, clock):
+  cache = make_cache(tmp_path, expiry_hours=1)
+  cache.set("old", {"report": "a"})
+  clock.now += 1800
+  cache.set("new", {"report": "b"})
+
+  clock.now += 2400
+  assert cache.get("old") is None
+  assert cache.get("new") == {"report": "b"}
+  assert rows(cache) == 2
+
+  assert cache.sweep() == 1
+  assert rows(cache) == 1
+
+def test_max_entries_evicts_the_least_recently_used(tmp_path, clock):
+  cache = make_cache(tmp_path, max_entries=2)
+  cache.set("a", 1)
+  clock.now += 120
+  cache.set("b", 2)
+  clock.now += 120
+  # Reading "a" makes "b" the least recently used entry.
+  assert cache.get("a") == 1
+  clock.now += 120
+  cache.set("c", 3)
+
+  assert cache.get("b") is None
+  assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+def test_max_bytes_evicts_until_the_cache_fits(tmp_path, clock):
+  cache = make_cache(tmp_path, max_bytes=2500)
+  for index in range(5):
+    cache.set(f"key-{index}", "x" * 1000)
+    clock.now += 120
+
+  assert [cache.get(f"key-{index}") is not None for index in range(5)] == [False, False, False, True, True]
+
+def test_writes_under_the_caps_do_not_evict(tmp_path, clock, monkeypatch):
+  cache = make_cache(tmp_path, max_entries=3)
+  evictions = []
+  evict = cache.evict
+  monkeypatch.setattr(cache, "evict", lambda: evictions.append(1) or evict())
+
+  for index in range(3):
+    cache.set(f"key-{index}", index)
+  assert evictions == []
+
+  cache.set("key-3", 3)
+  assert len(evictions) == 1 and rows(cache) == 3
+  # The eviction recounted the entries. A replaced entry is counted again, so this write
+  # recounts them without deleting anything.
+  cache.set("key-3", 4)
+  assert len(evictions) == 2 and rows(cache) == 3 and cache.get("key-3") == 4
+
+def test_totals_start_from_the_existing_file(tmp_path, clock):
+  cache = make_cache(tmp_path)
+  for index in range(4):
+    cache.set(f"key-{index}", index)
+  cache.close()
+
+  reopened = make_cache(tmp_path, max_entries=4)
+  reopened.set("key-4", 4)
+  assert rows(reopened) == 4
+
+def test_invalidate_deletes_a_namespace(tmp_path, clock):
+  cache = make_cache(tmp_path)
+  old_report = cache_keys.make_key("report", "v1", "Will it rain?")
+  new_report = cache_keys.make_key("report", "v2", "Will it rain?")
+  prediction = cache_keys.make_key("prediction", "v1", "report", "Will it rain?")
+  for key in (old_report, new_report, prediction):
+    cache.set(key, key)
+
+  assert cache.invalidate("report", keep_version="v2") == 1
+  assert cache.get(old_report) is None and cache.get(new_report) == new_report
+  assert cache.invalidate("report") == 1
+  assert cache.get(prediction) == prediction
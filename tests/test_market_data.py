@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from py_clob_client.utilities import parse_raw_orderbook_summary
+
+import market_data
+import replay_server
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SESSION = os.path.join(DATA_DIR, "market_channel_session.jsonl")
+
+def rest_books():
+  with open(os.path.join(DATA_DIR, "market_channel_rest_books.json")) as f:
+    return {token_id: parse_raw_orderbook_summary(raw) for token_id, raw in json.load(f).items()}
+
+class RestClient:
+  """Answers the stream's REST resyncs with the books at the end of the session."""
+
+  def __init__(self):
+    self.books = rest_books()
+    self.requested = []
+
+  def get_order_books(self, params):
+    self.requested.extend(param.token_id for param in params)
+    return [self.books[param.token_id] for param in params]
+
+  def get_order_book(self, token_id):
+    self.requested.append(token_id)
+    return self.books[token_id]
+
+def levels(book):
+  return ([(level.price, level.size) for level in book.bids], [(level.price, level.size) for level in book.asks])
+
+def replay(messages):
+  client = RestClient()
+  server = replay_server.ReplayServer(messages).start()
+  # A short ping interval lets the websocket thread notice the stop sooner.
+  stream = market_data.OrderBookStream(client, list(client.books), url=server.url, ping_interval=1)
+  stream.start()
+  try:
+    assert stream.wait_ready(timeout=10) == len(client.books)
+    deadline = time.monotonic() + 10
+    while stream.stats["messages"] < len(messages) and time.monotonic() < deadline:
+      time.sleep(0.01)
+  finally:
+    stream.stop()
+    server.stop()
+  return stream, client
+
+def test_clean_session_matches_rest_without_resyncs():
+  messages = replay_server.load_recording(SESSION)
+  stream, client = replay(messages)
+  assert stream.stats["messages"] == len(messages)
+  assert stream.stats["resyncs"] == 0
+  assert stream.stats["hash_mismatches"] == 0
+  assert stream.stats["unverified_hashes"] == 0
+  assert client.requested == []
+  snapshots = stream.snapshots()
+  for token_id, book in client.books.items():
+    assert levels(snapshots[token_id]) == levels(book)
+    assert stream.view(token_id).best_ask() == min(float(level.price) for level in book.asks)
+  # The metadata events are applied, but they are not part of the market channel hashes.
+  assert all(book.hash_fields == "book" for book in stream._books.values())
+  assert {snapshot.tick_size for snapshot in snapshots.values()} == {None, "0.001"}
+
+def test_dropped_level_is_caught_by_the_hash_and_resynced():
+  messages = replay_server.load_recording(SESSION)
+  # Drop one level change from the middle of the session.
+  index, (t, raw) = next((i, m) for i, m in enumerate(messages) if i > 2 and '"price_change"' in m[1])
+  event = json.loads(raw)
+  dropped = event["price_changes"][0]
+  event["price_changes"][0] = dict(dropped, size=str(float(dropped["size"]) + 1))
+  messages[index] = (t, json.dumps(event))
+
+  stream, client = replay(messages)
+  assert stream.stats["hash_mismatches"] == 1
+  assert stream.stats["resyncs"] == 1
+  assert client.requested == [dropped["asset_id"]]
+  # Later changes apply on top of the resynced book, which already holds them, so the book
+  # still ends up as REST has it.
+  snapshots = stream.snapshots()
+  for token_id, book in client.books.items():
+    assert levels(snapshots[token_id]) == levels(book)
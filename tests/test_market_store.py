@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from py_clob_client.clob_types import OrderBookSummary, OrderSummary
+
+import market_store
+
+def book(bids=(), asks=()):
+  return OrderBookSummary(bids=[OrderSummary(price=str(price), size="10") for price in bids],
+                          asks=[OrderSummary(price=str(price), size="10") for price in asks])
+
+def market(condition_id, hours=12, tags=("Politics",)):
+  end = datetime.now(timezone.utc) + timedelta(hours=hours)
+  return {"condition_id": condition_id, "end_date_iso": end.isoformat(), "tags": list(tags), "active": True,
+          "closed": False, "tokens": [{"token_id": f"{condition_id}-yes"}, {"token_id": f"{condition_id}-no"}]}
+
+def test_spread_screen():
+  store = market_store.MarketStore({"a": market("a"), "b": market("b", hours=40), "c": market("c", tags=["Sports"])})
+  store.update_books({
+    "a-yes": book(bids=[0.40, 0.48], asks=[0.50, 0.55]), "a-no": book(bids=[0.45], asks=[0.60]),
+    "b-yes": book(bids=[0.30], asks=[0.31]), "c-yes": book(bids=[0.30], asks=[0.31])})
+
+  assert store.spreads["a"] == pytest.approx(0.02)
+  assert store.query(end_after=timedelta(hours=6), end_before=timedelta(hours=30), exclude_tags=["Sports"],
+                     max_spread=0.03) == ["a"]
+
+def test_spread_follows_the_current_books():
+  store = market_store.MarketStore({"a": market("a")})
+  store.update_books({"a-yes": book(bids=[0.48], asks=[0.50]), "a-no": book(bids=[0.40], asks=[0.60])})
+  assert store.query(max_spread=0.03) == ["a"]
+
+  # The tight book widens: the market's spread is now its tightest current book's.
+  store.update_books({"a-yes": book(bids=[0.40], asks=[0.50])})
+  assert store.spreads["a"] == pytest.approx(0.10)
+  assert store.query(max_spread=0.03) == []
+
+  # With no two-sided book left, the market has no spread.
+  store.update_books({"a-yes": book(bids=[0.40]), "a-no": None})
+  assert "a" not in store.spreads
+  assert store.query(max_spread=1.0) == []
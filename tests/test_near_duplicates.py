@@ -0,0 +1,38 @@
+import pytest
+
+import near_duplicates
+
+DESCRIPTION = "Question: Will the Fed cut rates in June?\nDescription and Rules: Resolves Yes if the FOMC lowers the target range."
+
+def test_exact_repeats_that_all_fail_keep_their_errors():
+  index = near_duplicates.ReportReuseIndex()
+  assert index.claim(DESCRIPTION) == (None, None)
+  assert index.claim(DESCRIPTION) == (None, None)
+
+  index.resolve(DESCRIPTION, error=TimeoutError("first"))
+  # The first failure forgot the description; the second caller's failure is its own to raise.
+  index.resolve(DESCRIPTION, error=TimeoutError("second"))
+
+  # The next caller claims the description again.
+  assert index.claim(DESCRIPTION) == (None, None)
+
+def test_near_duplicates_wait_for_the_first_report():
+  index = near_duplicates.ReportReuseIndex(threshold=0.5)
+  assert index.claim(DESCRIPTION) == (None, None)
+  future, match_similarity = index.claim(DESCRIPTION.replace("June", "July"))
+  assert match_similarity >= 0.5
+
+  index.resolve(DESCRIPTION, "report")
+  index.resolve(DESCRIPTION, "report of an exact repeat")
+
+  assert future.result(timeout=1) == "report"
+
+def test_near_duplicates_see_the_failure():
+  index = near_duplicates.ReportReuseIndex(threshold=0.5)
+  index.claim(DESCRIPTION)
+  future, _ = index.claim(DESCRIPTION.replace("June", "July"))
+
+  index.resolve(DESCRIPTION, error=TimeoutError("report timed out"))
+
+  with pytest.raises(TimeoutError):
+    future.result(timeout=1)
@@ -0,0 +1,143 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from py_clob_client.client import ClobClient
+
+import orderbooks
+
+def raw_book(token_id):
+  return {
+    "market": "0xmarket", "asset_id": token_id, "timestamp": "1700000000000", "hash": "0xhash",
+    "bids": [{"price": "0.4", "size": "10"}, {"price": "0.45", "size": "5"}],
+    "asks": [{"price": "0.55", "size": "7"}, {"price": "0.5", "size": "3"}],
+    "min_order_size": "5", "tick_size": "0.01", "neg_risk": False, "last_trade_price": "0.5",
+  }
+
+class FakeClob:
+  """Serves `POST /books` and `GET /book` for the tokens in `books`.
+
+  Args:
+      books (dict): token_id to raw book. Other tokens have no book.
+      books_status (int): Status of every `POST /books`, e.g. 404 for a server without it.
+      failing_tokens (set): A `POST /books` for a batch holding one of these answers 500.
+      flaky (dict): token_id to the number of `GET /book` calls that answer 503 first."""
+
+  def __init__(self, books, books_status=200, failing_tokens=(), flaky=None):
+    self.books = books
+    self.books_status = books_status
+    self.failing_tokens = set(failing_tokens)
+    self.flaky = dict(flaky or {})
+    self.requests = []
+    self._lock = threading.Lock()
+    self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+  @property
+  def host(self):
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def _handler(self):
+    fake = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def log_message(self, format, *args):
+        pass
+
+      def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def do_POST(self):
+        token_ids = [p["token_id"] for p in json.loads(self.rfile.read(int(self.headers["Content-Length"])))]
+        with fake._lock:
+          fake.requests.append(("POST", urlparse(self.path).path, token_ids))
+        if urlparse(self.path).path != "/books" or fake.books_status != 200:
+          self._send(fake.books_status if fake.books_status != 200 else 404, {"error": "not found"})
+        elif fake.failing_tokens & set(token_ids):
+          self._send(500, {"error": "internal"})
+        else:
+          self._send(200, [fake.books[t] for t in token_ids if t in fake.books])
+
+      def do_GET(self):
+        url = urlparse(self.path)
+        token_id = parse_qs(url.query).get("token_id", [None])[0]
+        with fake._lock:
+          fake.requests.append(("GET", url.path, [token_id]))
+          flaky = fake.flaky.get(token_id, 0)
+          if flaky:
+            fake.flaky[token_id] = flaky - 1
+        if url.path != "/book" or token_id not in fake.books:
+          self._send(404, {"error": "No orderbook exists for the requested token id"})
+        elif flaky:
+          self._send(503, {"error": "unavailable"})
+        else:
+          self._send(200, fake.books[token_id])
+
+    return Handler
+
+  def calls(self, method):
+    return [request for request in self.requests if request[0] == method]
+
+@pytest.fixture
+def serve():
+  servers = []
+
+  def start(*args, **kwargs):
+    servers.append(FakeClob(*args, **kwargs))
+    return servers[-1], ClobClient(servers[-1].host)
+  yield start
+  for server in servers:
+    server.stop()
+
+TOKENS = [f"t{i}" for i in range(120)]
+
+def test_fetches_in_batches(serve):
+  server, client = serve({t: raw_book(t) for t in TOKENS})
+  books = orderbooks.fetch_order_books(client, TOKENS + TOKENS[:5], batch_size=50, max_workers=4)
+  assert sorted(books) == sorted(TOKENS)
+  assert sorted(len(tokens) for _, _, tokens in server.calls("POST")) == [20, 50, 50]
+  assert server.calls("GET") == []
+  book = books["t7"]
+  assert book.asset_id == "t7"
+  assert [(level.price, level.size) for level in book.asks] == [("0.55", "7"), ("0.5", "3")]
+  assert book.tick_size == "0.01"
+
+def test_falls_back_to_single_token_requests_without_batch_endpoint(serve):
+  server, client = serve({t: raw_book(t) for t in TOKENS[:30]}, books_status=404)
+  fetcher = orderbooks.OrderBookFetcher(client, batch_size=10, max_workers=4, retries=1, backoff_seconds=0)
+  books = fetcher.fetch(TOKENS[:30])
+  assert sorted(books) == sorted(TOKENS[:30])
+  assert not fetcher.batch_supported
+  assert sorted(tokens[0] for _, _, tokens in server.calls("GET")) == sorted(TOKENS[:30])
+  # Later fetches go straight to the single-token endpoint.
+  posts = len(server.calls("POST"))
+  assert sorted(fetcher.fetch(TOKENS[:3])) == TOKENS[:3]
+  assert len(server.calls("POST")) == posts
+
+def test_partial_failure(serve):
+  tokens = TOKENS[:20]
+  books = {t: raw_book(t) for t in tokens if t != "t3"}
+  server, client = serve(books, failing_tokens={"t12"}, flaky={"t15": 1})
+  fetcher = orderbooks.OrderBookFetcher(client, batch_size=10, max_workers=4, retries=2, backoff_seconds=0)
+  result = fetcher.fetch(tokens)
+  # t3 has no book: the batch leaves it out. The batch holding t12 keeps failing, so its tokens
+  # are fetched one by one, and t15's 503 is retried.
+  assert sorted(result) == sorted(t for t in tokens if t != "t3")
+  assert fetcher.batch_supported
+  failed_batch = TOKENS[10:20]
+  assert [tokens for _, _, tokens in server.calls("POST")].count(failed_batch) == 3
+  single = [tokens[0] for _, _, tokens in server.calls("GET")]
+  assert sorted(set(single)) == sorted(failed_batch)
+  assert single.count("t15") == 2
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+import prediction_daemon
+import prediction_pipeline
+
+class FakePipeline:
+  """Stands in for the report and analysis calls of `prediction_pipeline`."""
+
+  def __init__(self, update=None, gate=None):
+    self.update = update
+    self.gate = gate
+    self.calls = []
+
+  def create_report(self, description, cache=None, reuse_index=None):
+    self.calls.append("create_report")
+    if self.gate is not None:
+      self.gate.wait(5)
+    return f"report of {description}"
+
+  def write_report(self, description):
+    self.calls.append("write_report")
+    return f"full report of {description}"
+
+  def update_report(self, report, description, written_at):
+    self.calls.append(("update_report", written_at.timestamp()))
+    return self.update
+
+  def create_prediction_from_report(self, report, description, cache=None):
+    self.calls.append("create_prediction_from_report")
+    return {"report": report, "probability": 0.6}
+
+@pytest.fixture
+def pipeline(monkeypatch):
+  fake = FakePipeline()
+  for name in ("create_report", "write_report", "update_report", "create_prediction_from_report"):
+    monkeypatch.setattr(prediction_pipeline, name, getattr(fake, name))
+  return fake
+
+def make_daemon(**kwargs):
+  return prediction_daemon.PredictionDaemon(None, None, **kwargs)
+
+def test_research_writes_a_report_for_a_new_market(pipeline):
+  entry, prediction, kind = make_daemon().research("Will it rain?", None)
+
+  assert kind == "new_reports"
+  assert pipeline.calls == ["create_report", "create_prediction_from_report"]
+  assert entry["report"] == "report of Will it rain?"
+  assert entry["written_at"] == entry["full_at"] == entry["checked_at"]
+  assert prediction["report"] == entry["report"]
+
+def test_research_keeps_the_prediction_when_nothing_changed(pipeline):
+  written_at = time.time() - 3600
+  previous = {"report": "old", "description": "Will it rain?", "written_at": written_at, "full_at": written_at,
+              "checked_at": written_at}
+
+  entry, prediction, kind = make_daemon().research("Will it rain?", previous)
+
+  assert kind == "unchanged"
+  assert prediction is None
+  # The update asked about the developments since the report was written, not since it was checked.
+  assert pipeline.calls == [("update_report", pytest.approx(written_at))]
+  assert entry["report"] == "old" and entry["written_at"] == written_at
+  assert entry["checked_at"] > written_at
+
+def test_research_analyses_an_updated_report(pipeline):
+  pipeline.update = "old, and news"
+  written_at = time.time() - 3600
+  previous = {"report": "old", "description": "Will it rain?", "written_at": written_at, "full_at": written_at,
+              "checked_at": written_at}
+
+  entry, prediction, kind = make_daemon().research("Will it rain?", previous)
+
+  assert kind == "updates"
+  assert entry["report"] == prediction["report"] == "old, and news"
+  assert entry["written_at"] > written_at and entry["full_at"] == written_at
+
+def test_research_rewrites_a_report_after_full_report_hours(pipeline):
+  written_at = time.time() - 1800
+  previous = {"report": "old", "description": "Will it rain?", "written_at": written_at,
+              "full_at": time.time() - 3 * 3600, "checked_at": written_at}
+  daemon = make_daemon(policy=prediction_daemon.ResearchPolicy(full_report_hours=2))
+
+  entry, prediction, kind = daemon.research("Will it rain?", previous)
+
+  assert kind == "new_reports"
+  assert pipeline.calls == ["write_report", "create_prediction_from_report"]
+  assert entry["full_at"] == entry["written_at"] > written_at
+
+def test_run_drops_research_of_a_market_synced_away(pipeline, monkeypatch):
+  pipeline.gate = threading.Event()
+  daemon = make_daemon()
+
+  def sync():
+    daemon.markets = {"0xa": {}}
+    daemon.descriptions = {"0xa": "Will it rain?"}
+    daemon.queue.schedule("0xa", time.time())
+    daemon._last_sync = time.time()
+
+  monkeypatch.setattr(daemon, "sync", sync)
+  monkeypatch.setattr(daemon, "render", lambda top: None)
+  errors = []
+
+  def run():
+    try:
+      daemon.run(idle_seconds=0.05)
+    except Exception as e:
+      errors.append(e)
+
+  thread = threading.Thread(target=run)
+  thread.start()
+  deadline = time.time() + 5
+  while "0xa" not in daemon._running and time.time() < deadline:
+    time.sleep(0.01)
+  # The next sync drops the market while its research is in flight.
+  daemon.markets = {}
+  daemon.descriptions = {}
+  pipeline.gate.set()
+  while daemon._running and time.time() < deadline:
+    time.sleep(0.01)
+  time.sleep(0.1)
+  daemon.stop()
+  thread.join(5)
+
+  assert not thread.is_alive()
+  assert errors == []
+  assert daemon.reports == {} and daemon.predictions == {}
+  assert "0xa" not in daemon.queue
+
+def test_run_survives_a_failed_sync(pipeline, monkeypatch):
+  daemon = make_daemon(sync_hours=0.01 / 3600)
+  syncs = []
+
+  def sync():
+    syncs.append(time.time())
+    if len(syncs) == 1:
+      raise ConnectionError("Gamma is down")
+    daemon.stop()
+
+  monkeypatch.setattr(daemon, "sync", sync)
+  monkeypatch.setattr(daemon, "render", lambda top: None)
+  thread = threading.Thread(target=daemon.run, kwargs={"idle_seconds": 0.05})
+  thread.start()
+  thread.join(5)
+
+  assert not thread.is_alive()
+  assert len(syncs) == 2
@@ -0,0 +1,155 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+import requests
+from google.api_core import exceptions as google_exceptions
+
+import prediction_parser
+import prediction_pipeline
+import region_router
+
+def chunk(text):
+  return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+          "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 2, "trafficType": "ON_DEMAND"},
+          "createTime": "2025-01-01T00:00:00Z"}
+
+class FakeVertex:
+  """Serves generateContent and streamGenerateContent under `/<region>/models/<model>`.
+
+  Args:
+      chunks (list): Text of the streamed chunks. A non-streamed call answers their concatenation.
+      failing (dict): Region to the HTTP status every call to it answers."""
+
+  def __init__(self, chunks, failing=None):
+    self.chunks = chunks
+    self.failing = dict(failing or {})
+    self.requests = []
+    self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+  @property
+  def endpoint_template(self):
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}/{{region}}/projects/{{project}}/models/{{model}}"
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def _handler(self):
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, format, *args):
+        pass
+
+      def do_POST(self):
+        url = urlparse(self.path)
+        region = url.path.split("/")[1]
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append((region, url.path.rsplit(":", 1)[1], body))
+        if region in server.failing:
+          data = json.dumps({"error": {"code": server.failing[region], "message": f"{region} is busy"}}).encode()
+          self.send_response(server.failing[region])
+          self.send_header("Content-Length", str(len(data)))
+          self.end_headers()
+          self.wfile.write(data)
+          return
+        if url.path.endswith(":generateContent"):
+          data = json.dumps(chunk("".join(server.chunks))).encode()
+          self.send_response(200)
+          self.send_header("Content-Type", "application/json")
+          self.send_header("Content-Length", str(len(data)))
+          self.end_headers()
+          self.wfile.write(data)
+          return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+          for text in server.chunks:
+            self.wfile.write(f"data: {json.dumps(chunk(text))}\r\n\r\n".encode())
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+          pass
+        self.close_connection = True
+
+    return Handler
+
+@pytest.fixture
+def vertex():
+  servers = []
+
+  def start(chunks, failing=None):
+    servers.append(FakeVertex(chunks, failing))
+    return servers[-1]
+  yield start
+  for server in servers:
+    server.stop()
+
+def make_router(server, regions=("us-east1", "europe-west4")):
+  return region_router.RegionRouter(
+    list(regions), "test-project", session=requests.Session(), endpoint_template=server.endpoint_template)
+
+def in_flight(router):
+  return {region: stats.in_flight for region, stats in router._stats.items()}
+
+def test_generate_content_sends_the_config_and_reads_the_response(vertex):
+  server = vertex(["{\"probability\": ", "0.4}"])
+  router = make_router(server, regions=["us-east1"])
+
+  response = router.call("gemini-test", lambda client: client.generate_content(
+    "gemini-test", "Will it rain?", prediction_pipeline.TRIAGE_CONFIG, "Be brief."))
+
+  assert response.text == "{\"probability\": 0.4}"
+  assert response.usage_metadata.candidates_token_count == 2
+  region, method, body = server.requests[0]
+  assert (region, method) == ("us-east1", "generateContent")
+  assert body["system_instruction"] == {"parts": [{"text": "Be brief."}]}
+  assert body["generation_config"]["response_schema"]["type"] == "OBJECT"
+  assert router.stats()["us-east1"]["calls"] == 1
+  assert in_flight(router) == {"us-east1": 0}
+
+def test_call_fails_over_from_a_throttled_region(vertex):
+  server = vertex(["ok"], failing={"us-east1": 429})
+  router = make_router(server)
+
+  for _ in range(4):
+    assert router.call("gemini-test", lambda client: client.generate_content("gemini-test", "hi")).text == "ok"
+
+  stats = router.stats()
+  assert stats["us-east1"]["errors"] >= 1 and stats["us-east1"]["in_cooldown"]
+  assert stats["europe-west4"]["errors"] == 0 and stats["europe-west4"]["calls"] == 4
+  assert in_flight(router) == {"us-east1": 0, "europe-west4": 0}
+
+def test_request_errors_are_not_failed_over(vertex):
+  server = vertex(["ok"], failing={"us-east1": 400, "europe-west4": 400})
+  router = make_router(server)
+
+  with pytest.raises(google_exceptions.BadRequest):
+    router.call("gemini-test", lambda client: client.generate_content("gemini-test", "hi"))
+  assert len(server.requests) == 1
+
+def test_streamed_analysis_releases_its_region(vertex, monkeypatch):
+  server = vertex(["Reasoning first.\n", "{\"probability\": 0.4, \"uncertainty\": ", "{}}", " trailing"])
+  router = make_router(server, regions=["us-east1"])
+  monkeypatch.setattr(prediction_pipeline, "gemini_router", router)
+  reservation = type("Reservation", (), {"record": lambda self, prompt_tokens, output_tokens: None})()
+
+  prediction_pipeline._stream_analysis("Will it rain?", reservation)
+  assert router.stats()["us-east1"]["calls"] == 1
+  assert in_flight(router) == {"us-east1": 0}
+
+  # A consumer that stops on an error of its own still frees the region's slot.
+  def interrupted(text):
+    raise KeyboardInterrupt
+  monkeypatch.setattr(prediction_parser, "parse_final_prediction", interrupted)
+  with pytest.raises(KeyboardInterrupt):
+    prediction_pipeline._stream_analysis("Will it rain?", reservation)
+  assert in_flight(router) == {"us-east1": 0}
@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+import stage_dag
+
+class Pipeline:
+  """A local three-stage pipeline: `catalog` once, `report` and `analyze` per market, `score` once.
+
+  Records the tasks it runs. Markets in `failing` fail their report."""
+
+  def __init__(self, catalog, failing=(), catalog_max_age_hours=None):
+    self.catalog = dict(catalog)
+    self.failing = set(failing)
+    self.catalog_max_age_hours = catalog_max_age_hours
+    self.ran = []
+    self._lock = threading.Lock()
+
+  def _ran(self, task):
+    with self._lock:
+      self.ran.append(task)
+
+  def load_catalog(self, inputs):
+    self._ran("catalog")
+    return dict(self.catalog)
+
+  def write_report(self, key, inputs):
+    self._ran(f"report/{key}")
+    if key in self.failing:
+      raise TimeoutError(f"report of {key} timed out")
+    return f"report on {inputs['question']}"
+
+  def analyze(self, key, inputs):
+    self._ran(f"analyze/{key}")
+    return len(inputs["report"])
+
+  def score(self, inputs):
+    self._ran("score")
+    return sorted(inputs["analyze"])
+
+  def stages(self):
+    return [
+      stage_dag.Stage("catalog", [], self.load_catalog, max_age_hours=self.catalog_max_age_hours),
+      stage_dag.Stage("report", ["catalog"], self.write_report, per_market=True,
+                      markets=lambda outputs: list(outputs["catalog"]),
+                      market_inputs=lambda key, outputs: {"question": outputs["catalog"][key]}, pool="reports"),
+      stage_dag.Stage("analyze", ["report"], self.analyze, per_market=True,
+                      market_inputs=lambda key, outputs: {"report": outputs["report"][key]}),
+      stage_dag.Stage("score", ["analyze"], self.score),
+    ]
+
+  def run(self, run_dir, resume=False):
+    self.ran = []
+    dag = stage_dag.StageDag(self.stages(), str(run_dir), resume=resume, pools={"reports": 2})
+    return dag, dag.run()
+
+CATALOG = {"a": "Will it rain?", "b": "Will it snow?", "c": "Will it hail?"}
+
+def test_a_failed_market_blocks_only_its_downstream_tasks(tmp_path):
+  pipeline = Pipeline(CATALOG, failing={"b"})
+
+  dag, outputs = pipeline.run(tmp_path)
+
+  assert "analyze/b" not in pipeline.ran
+  assert set(outputs["analyze"]) == {"a", "c"}
+  assert outputs["score"] == ["a", "c"]
+  assert dag.stats["report"]["failed"] == 1 and dag.stats["analyze"]["blocked"] == 1
+  assert list(dag.errors) == ["report/b"]
+
+def test_a_failed_stage_blocks_its_dependents(tmp_path):
+  pipeline = Pipeline(CATALOG)
+  pipeline.load_catalog = lambda inputs: 1 / 0
+
+  dag, outputs = pipeline.run(tmp_path)
+
+  assert outputs == {}
+  assert pipeline.ran == []
+  assert dag.stats["report"]["blocked"] == 1 and dag.stats["score"]["blocked"] == 1
+
+def test_resume_reruns_only_the_failed_task_and_its_dependents(tmp_path):
+  pipeline = Pipeline(CATALOG, failing={"b"})
+  pipeline.run(tmp_path)
+  pipeline.failing = set()
+
+  dag, outputs = pipeline.run(tmp_path, resume=True)
+
+  assert sorted(pipeline.ran) == ["analyze/b", "report/b", "score"]
+  assert outputs["score"] == ["a", "b", "c"]
+  assert (dag.stats["report"]["ran"], dag.stats["report"]["reused"]) == (1, 2)
+  assert dag.errors == {}
+
+  # A third run has nothing left to do.
+  pipeline.run(tmp_path, resume=True)
+  assert pipeline.ran == []
+
+def test_changed_inputs_invalidate_a_checkpoint(tmp_path):
+  pipeline = Pipeline(CATALOG)
+  pipeline.run(tmp_path)
+  pipeline.catalog["a"] = "Will it rain on Sunday?"
+  # An expired catalog is fetched again and brings the changed question.
+  pipeline.catalog_max_age_hours = 0
+
+  _, outputs = pipeline.run(tmp_path, resume=True)
+
+  assert sorted(pipeline.ran) == ["analyze/a", "catalog", "report/a", "score"]
+  assert outputs["report"]["a"] == "report on Will it rain on Sunday?"
+
+def test_an_expired_checkpoint_is_redone(tmp_path, monkeypatch):
+  pipeline = Pipeline(CATALOG, catalog_max_age_hours=1)
+  pipeline.run(tmp_path)
+
+  # Within its maximum age, the catalog is reused.
+  pipeline.run(tmp_path, resume=True)
+  assert pipeline.ran == []
+
+  later = time.time() + 2 * 3600
+  monkeypatch.setattr(stage_dag.time, "time", lambda: later)
+  dag, _ = pipeline.run(tmp_path, resume=True)
+
+  # The refetched catalog is unchanged, so every market's checkpoints are still valid.
+  assert pipeline.ran == ["catalog"]
+  assert dag.stats["report"]["reused"] == 3
+
+def test_the_journal_records_every_task(tmp_path):
+  pipeline = Pipeline(CATALOG, failing={"b"})
+  pipeline.run(tmp_path)
+
+  with open(tmp_path / "journal.jsonl") as f:
+    entries = {entry["task"]: entry["status"] for entry in map(json.loads, f)}
+
+  assert entries == {"catalog": "done", "report/a": "done", "report/b": "failed", "report/c": "done",
+                     "analyze/a": "done", "analyze/c": "done", "score": "done"}
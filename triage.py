@@ -0,0 +1,209 @@
+"""Cheap triage that keeps markets without a realistic edge out of the expensive stages.
+
+A market is assessed from its order books and metadata alone (plus, optionally, a quick
+probability from a fast model) before any report is written. The market price is taken as
+the prior, and the full pipeline is assumed to move it by at most `max_logit_move` in
+log-odds. That gives the best-case probability range, and so the best-case edge of buying
+either outcome at its best ask. A coin-flip market can move a long way in probability, a
+0.99/0.01 market hardly at all. Markets whose best-case edge does not beat fees plus
+`min_edge`, or that are too thin, too close to closing or too quiet, are skipped.
+"""
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import rate_limiter
+
+def _logit(p):
+  p = min(max(p, 1e-6), 1 - 1e-6)
+  return math.log(p / (1 - p))
+
+def _sigmoid(x):
+  return 1 / (1 + math.exp(-x))
+
+def _hours_to_close(end_date_iso, now):
+  if not isinstance(end_date_iso, str) or not end_date_iso:
+    return None
+  try:
+    end_date = datetime.fromisoformat(end_date_iso.replace('Z', '+00:00'))
+  except ValueError:
+    return None
+  return (end_date - now).total_seconds() / 3600
+
+def _side(levels):
+  return [(float(level.price), float(level.size)) for level in levels or []]
+
+def market_features(market, order_books, now=None, volume=None):
+  """Returns the book-derived features of a binary market used by `Triage`.
+
+  Args:
+      market (dict): CLOB market.
+      order_books (dict): Maps token_id to OrderBookSummary (or a streamed book view).
+      volume (float): Traded volume, e.g. Gamma's `volumeNum`, if known.
+
+  Returns:
+      dict: `yes_ask`, `no_ask`, `yes_bid`, `mid` (Yes probability implied by the book),
+        `spread`, `depth_dollars` (USDC resting on both ask ladders), `hours_to_close` and
+        `volume`. Missing values are None."""
+  now = now or datetime.now(timezone.utc)
+  asks = {}
+  bids = {}
+  depth_dollars = 0.0
+  for token in market.get('tokens', []):
+    book = order_books.get(token.get('token_id'))
+    outcome = 'no' if token.get('outcome') == 'No' else 'yes'
+    if book is None:
+      continue
+    token_asks = _side(book.asks)
+    token_bids = _side(book.bids)
+    asks[outcome] = min(price for price, _ in token_asks) if token_asks else None
+    bids[outcome] = max(price for price, _ in token_bids) if token_bids else None
+    depth_dollars += sum(price * size for price, size in token_asks)
+
+  yes_ask, no_ask = asks.get('yes'), asks.get('no')
+  # A No bid at b is a Yes ask at 1 - b and the other way around, so use the tighter of the two.
+  yes_bid = max([b for b in (bids.get('yes'), None if no_ask is None else 1 - no_ask) if b is not None], default=None)
+  best_yes_ask = min([a for a in (yes_ask, None if bids.get('no') is None else 1 - bids['no']) if a is not None],
+                     default=None)
+  mid = spread = None
+  if yes_bid is not None and best_yes_ask is not None:
+    mid = (yes_bid + best_yes_ask) / 2
+    spread = best_yes_ask - yes_bid
+  return {
+    "yes_ask": yes_ask,
+    "no_ask": no_ask,
+    "yes_bid": yes_bid,
+    "mid": mid,
+    "spread": spread,
+    "depth_dollars": depth_dollars,
+    "hours_to_close": _hours_to_close(market.get('end_date_iso'), now),
+    "volume": volume,
+  }
+
+class Triage:
+  """Decides which markets are worth a report and an analysis.
+
+  Args:
+      fee (float): Trading cost per share, in probability points.
+      min_edge (float): Best-case edge a market needs on top of the fee.
+      max_logit_move (float): How far the full pipeline is assumed to move the market's
+        probability, in log-odds. 1.0 turns 0.50 into at most 0.73 and 0.95 into 0.98.
+      min_depth_dollars (float): Minimum USDC on the ask ladders.
+      min_hours_to_close (float): Markets closing sooner are skipped.
+      min_volume (float): Minimum traded volume. Markets with unknown volume pass.
+      quick_probability (callable): Optional `description -> probability or None` from a fast
+        model. When given, it replaces the book mid as the prior."""
+
+  def __init__(self, fee=0.0, min_edge=0.03, max_logit_move=1.0, min_depth_dollars=10.0,
+               min_hours_to_close=0.25, min_volume=None, quick_probability=None):
+    self.fee = fee
+    self.min_edge = min_edge
+    self.max_logit_move = max_logit_move
+    self.min_depth_dollars = min_depth_dollars
+    self.min_hours_to_close = min_hours_to_close
+    self.min_volume = min_volume
+    self.quick_probability = quick_probability
+
+  def assess(self, market, order_books, description=None, volume=None, now=None):
+    """Assesses one market.
+
+    Returns:
+        dict: The `market_features` plus `prior`, `best_case_edge`, `keep`, `reasons` (why
+          the market was skipped, empty when kept) and `skip_codes` (one of no_asks, thin,
+          closing, low_volume or no_edge per reason)."""
+    features = market_features(market, order_books, now=now, volume=volume)
+    codes = []
+    reasons = []
+
+    def skip(code, reason):
+      codes.append(code)
+      reasons.append(reason)
+
+    if features["yes_ask"] is None and features["no_ask"] is None:
+      skip("no_asks", "no asks")
+    if features["depth_dollars"] < self.min_depth_dollars:
+      skip("thin", f"depth ${features['depth_dollars']:.0f} < ${self.min_depth_dollars:.0f}")
+    hours = features["hours_to_close"]
+    if hours is not None and hours < self.min_hours_to_close:
+      skip("closing", f"closes in {hours * 60:.0f} min")
+    if self.min_volume is not None and volume is not None and volume < self.min_volume:
+      skip("low_volume", f"volume {volume:.0f} < {self.min_volume:.0f}")
+
+    prior = features["mid"]
+    if self.quick_probability is not None and description and not reasons:
+      quick = self.quick_probability(description)
+      if quick is not None:
+        prior = quick
+    features["prior"] = prior
+
+    best_case_edge = None
+    if prior is not None:
+      high = _sigmoid(_logit(prior) + self.max_logit_move)
+      low = _sigmoid(_logit(prior) - self.max_logit_move)
+      edges = []
+      if features["yes_ask"] is not None:
+        edges.append(high - features["yes_ask"] - self.fee)
+      if features["no_ask"] is not None:
+        edges.append((1 - low) - features["no_ask"] - self.fee)
+      best_case_edge = max(edges) if edges else None
+    features["best_case_edge"] = best_case_edge
+    if not reasons and best_case_edge is not None and best_case_edge < self.min_edge:
+      skip("no_edge", f"best-case edge {best_case_edge:.3f} < {self.min_edge:.3f}")
+    features["skip_codes"] = codes
+    features["reasons"] = reasons
+    features["keep"] = not reasons
+    return features
+
+  def split(self, markets, order_books, descriptions=None, volumes=None, max_workers=8):
+    """Triages many markets.
+
+    Args:
+        markets (dict): Maps condition_id to CLOB market.
+        descriptions (dict): condition_id to description, for `quick_probability`.
+        volumes (dict): condition_id to traded volume.
+        max_workers (int): Concurrent `quick_probability` calls.
+
+    Returns:
+        tuple: (kept condition ids, dict of skipped condition_id to assessment). Markets whose
+          `quick_probability` call hit the daily budget are kept without triage."""
+    now = datetime.now(timezone.utc)
+    descriptions = descriptions or {}
+    volumes = volumes or {}
+    over_budget = []
+
+    def assess(condition_id):
+      try:
+        return self.assess(markets[condition_id], order_books, descriptions.get(condition_id),
+                           volumes.get(condition_id), now=now)
+      except rate_limiter.BudgetExceeded as e:
+        over_budget.append(e)
+        features = market_features(markets[condition_id], order_books, now=now, volume=volumes.get(condition_id))
+        features.update(prior=None, best_case_edge=None, skip_codes=[], reasons=[], keep=True)
+        return features
+
+    if self.quick_probability is None:
+      assessments = map(assess, markets)
+    else:
+      with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="triage") as pool:
+        assessments = list(pool.map(assess, markets))
+    if over_budget:
+      print(f"Error: {over_budget[0]}. Kept {len(over_budget)} markets without triage.")
+    kept = []
+    skipped = {}
+    for condition_id, assessment in zip(markets, assessments):
+      if assessment["keep"]:
+        kept.append(condition_id)
+      else:
+        skipped[condition_id] = assessment
+    return kept, skipped
+
+def skip_report(markets, skipped, limit=20):
+  """Prints how many markets were skipped per reason and the first `limit` of them."""
+  codes = Counter(code for assessment in skipped.values() for code in assessment["skip_codes"])
+  print(f"Triage skipped {len(skipped)} markets:")
+  for code, count in codes.most_common():
+    print(f"  {count:5d}  {code}")
+  for condition_id, assessment in list(skipped.items())[:limit]:
+    question = markets[condition_id].get('question', condition_id)
+    print(f"  - {question[:70]}: {'; '.join(assessment['reasons'])}")